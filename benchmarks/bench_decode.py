@@ -0,0 +1,151 @@
+"""Decode + preprocess benchmark for the DECODE_BACKENDs in server/decode.py.
+
+Times bytes -> normalized [V, 3, 224, 224] model input per image, the part
+of a request that runs before the forward pass, and reports it per
+megapixel so phone photos of different sizes compare. Each backend is
+also checked against the `pil` reference input (max / mean abs difference
+in normalized units). CPU-only and offline: synthetic JPEGs (and a PNG
+copy of each) unless --image-dir adds real photos.
+
+Example:
+    python benchmarks/bench_decode.py --views 3 --threads 1 --output decode.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+from bench_predictor import git_commit, parse_list, percentile_ms, sample_images, synthetic_images  # noqa: E402
+
+
+def png_copy(data: bytes) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(data)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def image_format(data: bytes) -> str:
+    return "png" if data.startswith(b"\x89PNG") else "jpeg"
+
+
+def bench_image(data: bytes, backend: str, views: list, warmup: int, iterations: int):
+    from server.decode import decode_image, preprocess
+
+    def run():
+        decoded, _ = decode_image(data, backend)
+        return preprocess([decoded], views)
+
+    for _ in range(warmup):
+        batch = run()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        batch = run()
+        latencies.append(time.perf_counter() - start)
+    return batch, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image decode + preprocess per backend")
+    parser.add_argument("--backends", default="pil,pil_draft,torchvision")
+    parser.add_argument("--views", type=int, default=3, help="TTA views built per image (1 = center only)")
+    parser.add_argument("--image-dir", default=None, help="Optional folder of sample images")
+    parser.add_argument("--max-images", type=int, default=8)
+    parser.add_argument("--no-png", action="store_true", help="Skip the PNG copies of the synthetic images")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write JSON results here (stdout otherwise)")
+    args = parser.parse_args()
+
+    import torch
+    import torchvision
+    from PIL import Image
+
+    from server.decode import DECODE_BACKENDS, VIEW_TRANSFORMS
+
+    backends = parse_list(args.backends)
+    unknown = set(backends) - set(DECODE_BACKENDS)
+    if unknown:
+        parser.error(f"Unknown backends: {sorted(unknown)}")
+    if "pil" not in backends:
+        backends.insert(0, "pil")
+
+    torch.set_num_threads(args.threads)
+    images = synthetic_images(args.seed)
+    if not args.no_png:
+        images += [png_copy(data) for data in images]
+    if args.image_dir:
+        images += sample_images(Path(args.image_dir), args.max_images)
+
+    views = list(range(min(args.views, len(VIEW_TRANSFORMS))))
+
+    results = []
+    for data in images:
+        width, height = Image.open(io.BytesIO(data)).size
+        megapixels = width * height / 1e6
+        reference = None
+        for backend in backends:
+            batch, latencies = bench_image(data, backend, views, args.warmup, args.iterations)
+            if reference is None:
+                reference = batch
+            diff = (batch - reference).abs()
+            result = {
+                "backend": backend,
+                "format": image_format(data),
+                "width": width,
+                "height": height,
+                "p50_ms": percentile_ms(latencies, 50),
+                "p95_ms": percentile_ms(latencies, 95),
+                "ms_per_mp": round(float(np.median(latencies)) * 1000 / megapixels, 3),
+                "max_abs_diff": round(float(diff.max()), 4),
+                "mean_abs_diff": round(float(diff.mean()), 5),
+            }
+            results.append(result)
+            print(
+                f"{result['format']:>4} {width}x{height} {backend:<12} p50={result['p50_ms']}ms "
+                f"({result['ms_per_mp']} ms/MP) max|diff|={result['max_abs_diff']}",
+                file=sys.stderr,
+            )
+
+    report = {
+        "meta": {
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torchvision": torchvision.__version__,
+            "pillow": Image.__version__,
+            "platform": platform.platform(),
+            "threads": args.threads,
+            "views": len(views),
+            "warmup": args.warmup,
+            "iterations": args.iterations,
+            "num_images": len(images),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Inference benchmark for DermSightPredictor.
+
+Sweeps backend, batch size, TTA, torch thread count and channels_last,
+running each configuration in a fresh process so peak RSS is per config.
+CPU-only and offline: without a checkpoint the model is randomly
+initialised from a fixed seed.
+
+Example:
+    python benchmarks/bench_predictor.py --batch-sizes 1,4 --threads 1,4 \
+        --output bench.json --baseline previous.json --max-regression 0.10
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+# Force CPU before torch is imported anywhere in this process tree
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+SYNTHETIC_SIZES = [(4032, 3024), (1920, 1080), (640, 480)]
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
+def _eager(predictor):
+    return predictor
+
+
+def _torchscript(predictor):
+    import torch
+
+    example = torch.zeros(1, 3, 224, 224)
+    if predictor.channels_last:
+        example = example.contiguous(memory_format=torch.channels_last)
+    with torch.no_grad():
+        traced = torch.jit.trace(predictor.model, example)
+    predictor.model = torch.jit.freeze(traced)
+    return predictor
+
+
+BACKENDS = {
+    "eager": _eager,
+    "torchscript": _torchscript,
+}
+
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def parse_bool_list(value):
+    return [item in {"on", "true", "1", "yes"} for item in parse_list(value, str.lower)]
+
+
+def synthetic_images(seed: int) -> list[bytes]:
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for width, height in SYNTHETIC_SIZES:
+        # Smooth noise compresses like a photo rather than like white noise
+        small = rng.integers(0, 256, size=(height // 32, width // 32, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def sample_images(image_dir: Path, limit: int) -> list[bytes]:
+    paths = sorted(p for p in image_dir.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    return [p.read_bytes() for p in paths[:limit]]
+
+
+def random_checkpoint(seed: int) -> str:
+    import torch
+
+    from server.model import DermSightModel
+
+    torch.manual_seed(seed)
+    handle = tempfile.NamedTemporaryFile(prefix="dermsight_random_", suffix=".pth", delete=False)
+    handle.close()
+    torch.save(DermSightModel().state_dict(), handle.name)
+    return handle.name
+
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 3)
+
+
+def run_config(config: dict, model_path: str, images: list[bytes], warmup: int, iterations: int) -> dict:
+    """Runs in a spawned worker: one configuration, one process."""
+    import torch
+
+    from server.model import DermSightPredictor
+
+    torch.set_num_threads(config["threads"])
+    torch.manual_seed(0)
+    predictor = DermSightPredictor(
+        model_path, use_tta=config["tta"], channels_last=config["channels_last"]
+    )
+    predictor = BACKENDS[config["backend"]](predictor)
+
+    batch_size = config["batch_size"]
+    batches = [
+        [images[(i * batch_size + j) % len(images)] for j in range(batch_size)]
+        for i in range(warmup + iterations)
+    ]
+
+    latencies = []
+    for step, batch in enumerate(batches):
+        start = time.perf_counter()
+        predictor.predict_batch([io.BytesIO(data) for data in batch])
+        elapsed = time.perf_counter() - start
+        if step >= warmup:
+            latencies.append(elapsed)
+
+    total = sum(latencies)
+    return {
+        **config,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99),
+        "mean_ms": round(total / len(latencies) * 1000, 3),
+        "throughput_ips": round(batch_size * len(latencies) / total, 3),
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def config_key(result: dict) -> tuple:
+    return (
+        result["backend"],
+        result["batch_size"],
+        result["tta"],
+        result["threads"],
+        result["channels_last"],
+    )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_to_baseline(results: list[dict], baseline_path: Path, max_regression: float) -> list[str]:
+    baseline = json.loads(baseline_path.read_text())
+    previous = {config_key(r): r for r in baseline["results"]}
+    failures = []
+    for result in results:
+        before = previous.get(config_key(result))
+        if not before:
+            continue
+        change = result["p95_ms"] / before["p95_ms"] - 1.0
+        result["p95_change_vs_baseline"] = round(change, 4)
+        if change > max_regression:
+            failures.append(
+                f"{config_key(result)}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms (+{change:.1%})"
+            )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DermSightPredictor on CPU")
+    parser.add_argument("--model-path", default=None, help="Checkpoint; random weights if omitted or missing")
+    parser.add_argument("--image-dir", default=None, help="Optional folder of sample images")
+    parser.add_argument("--max-images", type=int, default=16)
+    parser.add_argument("--backends", default="eager", help=f"Comma list of {sorted(BACKENDS)}")
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--tta", default="on,off")
+    parser.add_argument("--threads", default=str(min(4, os.cpu_count() or 1)))
+    parser.add_argument("--channels-last", default="off,on")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write JSON results here (stdout otherwise)")
+    parser.add_argument("--baseline", default=None, help="Previous JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="Allowed p95 slowdown")
+    args = parser.parse_args()
+
+    backends = parse_list(args.backends)
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"Unknown backends: {sorted(unknown)}")
+
+    images = synthetic_images(args.seed)
+    if args.image_dir:
+        images += sample_images(Path(args.image_dir), args.max_images)
+
+    model_path = args.model_path
+    random_weights = not model_path or not Path(model_path).exists()
+    if random_weights:
+        print("No checkpoint found; using randomly initialised weights.", file=sys.stderr)
+        model_path = random_checkpoint(args.seed)
+
+    configs = [
+        {"backend": b, "batch_size": bs, "tta": tta, "threads": th, "channels_last": cl}
+        for b, bs, tta, th, cl in itertools.product(
+            backends,
+            parse_list(args.batch_sizes, int),
+            parse_bool_list(args.tta),
+            parse_list(args.threads, int),
+            parse_bool_list(args.channels_last),
+        )
+    ]
+
+    results = []
+    try:
+        for config in configs:
+            print(f"Running {config}...", file=sys.stderr)
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(
+                    run_config, config, model_path, images, args.warmup, args.iterations
+                ).result()
+            print(
+                f"  p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                f"throughput={result['throughput_ips']} img/s rss={result['peak_rss_mb']}MB",
+                file=sys.stderr,
+            )
+            results.append(result)
+    finally:
+        if random_weights:
+            os.remove(model_path)
+
+    import torch
+    import torchvision
+
+    report = {
+        "meta": {
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torchvision": torchvision.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model": "random" if random_weights else str(Path(args.model_path).name),
+            "seed": args.seed,
+            "warmup": args.warmup,
+            "iterations": args.iterations,
+            "num_images": len(images),
+        },
+        "results": results,
+    }
+
+    failures = []
+    if args.baseline:
+        failures = compare_to_baseline(results, Path(args.baseline), args.max_regression)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if failures:
+        print("Performance regressions vs baseline:", file=sys.stderr)
+        for failure in failures:
+            print(f"  {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Top-k query latency and recall of the similar-case index (server/similarity.py).
+
+Builds exact and IVF indexes over synthetic clustered embeddings (unit
+vectors around random centers, like lesion types) and reports, per case
+count and IVF nprobe: query p50/p95, recall@k of IVF against the exact
+result, IVF training time and the vector memory of each index.
+
+Queries take the endpoint's path: each excludes itself and keeps only cases
+created before it. `recent` queries come after the whole corpus, `uniform`
+ones at a random point of it, and `early` ones within its first 1%, where
+the filter rejects almost everything.
+
+Example:
+    python benchmarks/bench_similarity.py --sizes 10000,100000,300000 --nprobe 8,16,32 --output sim.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_predictor import git_commit, parse_list, percentile_ms  # noqa: E402
+
+
+def synthetic_embeddings(count: int, dim: int, clusters: int, spread: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 65536):
+        stop = min(count, start + 65536)
+        labels = rng.integers(0, clusters, stop - start)
+        vectors[start:stop] = centers[labels] + spread * rng.standard_normal((stop - start, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Round-trip through the fp16 storage format
+    return vectors.astype(np.float16).astype(np.float32)
+
+
+def query_positions(size: int, count: int, seed: int) -> dict:
+    """Creation time of each query per mix; corpus vector i was created at time i."""
+    rng = np.random.default_rng(seed + 1)
+    return {
+        "recent": np.full(count, float(size)),
+        "uniform": rng.uniform(0, size, count),
+        "early": rng.uniform(0, max(1.0, size / 100), count),
+    }
+
+
+def time_queries(index, queries, k, befores):
+    latencies, results = [], []
+    for i, (query, before) in enumerate(zip(queries, befores)):
+        start = time.perf_counter()
+        found = index.search(query, k, exclude={("query", i)}, before=before)
+        latencies.append(time.perf_counter() - start)
+        results.append([key for key, _ in found])
+    return latencies, results
+
+
+def recall(truth, found):
+    return float(np.mean([len(set(a) & set(b)) / len(a) if a else 1.0 for a, b in zip(truth, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark similar-case top-k search")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma list of case counts")
+    parser.add_argument("--dim", type=int, default=1408)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--spread", type=float, default=0.08, help="Per-case noise around its cluster center")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = about sqrt(N))")
+    parser.add_argument("--nprobe", default="8,16,32")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=1, help="BLAS threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write JSON results here (stdout otherwise)")
+    args = parser.parse_args()
+
+    # BLAS reads its thread count when numpy loads, so set it before importing the index
+    for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(args.threads)
+    from server.similarity import VectorIndex
+
+    results = []
+    for size in parse_list(args.sizes, int):
+        vectors = synthetic_embeddings(size + args.queries, args.dim, args.clusters, args.spread, args.seed)
+        corpus, queries = vectors[:size], vectors[size:]
+        mixes = query_positions(size, args.queries, args.seed)
+
+        exact = VectorIndex(args.dim, "exact")
+        for i, vector in enumerate(corpus):
+            exact.add(i, vector, float(i))
+        truth = {}
+        for mix, befores in mixes.items():
+            latencies, truth[mix] = time_queries(exact, queries, args.k, befores)
+            results.append({
+                "cases": size, "index": "exact", "nprobe": None, "queries": mix,
+                "p50_ms": percentile_ms(latencies, 50), "p95_ms": percentile_ms(latencies, 95),
+                "recall_at_k": 1.0, "vector_mb": round(corpus.nbytes / 2**20, 1),
+            })
+            print(f"{size:>8} exact          {mix:<8} p50={results[-1]['p50_ms']}ms "
+                  f"p95={results[-1]['p95_ms']}ms", file=sys.stderr)
+        del exact
+
+        ivf = VectorIndex(args.dim, "ivf")
+        for i, vector in enumerate(corpus):
+            ivf.add(i, vector, float(i))
+        start = time.perf_counter()
+        ivf.train(args.nlist)
+        train_s = time.perf_counter() - start
+        for nprobe in parse_list(args.nprobe, int):
+            ivf.nprobe = nprobe
+            for mix, befores in mixes.items():
+                latencies, found = time_queries(ivf, queries, args.k, befores)
+                results.append({
+                    "cases": size, "index": "ivf", "nprobe": nprobe, "queries": mix, "nlist": len(ivf.centroids),
+                    "p50_ms": percentile_ms(latencies, 50), "p95_ms": percentile_ms(latencies, 95),
+                    "recall_at_k": round(recall(truth[mix], found), 4), "train_s": round(train_s, 2),
+                    "vector_mb": round(corpus.nbytes / 2**20, 1),
+                })
+                print(
+                    f"{size:>8} ivf nprobe={nprobe:<3} {mix:<8} p50={results[-1]['p50_ms']}ms "
+                    f"p95={results[-1]['p95_ms']}ms recall@{args.k}={results[-1]['recall_at_k']} "
+                    f"(train {train_s:.1f}s)",
+                    file=sys.stderr,
+                )
+        del ivf
+
+    report = {
+        "meta": {"git_commit": git_commit(), "dim": args.dim, "k": args.k, "queries": args.queries,
+                 "threads": args.threads, "clusters": args.clusters, "spread": args.spread},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Data-parallel CPU training scaling benchmark.
+
+Launches the training loop from training/train_ham10000.py under torchrun
+for each process count, on synthetic uint8 images with a randomly
+initialised EfficientNet-B2 (no dataset or downloads needed). The per-process
+batch size is fixed (weak scaling), so ideal throughput grows linearly:
+efficiency = throughput(n) / (n * throughput(1)).
+
+Example:
+    python benchmarks/ddp_scaling.py --procs 1,2,4,8 --output ddp.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+TRAINING_DIR = REPO_ROOT / "training"
+
+
+def worker(args) -> None:
+    sys.path.insert(0, str(TRAINING_DIR))
+    import torch
+    import torch.nn as nn
+    from torch.utils.data import DataLoader, TensorDataset
+    from torchvision import models
+
+    from batch_augment import BatchAugment
+    from checkpointing import ResumableRandomSampler
+    from distributed import cleanup_distributed, init_distributed
+    from train_ham10000 import train_one_epoch
+    from train_utils import make_grad_scaler, prepare_model
+
+    ctx = init_distributed(args.threads)
+    try:
+        torch.manual_seed(0)
+        count = args.batch_size * args.steps * ctx.world_size
+        images = torch.randint(0, 256, (count, 3, args.image_size, args.image_size), dtype=torch.uint8)
+        labels = torch.randint(0, 7, (count,))
+        sampler = ResumableRandomSampler(count, 0, ctx.world_size, ctx.rank)
+        loader = DataLoader(TensorDataset(images, labels), batch_size=args.batch_size, sampler=sampler)
+
+        model = models.efficientnet_b2(weights=None, num_classes=7)
+        train_model = prepare_model(model, distributed=ctx.enabled)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=3e-4)
+        augment = BatchAugment(hflip=True, vflip=True, degrees=15)
+        scaler = make_grad_scaler("cpu", "off")
+
+        results = []
+        for epoch in range(args.warmup + args.repeats):
+            sampler.set_epoch(epoch)
+            _, _, images_per_sec, _ = train_one_epoch(
+                train_model, loader, nn.CrossEntropyLoss(), optimizer, "cpu", augment, scaler=scaler
+            )
+            if epoch >= args.warmup:
+                results.append(images_per_sec)
+        if ctx.is_main:
+            Path(args.result).write_text(json.dumps({
+                "processes": ctx.world_size,
+                "threads_per_process": torch.get_num_threads(),
+                "images_per_sec": max(results),
+            }))
+    finally:
+        cleanup_distributed()
+
+
+def run(procs: int, args) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as handle:
+        result_path = handle.name
+    command = [
+        sys.executable, "-m", "torch.distributed.run", "--standalone", f"--nproc-per-node={procs}",
+        str(Path(__file__).resolve()), "--worker", "--result", result_path,
+        "--batch-size", str(args.batch_size), "--steps", str(args.steps),
+        "--image-size", str(args.image_size), "--warmup", str(args.warmup), "--repeats", str(args.repeats),
+    ]
+    if args.threads:
+        command += ["--threads", str(args.threads)]
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES="")
+    start = time.perf_counter()
+    subprocess.run(command, check=True, env=env, cwd=REPO_ROOT)
+    result = json.loads(Path(result_path).read_text())
+    os.unlink(result_path)
+    result["wall_s"] = round(time.perf_counter() - start, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure DDP (gloo) training scaling on CPU")
+    parser.add_argument("--procs", default="1,2,4,8", help="Comma list of process counts")
+    parser.add_argument("--batch-size", type=int, default=16, help="Per-process batch size")
+    parser.add_argument("--steps", type=int, default=8, help="Optimizer steps per timed epoch")
+    parser.add_argument("--image-size", type=int, default=260)
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed epochs")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed epochs (best is reported)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Torch threads per process (default: cores / processes)")
+    parser.add_argument("--output", default=None, help="Write JSON results here (stdout otherwise)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    runs = [run(int(procs), args) for procs in args.procs.split(",")]
+    baseline = next((r for r in runs if r["processes"] == 1), None)
+    for result in runs:
+        if baseline:
+            ideal = baseline["images_per_sec"] * result["processes"]
+            result["efficiency"] = round(result["images_per_sec"] / ideal, 3)
+        result["images_per_sec"] = round(result["images_per_sec"], 2)
+
+    print(f"{'procs':>5} {'threads':>7} {'img/s':>9} {'efficiency':>10}", file=sys.stderr)
+    for result in runs:
+        efficiency = f"{result['efficiency']:.0%}" if "efficiency" in result else "-"
+        print(
+            f"{result['processes']:>5} {result['threads_per_process']:>7} "
+            f"{result['images_per_sec']:>9.1f} {efficiency:>10}",
+            file=sys.stderr,
+        )
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "batch_size_per_process": args.batch_size,
+            "steps": args.steps,
+            "image_size": args.image_size,
+        },
+        "results": runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
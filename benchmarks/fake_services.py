@@ -0,0 +1,141 @@
+"""In-process stand-ins for MongoDB (motor) and the Groq API, for load tests."""
+import asyncio
+import copy
+import os
+from types import SimpleNamespace
+
+from bson import ObjectId
+from fastapi import FastAPI
+
+LOADTEST_EMAIL = "loadtest@example.com"
+LOADTEST_PASSWORD = "loadtest-password"
+
+
+def _match_value(doc: dict, key, condition) -> bool:
+    if not isinstance(condition, dict):
+        return doc.get(key) == condition
+    checks = {
+        "$exists": lambda want: (key in doc) == want,
+        "$gt": lambda bound: key in doc and doc[key] > bound,
+        "$in": lambda values: doc.get(key) in values,
+    }
+    return all(checks[op](arg) for op, arg in condition.items())
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    return all(_match_value(doc, key, value) for key, value in query.items())
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        self._docs.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return self
+
+    def skip(self, count):
+        self._docs = self._docs[count:]
+        return self
+
+    def limit(self, count):
+        self._docs = self._docs[:count]
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield copy.deepcopy(doc)
+
+    async def to_list(self, length=None):
+        return [copy.deepcopy(doc) for doc in self._docs[:length]]
+
+
+class FakeCollection:
+    """The subset of AsyncIOMotorCollection the routes use."""
+
+    def __init__(self):
+        self._docs = []
+
+    def preload(self, docs):
+        """Synchronous seeding, usable before an event loop exists."""
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            self._docs.append(copy.deepcopy(doc))
+
+    async def insert_one(self, doc):
+        # pymongo mutates the caller's document, so do the same
+        doc.setdefault("_id", ObjectId())
+        self._docs.append(copy.deepcopy(doc))
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def find_one(self, query=None, *args, **kwargs):
+        for doc in self._docs:
+            if _matches(doc, query or {}):
+                return copy.deepcopy(doc)
+        return None
+
+    def find(self, query=None, *args, **kwargs):
+        return FakeCursor([doc for doc in self._docs if _matches(doc, query or {})])
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self._docs:
+            if _matches(doc, query):
+                doc.update(update.get("$set", {}))
+                return SimpleNamespace(matched_count=1, modified_count=1)
+        return SimpleNamespace(matched_count=0, modified_count=0)
+
+    async def count_documents(self, query):
+        return sum(1 for doc in self._docs if _matches(doc, query))
+
+
+class FakeDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        return self._collections.setdefault(name, FakeCollection())
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, name, *args, **kwargs):
+        return {"ok": 1.0}
+
+
+class FakeMongoClient:
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        return self._databases.setdefault(name, FakeDatabase())
+
+    def close(self):
+        pass
+
+
+# ==========================================
+# FAKE GROQ
+# ==========================================
+FAKE_GROQ_LATENCY = float(os.getenv("FAKE_GROQ_LATENCY", "0.5"))
+
+groq_app = FastAPI(title="Fake Groq")
+
+
+@groq_app.post("/openai/v1/chat/completions")
+async def chat_completions(payload: dict):
+    await asyncio.sleep(FAKE_GROQ_LATENCY)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "model": payload.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "This is a canned explanation for load testing."},
+            "finish_reason": "stop",
+        }],
+    }
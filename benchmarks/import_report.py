@@ -0,0 +1,133 @@
+"""Import-time report for the server modules.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter per
+module (best of --repeat runs), then reports the total import time, whether
+torch was pulled in, and the slowest imports by cumulative time. Use it to
+keep heavy dependencies out of the API's cold start.
+
+Example:
+    python benchmarks/import_report.py --modules server.main,server.model --top 15 \
+        --output imports.json --baseline previous.json --max-regression 0.20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_predictor import git_commit, parse_list  # noqa: E402
+
+DEFAULT_MODULES = "server.main,server.routes.auth,server.routes.triage,server.predict,server.model"
+HEAVY_PACKAGES = ("torch", "torchvision")
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """Rows of `-X importtime` output: self/cumulative microseconds, module and nesting depth."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return rows
+
+
+def measure(module: str) -> list[dict]:
+    env = {**os.environ, "PYTHONPATH": str(REPO_ROOT), "CUDA_VISIBLE_DEVICES": ""}
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.splitlines()[-1]}")
+    return parse_importtime(proc.stderr)
+
+
+def summarize(module: str, rows: list[dict], top: int) -> dict:
+    # Top-level rows (depth 0) partition the whole import
+    total_us = sum(row["cumulative_us"] for row in rows if row["depth"] == 0)
+    imported = {row["module"] for row in rows}
+    slowest = sorted(rows, key=lambda row: row["cumulative_us"], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_ms": round(total_us / 1000, 1),
+        "modules_imported": len(imported),
+        "heavy": [name for name in HEAVY_PACKAGES if name in imported],
+        "slowest": [
+            {"module": row["module"], "cumulative_ms": round(row["cumulative_us"] / 1000, 1),
+             "self_ms": round(row["self_us"] / 1000, 1)}
+            for row in slowest
+        ],
+    }
+
+
+def compare_to_baseline(results: list[dict], baseline_path: Path, max_regression: float) -> list[str]:
+    previous = {r["module"]: r for r in json.loads(baseline_path.read_text())["results"]}
+    failures = []
+    for result in results:
+        before = previous.get(result["module"])
+        if not before:
+            continue
+        change = result["total_ms"] / before["total_ms"] - 1.0
+        result["total_change_vs_baseline"] = round(change, 4)
+        if change > max_regression:
+            failures.append(f"{result['module']}: {before['total_ms']}ms -> {result['total_ms']}ms (+{change:.1%})")
+        new_heavy = set(result["heavy"]) - set(before["heavy"])
+        if new_heavy:
+            failures.append(f"{result['module']}: now imports {sorted(new_heavy)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report per-module import time with -X importtime")
+    parser.add_argument("--modules", default=DEFAULT_MODULES, help="Comma list of modules to import")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports listed per module")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per module; the fastest is kept")
+    parser.add_argument("--output", default=None, help="Write JSON results here (stdout otherwise)")
+    parser.add_argument("--baseline", default=None, help="Previous JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.20, help="Allowed total import slowdown")
+    args = parser.parse_args()
+
+    results = []
+    for module in parse_list(args.modules):
+        runs = [summarize(module, measure(module), args.top) for _ in range(args.repeat)]
+        result = min(runs, key=lambda run: run["total_ms"])
+        results.append(result)
+        heavy = ", ".join(result["heavy"]) or "none"
+        print(f"{module:<28} {result['total_ms']:>8.1f} ms  {result['modules_imported']:>5} modules  heavy: {heavy}",
+              file=sys.stderr)
+        for row in result["slowest"][:5]:
+            print(f"    {row['cumulative_ms']:>8.1f} ms  {row['module']}", file=sys.stderr)
+
+    report = {"meta": {"git_commit": git_commit(), "python": sys.version.split()[0], "repeat": args.repeat},
+              "results": results}
+    failures = []
+    if args.baseline:
+        failures = compare_to_baseline(results, Path(args.baseline), args.max_regression)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if failures:
+        print("Import-time regressions vs baseline:", file=sys.stderr)
+        for failure in failures:
+            print(f"  {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
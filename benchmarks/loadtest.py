@@ -0,0 +1,288 @@
+"""End-to-end HTTP load test for the DermSight API.
+
+Boots server.main:app under gunicorn with an in-memory Mongo stand-in
+(benchmarks/loadtest_app.py) and a fake Groq server, then drives a
+weighted mix of endpoints at each concurrency level for each worker
+count. It reports per-endpoint throughput and tail latency, and the
+saturation point per worker count: the lowest concurrency that reaches
+95% of the peak throughput.
+
+Example:
+    python benchmarks/loadtest.py --workers 1,2 --concurrency 1,4,16 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.bench_predictor import random_checkpoint, synthetic_images  # noqa: E402
+from benchmarks.fake_services import LOADTEST_EMAIL, LOADTEST_PASSWORD  # noqa: E402
+
+DEFAULT_MIX = "login=2,upload=1,cases=4,predict=2,explain=1"
+SATURATION_FRACTION = 0.95
+
+EXPLAIN_BODY = {
+    "prediction": "Low Risk (Benign)",
+    "risk_level": 0,
+    "confidence": 81.2,
+    "scores": {"low_risk": 81.2, "medium_risk": 12.5, "high_risk": 6.3},
+    "recommendation": {"action": "Self-monitor at home", "urgency": "No immediate action needed", "details": []},
+    "symptoms_used": {"itch": False, "bleed": False, "grew": False, "elevation": False, "danger_flags": 0},
+    "user_symptoms": "slightly itchy",
+}
+
+
+# ==========================================
+# SCENARIOS
+# ==========================================
+async def login(client, image):
+    return await client.post("/auth/login", json={"email": LOADTEST_EMAIL, "password": LOADTEST_PASSWORD})
+
+
+async def upload(client, image):
+    return await client.post(
+        "/triage/upload",
+        files={"image": ("lesion.jpg", image, "image/jpeg")},
+        data={"note": "load test"},
+    )
+
+
+async def cases(client, image):
+    return await client.get("/triage/cases", params={"limit": 20})
+
+
+async def predict(client, image):
+    return await client.post(
+        "/predict",
+        files={"image": ("lesion.jpg", image, "image/jpeg")},
+        data={"symptoms": random.choice(["", "itchy", "bleeding and growing", "raised bump"])},
+    )
+
+
+async def explain(client, image):
+    return await client.post("/explain", json=EXPLAIN_BODY)
+
+
+SCENARIOS = {
+    "login": login,
+    "upload": upload,
+    "cases": cases,
+    "predict": predict,
+    "explain": explain,
+}
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {sorted(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def drive(base_url: str, concurrency: int, duration: float, mix: dict, images: list[bytes]) -> dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    deadline = time.perf_counter() + duration
+
+    async def user(client):
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await SCENARIOS[name](client, random.choice(images))
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            if ok:
+                samples[name].append(elapsed)
+            else:
+                errors[name] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name in names:
+        latencies = np.array(samples[name]) * 1000
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": errors[name],
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+            "p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+            "p99_ms": round(float(np.percentile(latencies, 99)), 1) if len(latencies) else None,
+        }
+    total = sum(len(v) for v in samples.values())
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 2),
+        "errors": sum(errors.values()),
+        "endpoints": endpoints,
+    }
+
+
+# ==========================================
+# PROCESS MANAGEMENT
+# ==========================================
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited early with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"Server at {url} not ready after {timeout}s")
+
+
+def stop(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def start_fake_groq(port: int, latency: float) -> subprocess.Popen:
+    env = {**os.environ, "FAKE_GROQ_LATENCY": str(latency)}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.fake_services:groq_app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env,
+    )
+
+
+def start_api(port: int, workers: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-k", "uvicorn.workers.UvicornWorker",
+         "-w", str(workers), "-b", f"127.0.0.1:{port}", "--timeout", "300",
+         "--log-level", "warning", "benchmarks.loadtest_app:app"],
+        cwd=REPO_ROOT, env=env,
+    )
+
+
+def saturation_point(levels: list[dict]) -> dict:
+    peak = max(level["throughput_rps"] for level in levels)
+    for level in levels:
+        if level["throughput_rps"] >= SATURATION_FRACTION * peak:
+            return {"concurrency": level["concurrency"], "throughput_rps": level["throughput_rps"], "peak_rps": peak}
+    return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test for the DermSight API")
+    parser.add_argument("--workers", default="1,2", help="Gunicorn worker counts to test")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="Concurrent virtual users per run")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds measured per level")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Unmeasured seconds per worker count")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted endpoint mix, e.g. predict=2,cases=1")
+    parser.add_argument("--model-path", default=None, help="Checkpoint; random weights if omitted")
+    parser.add_argument("--groq-latency", type=float, default=0.5, help="Fake Groq response delay (s)")
+    parser.add_argument("--inference-workers", type=int, default=1, help="INFERENCE_WORKERS per process")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write JSON results here (stdout otherwise)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    worker_counts = [int(v) for v in args.workers.split(",") if v.strip()]
+    concurrency_levels = [int(v) for v in args.concurrency.split(",") if v.strip()]
+    images = synthetic_images(args.seed)
+
+    model_path = args.model_path
+    random_weights = not model_path or not Path(model_path).exists()
+    if random_weights:
+        model_path = random_checkpoint(args.seed)
+    upload_dir = tempfile.mkdtemp(prefix="dermsight_loadtest_uploads_")
+
+    groq_port = free_port()
+    groq = start_fake_groq(groq_port, args.groq_latency)
+    report = {"mix": mix, "groq_latency_s": args.groq_latency, "runs": []}
+    try:
+        wait_ready(f"http://127.0.0.1:{groq_port}/docs", groq)
+        env = {
+            **os.environ,
+            "MODEL_PATH": model_path,
+            "UPLOAD_DIR": upload_dir,
+            "GROQ_URL": f"http://127.0.0.1:{groq_port}/openai/v1/chat/completions",
+            "GROQ_API_KEY": "fake",
+            "INFERENCE_WORKERS": str(args.inference_workers),
+            # Synthetic noise images are not photos; measure the gate's cost without it rejecting them
+            "QUALITY_GATE": "off",
+            "CUDA_VISIBLE_DEVICES": "",
+        }
+        for workers in worker_counts:
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            print(f"Starting API with {workers} worker(s) on {base_url}...", file=sys.stderr)
+            api = start_api(port, workers, env)
+            try:
+                wait_ready(f"{base_url}/health", api)
+                # Warm up so lazy model loading in every worker is not measured
+                asyncio.run(drive(base_url, max(workers * 2, 2), args.warmup, mix, images))
+                levels = []
+                for concurrency in concurrency_levels:
+                    result = asyncio.run(drive(base_url, concurrency, args.duration, mix, images))
+                    print(
+                        f"  workers={workers} concurrency={concurrency} "
+                        f"throughput={result['throughput_rps']} rps errors={result['errors']}",
+                        file=sys.stderr,
+                    )
+                    levels.append(result)
+            finally:
+                stop(api)
+            report["runs"].append({
+                "workers": workers,
+                "levels": levels,
+                "saturation": saturation_point(levels),
+            })
+    finally:
+        stop(groq)
+        if random_weights:
+            os.remove(model_path)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""server.main:app wired to an in-memory Mongo stand-in, for load tests.
+
+Run with gunicorn from the repo root:
+    gunicorn -k uvicorn.workers.UvicornWorker benchmarks.loadtest_app:app
+Each worker gets its own fake database seeded with the load-test user.
+"""
+from datetime import datetime, timezone
+
+from server.auth import hash_password
+from server.db import db, set_database
+from server.main import app
+
+from .fake_services import LOADTEST_EMAIL, LOADTEST_PASSWORD, FakeMongoClient
+
+# The lifespan's connect() keeps a client that is already set
+set_database(FakeMongoClient())
+
+db.users.preload([{
+    "email": LOADTEST_EMAIL,
+    "full_name": "Load Test",
+    "role": "patient",
+    "hashed_password": hash_password(LOADTEST_PASSWORD),
+    "created_at": datetime.now(timezone.utc),
+}])
+
+__all__ = ["app"]
@@ -0,0 +1,170 @@
+"""Latency vs high-risk recall report for served checkpoints.
+
+Scores each checkpoint (e.g. the EfficientNet-B2 teacher and the students
+from training/distill_student.py) through DermSightPredictor with TTA on
+and off. Quality is measured on finetune_pad_ufes.py's validation split
+(same --seed / --val-split) with the served decision, symptom rules
+included. Latency is the single-image `predict` time, decode included.
+
+Example:
+    python benchmarks/student_report.py \
+        --checkpoints data/models/efficientnet_b2_pad_ufes_best.pth out/efficientnet_b0_student_best.pth \
+        --data-dirs data/pad_ufes/images --csv-path data/pad_ufes/metadata.csv --output students.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+TRAINING_DIR = REPO_ROOT / "training"
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(TRAINING_DIR))
+
+# Force CPU before torch is imported anywhere in this process tree
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+
+def validation_split(args):
+    """(paths, risk labels, symptom flags) of finetune_pad_ufes.py's validation split."""
+    import torch
+    from torch.utils.data import random_split
+
+    from calibrate_rules import read_symptom_flags
+    from finetune_pad_ufes import DEFAULT_HIGH, DEFAULT_MEDIUM, build_image_index, load_metadata, parse_labels
+    from server.predict import SYMPTOM_NAMES
+
+    manifest_path = Path(args.manifest) if args.manifest else None
+    image_index = build_image_index([Path(path) for path in args.data_dirs], manifest_path)
+    samples = load_metadata(
+        Path(args.csv_path),
+        image_index,
+        args.label_col,
+        parse_labels(args.high_labels) or DEFAULT_HIGH,
+        parse_labels(args.medium_labels) or DEFAULT_MEDIUM,
+        manifest_path,
+    )
+    val_size = int(len(samples) * args.val_split)
+    generator = torch.Generator().manual_seed(args.seed)
+    _, val_samples = random_split(samples, [len(samples) - val_size, val_size], generator=generator)
+
+    symptom_flags = read_symptom_flags(Path(args.csv_path))
+    paths = [sample.image_path for sample in val_samples]
+    labels = np.array([sample.label for sample in val_samples], dtype=np.int64)
+    flags = np.array(
+        [symptom_flags.get(path.name, [False] * len(SYMPTOM_NAMES)) for path in paths], dtype=bool
+    )
+    return paths, labels, flags
+
+
+def score(predictor, paths, labels, flags, batch_size: int) -> dict:
+    from risk_metrics import accuracy, confusion_matrix, high_risk_f1
+
+    preds = []
+    for start in range(0, len(paths), batch_size):
+        results = predictor.predict_batch(paths[start:start + batch_size], flags[start:start + batch_size])
+        preds.extend(result["risk_level"] for result in results)
+    confusion = confusion_matrix(labels, preds, num_classes=3)
+    precision, recall, f1 = high_risk_f1(confusion)
+    return {
+        "high_precision": round(precision, 4),
+        "high_recall": round(recall, 4),
+        "high_f1": round(f1, 4),
+        "accuracy": round(accuracy(confusion), 4),
+    }
+
+
+def latency(predictor, paths, warmup: int, runs: int) -> dict:
+    for i in range(warmup):
+        predictor.predict(paths[i % len(paths)])
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        predictor.predict(paths[i % len(paths)])
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": round(float(np.percentile(timings, 50)), 2),
+        "p95_ms": round(float(np.percentile(timings, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare served checkpoints on latency and high-risk recall")
+    parser.add_argument("--checkpoints", nargs="+", required=True, help="Teacher and student checkpoints")
+    parser.add_argument("--data-dirs", nargs="+", required=True, help="PAD-UFES image folders")
+    parser.add_argument("--csv-path", required=True, help="PAD-UFES metadata CSV")
+    parser.add_argument("--label-col", default="diagnostic")
+    parser.add_argument("--high-labels", default=None, help="Default: finetune_pad_ufes.py's")
+    parser.add_argument("--medium-labels", default=None, help="Default: finetune_pad_ufes.py's")
+    parser.add_argument("--manifest", default=None, help="SQLite image manifest to reuse between runs")
+    parser.add_argument("--val-split", type=float, default=0.15)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per predict_batch call")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed single-image predictions")
+    parser.add_argument("--runs", type=int, default=30, help="Timed single-image predictions")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads (default: torch's)")
+    parser.add_argument("--output", default=None, help="Write JSON results here (stdout otherwise)")
+    args = parser.parse_args()
+
+    import torch
+
+    from server.model import DermSightPredictor
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    paths, labels, flags = validation_split(args)
+    print(f"Validation split: {len(paths)} images ({int((labels == 2).sum())} high risk)", file=sys.stderr)
+
+    rows = []
+    for checkpoint in args.checkpoints:
+        for use_tta in (False, True):
+            predictor = DermSightPredictor(checkpoint, use_tta=use_tta)
+            row = {
+                "checkpoint": str(checkpoint),
+                "arch": predictor.arch,
+                "tta": use_tta,
+                "params_m": round(sum(p.numel() for p in predictor.model.parameters()) / 1e6, 2),
+                "file_mb": round(os.path.getsize(checkpoint) / 2**20, 1),
+            }
+            row.update(score(predictor, paths, labels, flags, args.batch_size))
+            row.update(latency(predictor, paths, args.warmup, args.runs))
+            rows.append(row)
+
+    print(
+        f"{'arch':<20} {'tta':>3} {'params':>7} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'recall':>7} {'prec':>7} {'f1':>7}",
+        file=sys.stderr,
+    )
+    for row in rows:
+        print(
+            f"{row['arch']:<20} {'on' if row['tta'] else 'off':>3} {row['params_m']:>6.1f}M "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['high_recall']:>7.3f} "
+            f"{row['high_precision']:>7.3f} {row['high_f1']:>7.3f}",
+            file=sys.stderr,
+        )
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "val_images": len(paths),
+            "seed": args.seed,
+            "val_split": args.val_split,
+        },
+        "results": rows,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
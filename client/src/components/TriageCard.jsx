@@ -30,6 +30,17 @@ const PAD_SYMPTOMS = [
   'back', 'chest', 'abdomen', 'shoulder',
 ]
 
+// Turn an error response body into one line of text: the quality gate's 422
+// sends { message, reasons: [{ message }] }, other errors a plain string
+function errorMessage(detail, fallback) {
+  if (typeof detail === 'string' && detail) return detail
+  if (detail && typeof detail === 'object' && detail.message) {
+    const reasons = (detail.reasons || []).map((reason) => reason.message).filter(Boolean)
+    return reasons.length ? `${detail.message}: ${reasons.join('; ')}` : detail.message
+  }
+  return fallback
+}
+
 function TriageCard({ isAuthed = false, onRequireAuth }) {
   const inputRef = useRef(null)
   const [file, setFile] = useState(null)
@@ -112,7 +123,7 @@ function TriageCard({ isAuthed = false, onRequireAuth }) {
       const res = await fetch(`${API}/predict`, { method: 'POST', body: fd })
       if (!res.ok) {
         const body = await res.json().catch(() => ({}))
-        throw new Error(body.detail || res.statusText)
+        throw new Error(errorMessage(body.detail, res.statusText))
       }
       const data = await res.json()
       setResult(data)
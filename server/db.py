@@ -2,6 +2,9 @@ import os
 
 from dotenv import find_dotenv, load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from .metrics import MONGO_LATENCY
 
 dotenv_path = find_dotenv(".env", usecwd=True)
 if dotenv_path:
@@ -10,14 +13,60 @@ else:
     load_dotenv(override=True)
 
 MONGO_URI = os.getenv("MONGODB_URI", "").strip()
-if not MONGO_URI:
-    print("CRITICAL: MONGODB_URI is not set in .env or environment.")
-    raise RuntimeError("MONGODB_URI is missing. Please check your .env file.")
-
 MONGO_DB = os.getenv("MONGODB_DB", "dermsight")
 
-mongo_client = AsyncIOMotorClient(MONGO_URI)
-db = mongo_client[MONGO_DB]
+
+class MongoCommandTimer(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name, outcome="ok")
+
+    def failed(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name, outcome="error")
+
+
+# Created by connect() (the app lifespan, or the first query of a CLI tool), not at import
+mongo_client = None
+
+
+def connect():
+    """The Mongo client, created from MONGODB_URI on first call."""
+    global mongo_client
+    if mongo_client is None:
+        if not MONGO_URI:
+            print("CRITICAL: MONGODB_URI is not set in .env or environment.")
+            raise RuntimeError("MONGODB_URI is missing. Please check your .env file.")
+        mongo_client = AsyncIOMotorClient(MONGO_URI, event_listeners=[MongoCommandTimer()])
+    return mongo_client
+
+
+def set_database(client) -> None:
+    """Serve `client` (e.g. an in-memory fake) instead of connecting to MONGODB_URI."""
+    global mongo_client
+    mongo_client = client
+
+
+def close_db() -> None:
+    global mongo_client
+    if mongo_client is not None:
+        mongo_client.close()
+        mongo_client = None
+
+
+class _Database:
+    """`db.<collection>` resolved on the current client at call time, so modules can
+    bind `db` at import without a connection."""
+
+    def __getattr__(self, name):
+        return getattr(connect()[MONGO_DB], name)
+
+    def __getitem__(self, name):
+        return connect()[MONGO_DB][name]
+
+
+db = _Database()
 
 
 async def ping_db() -> None:
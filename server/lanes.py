@@ -0,0 +1,177 @@
+"""Priority lanes for the inference workers.
+
+Every prediction is queued on a lane:
+  - interactive: a patient waiting on /predict (the default),
+  - batch: bulk re-scoring and multi-image uploads,
+  - background: work nobody waits on (e.g. indexing).
+
+Workers pick the next job by weighted fair queueing (stride scheduling):
+each lane advances a virtual clock by 1 / weight per job it runs, and the
+non-empty lane with the earliest clock goes next. A lane that was idle
+rejoins at the current clock instead of spending saved-up credit, and an
+empty lane costs nothing, so batch work soaks up every idle worker but
+gets only its weighted share while interactive requests are waiting.
+
+A lane with a latency target (slo_ms) whose oldest job has waited past
+SLO_URGENT_FRACTION of that target runs next regardless of weights.
+Each lane has a queue limit; submitting to a full lane raises LaneFull
+(mapped to 503 by the routes). Queue wait, SLO hits and misses and
+rejections are exported on /metrics.
+
+Lanes are configured with INFERENCE_LANES as `name:weight:max_queue:slo_ms`
+entries, e.g. "interactive:8:64:2000,batch:2:256:30000,background:1:1024:0"
+(slo_ms 0 = no target).
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+import numpy as np
+
+from .metrics import INFERENCE_ACTIVE, INFERENCE_LANE_REJECTED, INFERENCE_LANE_WAIT, INFERENCE_QUEUED, INFERENCE_SLO
+
+DEFAULT_LANES = "interactive:8:64:2000,batch:2:256:30000,background:1:1024:0"
+# Share of a lane's SLO its oldest job may wait before it jumps the weighted order
+SLO_URGENT_FRACTION = 0.5
+# Recent latencies kept per lane for the rolling p95 in status()
+SLO_WINDOW = 1000
+
+
+@dataclass(frozen=True)
+class Lane:
+    name: str
+    weight: float
+    max_queue: int
+    slo_ms: float = 0.0
+
+
+def parse_lanes(spec: str) -> tuple:
+    lanes = []
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, weight, max_queue, slo_ms = (part.strip() for part in entry.split(":"))
+        lanes.append(Lane(name, float(weight), int(max_queue), float(slo_ms)))
+    if not lanes:
+        raise ValueError("INFERENCE_LANES defines no lanes")
+    return tuple(lanes)
+
+
+class LaneFull(RuntimeError):
+    """The lane's queue is at its limit; retry later."""
+
+
+class _LaneState:
+    def __init__(self, lane: Lane):
+        self.lane = lane
+        self.queue = deque()
+        self.clock = 0.0
+        self.latencies = deque(maxlen=SLO_WINDOW)
+        self.slo_met = 0
+        self.slo_missed = 0
+
+
+class LaneScheduler:
+    """Worker threads that run submitted callables in weighted-fair lane order."""
+
+    def __init__(self, lanes, workers: int, thread_name_prefix: str = "inference"):
+        self._lanes = {lane.name: _LaneState(lane) for lane in lanes}
+        self._workers = workers
+        self._thread_name_prefix = thread_name_prefix
+        self._threads = []
+        self._cond = threading.Condition()
+        self._clock = 0.0
+
+    @property
+    def lanes(self) -> tuple:
+        return tuple(self._lanes)
+
+    def submit(self, lane: str, fn) -> Future:
+        state = self._lanes.get(lane)
+        if state is None:
+            raise ValueError(f"Unknown inference lane {lane!r}; expected one of {self.lanes}")
+        future = Future()
+        with self._cond:
+            if len(state.queue) >= state.lane.max_queue:
+                INFERENCE_LANE_REJECTED.inc(lane=lane)
+                raise LaneFull(f"Inference lane {lane!r} is full ({state.lane.max_queue} queued)")
+            if not state.queue:
+                state.clock = max(state.clock, self._clock)
+            state.queue.append((future, fn, time.perf_counter()))
+            INFERENCE_QUEUED.inc(lane=lane)
+            if len(self._threads) < self._workers:
+                self._start_worker()
+            self._cond.notify()
+        return future
+
+    def _start_worker(self) -> None:
+        thread = threading.Thread(
+            target=self._work, name=f"{self._thread_name_prefix}_{len(self._threads)}", daemon=True
+        )
+        self._threads.append(thread)
+        thread.start()
+
+    def _next(self):
+        """Pop the next job; call with the lock held and at least one job queued."""
+        now = time.perf_counter()
+        ready = [state for state in self._lanes.values() if state.queue]
+        urgent = [
+            state for state in ready
+            if state.lane.slo_ms and (now - state.queue[0][2]) * 1000 > state.lane.slo_ms * SLO_URGENT_FRACTION
+        ]
+        if urgent:
+            state = min(urgent, key=lambda s: s.queue[0][2] + s.lane.slo_ms / 1000)
+        else:
+            state = min(ready, key=lambda s: s.clock)
+        self._clock = max(self._clock, state.clock)
+        state.clock += 1.0 / state.lane.weight
+        return state, state.queue.popleft()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not any(state.queue for state in self._lanes.values()):
+                    self._cond.wait()
+                state, (future, fn, enqueued) = self._next()
+            lane = state.lane.name
+            INFERENCE_QUEUED.dec(lane=lane)
+            if not future.set_running_or_notify_cancel():
+                # Cancelled while queued (the caller went away)
+                continue
+            INFERENCE_LANE_WAIT.observe(time.perf_counter() - enqueued, lane=lane)
+            INFERENCE_ACTIVE.inc()
+            try:
+                future.set_result(fn())
+            except BaseException as exc:
+                future.set_exception(exc)
+            finally:
+                INFERENCE_ACTIVE.dec()
+                self._record(state, (time.perf_counter() - enqueued) * 1000)
+
+    def _record(self, state: _LaneState, latency_ms: float) -> None:
+        with self._cond:
+            state.latencies.append(latency_ms)
+            if not state.lane.slo_ms:
+                return
+            if latency_ms <= state.lane.slo_ms:
+                state.slo_met += 1
+            else:
+                state.slo_missed += 1
+        INFERENCE_SLO.inc(lane=state.lane.name, outcome="met" if latency_ms <= state.lane.slo_ms else "missed")
+
+    def status(self) -> dict:
+        with self._cond:
+            lanes = {}
+            for name, state in self._lanes.items():
+                total = state.slo_met + state.slo_missed
+                lanes[name] = {
+                    "weight": state.lane.weight,
+                    "queued": len(state.queue),
+                    "max_queue": state.lane.max_queue,
+                    "slo_ms": state.lane.slo_ms or None,
+                    "p95_ms": round(float(np.percentile(state.latencies, 95)), 2) if state.latencies else None,
+                    "slo_attainment": round(state.slo_met / total, 4) if total else None,
+                }
+        return {"workers": self._workers, "lanes": lanes}
@@ -1,18 +1,31 @@
+import asyncio
 import os
+import time
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from .db import mongo_client, ping_db
-from .routes import auth_router, predict_router, triage_router, explain_router
+from . import shadow, similarity
+from .db import close_db, connect, ping_db
+from .metrics import HTTP_LATENCY, render_metrics
+from .predict import MODEL_REGISTRY_POLL_S, watch_registry
+from .routes import auth_router, predict_router, triage_router, explain_router, admin_router
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    connect()
     await ping_db()
+    await similarity.sync(force=True)
+    if shadow.SHADOW_VERSION and shadow.SHADOW_FRACTION > 0:
+        await shadow.configure(shadow.SHADOW_VERSION, shadow.SHADOW_FRACTION)
+    watcher = asyncio.create_task(watch_registry(MODEL_REGISTRY_POLL_S)) if MODEL_REGISTRY_POLL_S > 0 else None
     yield
-    mongo_client.close()
+    if watcher is not None:
+        watcher.cancel()
+    close_db()
 
 
 app = FastAPI(title="DermSight API", lifespan=lifespan)
@@ -26,12 +39,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep cardinality bounded
+        route = request.scope.get("route")
+        HTTP_LATENCY.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status_code,
+        )
+
+
 app.include_router(auth_router)
 app.include_router(triage_router)
 app.include_router(predict_router)
 app.include_router(explain_router)
+app.include_router(admin_router)
 
 
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
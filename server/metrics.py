@@ -0,0 +1,215 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from fast Mongo calls up to slow LLM responses.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.label_names and self.kind != "histogram":
+            self._values[()] = 0
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, ("le", repr(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            plain = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{plain} {total}")
+            lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ==========================================
+# METRICS
+# ==========================================
+HTTP_LATENCY = Histogram(
+    "dermsight_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    labels=("method", "route", "status"),
+)
+PREDICT_STAGE_LATENCY = Histogram(
+    "dermsight_predict_stage_duration_seconds",
+    "Time spent in each stage of a /predict request.",
+    labels=("stage",),
+)
+MONGO_LATENCY = Histogram(
+    "dermsight_mongo_command_duration_seconds",
+    "MongoDB command latency.",
+    labels=("command", "outcome"),
+)
+GROQ_LATENCY = Histogram(
+    "dermsight_groq_request_duration_seconds",
+    "Groq chat completion latency.",
+    labels=("outcome",),
+)
+INFERENCE_QUEUED = Gauge(
+    "dermsight_inference_queue_depth",
+    "Predictions waiting for an inference worker, per priority lane.",
+    labels=("lane",),
+)
+INFERENCE_ACTIVE = Gauge(
+    "dermsight_inference_active",
+    "Predictions currently running on an inference worker.",
+)
+CASCADE_DECISIONS = Counter(
+    "dermsight_cascade_decisions_total",
+    "Cascade first-pass outcomes: early_exit answered from the cheap pass, escalated ran the full pass.",
+    labels=("outcome",),
+)
+MODEL_INFO = Gauge(
+    "dermsight_model_info",
+    "1 for the model version serving requests, 0 for versions swapped out.",
+    labels=("version",),
+)
+MODEL_SWAPS = Counter(
+    "dermsight_model_swaps_total",
+    "Hot model swaps by outcome.",
+    labels=("outcome",),
+)
+SHADOW_PREDICTIONS = Counter(
+    "dermsight_shadow_predictions_total",
+    "Candidate-model shadow scorings: logged, dropped (backlog full) or error.",
+    labels=("outcome",),
+)
+QUALITY_CHECKS = Counter(
+    "dermsight_quality_checks_total",
+    "Upload quality checks: passed, rejected, or would_reject with QUALITY_GATE=off.",
+    labels=("outcome",),
+)
+QUALITY_FAILURES = Counter(
+    "dermsight_quality_failures_total",
+    "Failed quality checks by reason (one upload can fail several).",
+    labels=("reason",),
+)
+
+REQUESTS_COALESCED = Counter(
+    "dermsight_requests_coalesced_total",
+    "Requests that awaited an identical in-flight request instead of running their own.",
+    labels=("flight",),
+)
+
+INFERENCE_LANE_WAIT = Histogram(
+    "dermsight_inference_lane_wait_seconds",
+    "Time predictions spent queued before a worker picked them up, per priority lane.",
+    labels=("lane",),
+)
+INFERENCE_SLO = Counter(
+    "dermsight_inference_slo_total",
+    "Predictions that met or missed their lane's latency target (queue wait + run).",
+    labels=("lane", "outcome"),
+)
+INFERENCE_LANE_REJECTED = Counter(
+    "dermsight_inference_lane_rejected_total",
+    "Predictions rejected because their lane's queue was full.",
+    labels=("lane",),
+)
+
+
+def stage_timer(stage: str):
+    return PREDICT_STAGE_LATENCY.time(stage=stage)
+
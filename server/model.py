@@ -0,0 +1,313 @@
+"""DermSight networks and the predictor that runs them.
+
+Imports torch and torchvision, so it is loaded on first use by
+server/predict.py rather than when the API starts.
+"""
+import torch
+import torch.nn as nn
+from torchvision import models
+from PIL import Image
+import numpy as np
+import os
+from contextlib import nullcontext
+
+from .decode import DECODE_BACKEND, VIEW_TRANSFORMS, decode_image, preprocess
+from .metrics import CASCADE_DECISIONS, stage_timer
+from .predict import (
+    CASCADE_FAST_MODEL_PATH,
+    CASCADE_GATE_PATH,
+    DEFAULT_RULES,
+    MODEL_ARCH,
+    MODEL_WARMUP_RUNS,
+    SYMPTOM_NAMES,
+    SYMPTOM_RULES_PATH,
+    CascadeGate,
+    SymptomRules,
+    apply_symptom_rules,
+    build_results,
+    cascade_exit,
+)
+from .profiling import claim_session
+
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+# ==========================================
+# 1. MODEL ARCHITECTURE
+# ==========================================
+# Backbones with torchvision's features / avgpool / classifier layout, so
+# checkpoints of any of them share the same key structure.
+MODEL_ARCHS = {
+    "efficientnet_b2": models.efficientnet_b2,
+    "efficientnet_b0": models.efficientnet_b0,
+    "mobilenet_v3_large": models.mobilenet_v3_large,
+    "mobilenet_v3_small": models.mobilenet_v3_small,
+}
+DEFAULT_ARCH = "efficientnet_b2"
+
+
+class DermSightModel(nn.Module):
+    def __init__(self, arch=DEFAULT_ARCH, pretrained=False):
+        super().__init__()
+        if arch not in MODEL_ARCHS:
+            raise ValueError(f"Unknown model architecture {arch!r}; expected one of {sorted(MODEL_ARCHS)}")
+        self.arch = arch
+        base = MODEL_ARCHS[arch](weights="DEFAULT" if pretrained else None)
+        in_features = base.classifier[-1].in_features
+        base.classifier[-1] = nn.Linear(in_features, 3)
+        # Expose features and classifier at top level (no wrapper prefix)
+        self.features = base.features
+        self.avgpool = base.avgpool
+        self.classifier = base.classifier
+
+    def forward(self, image):
+        return self.classifier(self.embed(image))
+
+    def embed(self, image):
+        """Pooled backbone features [N, D] (1408 for efficientnet_b2), the classifier's input."""
+        x = self.features(image)
+        x = self.avgpool(x)
+        return torch.flatten(x, 1)
+
+
+# ==========================================
+# 2. PREDICTION ENGINE
+# ==========================================
+def load_model(model_path, arch=None, device=DEVICE, default_arch=DEFAULT_ARCH):
+    """Build the registered architecture for a checkpoint and load its weights.
+
+    The architecture is `arch` if given, else the checkpoint's own "arch"
+    key, else `default_arch` (for checkpoints that predate the key).
+    Returns (model in eval mode, arch, number of matched keys).
+    """
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model not found: {model_path}")
+
+    raw = torch.load(model_path, map_location=device, weights_only=False)
+
+    checkpoint_arch = raw.get("arch") if isinstance(raw, dict) else None
+    arch = arch or checkpoint_arch or default_arch
+    model = DermSightModel(arch).to(device)
+
+    # Handle different checkpoint formats
+    if isinstance(raw, dict) and "model_state_dict" in raw:
+        state_dict = raw["model_state_dict"]
+    elif isinstance(raw, dict) and "state_dict" in raw:
+        state_dict = raw["state_dict"]
+    elif isinstance(raw, dict):
+        state_dict = raw
+    else:
+        # torch.save(model, ...) was used — extract state_dict
+        state_dict = raw.state_dict()
+
+    # Strip 'backbone.' prefix if present (training saved with wrapper)
+    cleaned = {}
+    for k, v in state_dict.items():
+        new_key = k.replace("backbone.", "") if k.startswith("backbone.") else k
+        cleaned[new_key] = v
+
+    # Drop num_batches_tracked if missing in model
+    model_keys = set(model.state_dict().keys())
+    cleaned = {k: v for k, v in cleaned.items() if k in model_keys}
+
+    model.load_state_dict(cleaned, strict=False)
+    model.eval()
+    return model, arch, len(cleaned)
+
+
+def open_image(image, backend=None):
+    """Decoded image from a path, file object, encoded bytes or an already decoded image.
+
+    An RGB PIL image, or a uint8 [3, H, W] tensor for the fast DECODE_BACKENDs
+    (see server/decode.py).
+    """
+    return decode_image(image, backend)[0]
+
+
+class DermSightPredictor:
+    def __init__(
+        self,
+        model_path,
+        use_tta=True,
+        channels_last=False,
+        rules=None,
+        arch=None,
+        cascade=None,
+        fast_model_path=None,
+        decode_backend=None,
+    ):
+        self.device = DEVICE
+        self.decode_backend = decode_backend or DECODE_BACKEND
+        self.use_tta = use_tta
+        self.channels_last = channels_last
+        if rules is None:
+            rules = SymptomRules.from_file(SYMPTOM_RULES_PATH) if SYMPTOM_RULES_PATH else DEFAULT_RULES
+        self.rules = rules
+        print(f"Loading DermSight model on {self.device}...")
+
+        # Explicit argument, then the checkpoint's own "arch" key, then MODEL_ARCH
+        self.model, self.arch, matched = load_model(model_path, arch, self.device, MODEL_ARCH or DEFAULT_ARCH)
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        print(f"Model loaded: {model_path} [{self.arch}] ({matched} keys matched)")
+
+        if cascade is None and CASCADE_GATE_PATH:
+            cascade = CascadeGate.from_file(CASCADE_GATE_PATH)
+        fast_model_path = fast_model_path or CASCADE_FAST_MODEL_PATH or None
+        self.fast_model = None
+        if cascade is not None and fast_model_path:
+            self.fast_model, fast_arch, matched = load_model(fast_model_path, device=self.device)
+            if channels_last:
+                self.fast_model = self.fast_model.to(memory_format=torch.channels_last)
+            print(f"Cascade fast model loaded: {fast_model_path} [{fast_arch}] ({matched} keys matched)")
+        if cascade is not None and self.fast_model is None and not use_tta:
+            # Nothing to escalate to: the first pass already is the full pass
+            cascade = None
+        self.cascade = cascade
+
+        # Center, horizontal-flip and vertical-flip views (see server/decode.py)
+        self.tta_transforms = list(VIEW_TRANSFORMS)
+        self.transform = self.tta_transforms[0]
+
+    def predict(self, image, itch=False, bleed=False, grew=False, elevation=False, capture=None):
+        """Score one image: a path, a file object, encoded bytes or a decoded PIL image.
+
+        If `capture` is a dict, the preprocessed views behind the result
+        ("batch": all TTA views, or only the center view when the cascade
+        exits early) and the averaged model probabilities ("probs") are
+        stored in it.
+        """
+        # An admin profile capture (see server/profiling.py) claims live requests
+        session = claim_session()
+        if session is None:
+            return self._predict(image, itch, bleed, grew, elevation, capture=capture)
+        with session:
+            return self._predict(image, itch, bleed, grew, elevation, session, capture)
+
+    def _predict(self, image, itch, bleed, grew, elevation, session=None, capture=None):
+        try:
+            with stage_timer("decode"):
+                image = open_image(image, self.decode_backend)
+        except Exception as e:
+            return {"error": f"Image load failed: {str(e)}"}
+
+        symptom_flags = [[itch, bleed, grew, elevation]]
+        forward_profile = session.forward() if session else nullcontext()
+        if self.cascade is not None:
+            with forward_profile:
+                avg_probs = self._cascade([image], symptom_flags, capture)
+        else:
+            with stage_timer("preprocess"):
+                batch = self._preprocess([image])
+            if capture is not None:
+                capture["batch"] = batch
+
+            with stage_timer("forward"), forward_profile:
+                view_probs = self._forward(batch)
+            avg_probs = np.mean(view_probs, axis=0)[np.newaxis]
+        if capture is not None:
+            capture["probs"] = avg_probs[0]
+
+        with stage_timer("postprocess"):
+            return build_results(avg_probs, symptom_flags, self.rules)[0]
+
+    def predict_batch(self, images, symptom_flags=None):
+        """Score several images in one forward pass.
+
+        images: paths, file objects, encoded bytes or PIL images.
+        symptom_flags: optional [N, 4] flags ordered as SYMPTOM_NAMES.
+        """
+        decoded = [open_image(image, self.decode_backend) for image in images]
+        if symptom_flags is None:
+            symptom_flags = np.zeros((len(decoded), len(SYMPTOM_NAMES)), dtype=bool)
+        if self.cascade is not None:
+            avg_probs = self._cascade(decoded, symptom_flags)
+        else:
+            view_probs = self._forward(self._preprocess(decoded))
+            avg_probs = view_probs.reshape(len(decoded), -1, view_probs.shape[-1]).mean(axis=1)
+        return build_results(avg_probs, symptom_flags, self.rules)
+
+    def embed(self, images):
+        """L2-normalized pooled embeddings [N, D], averaged over the same views as predict().
+
+        images: paths, file objects, encoded bytes or decoded images.
+        """
+        decoded = [open_image(image, self.decode_backend) for image in images]
+        views = self._views()
+        with stage_timer("embed"):
+            batch = self._preprocess(decoded, views)
+            with torch.no_grad():
+                features = self.model.embed(batch).float().cpu().numpy()
+        features = features.reshape(len(decoded), len(views), -1).mean(axis=1)
+        return features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+
+    def predict_preprocessed(self, batch, symptom_flags):
+        """Score one image's views that another predictor already preprocessed.
+
+        batch: [V, 3, 224, 224] from `predict(..., capture=...)`.
+        Returns (averaged model probabilities [3], result dict).
+        """
+        probs = np.mean(self._forward(batch), axis=0)
+        return probs, build_results(probs[np.newaxis], [symptom_flags], self.rules)[0]
+
+    def _cascade(self, images, symptom_flags, capture=None):
+        """Averaged probabilities [N, 3]: a center-view first pass, then the full
+        pass only for the images the gate does not let exit early."""
+        with stage_timer("preprocess"):
+            first_batch = self._preprocess(images, [0])
+        if capture is not None:
+            capture["batch"] = first_batch
+        with stage_timer("forward"):
+            first = self._forward(first_batch, self.fast_model)
+
+        adjusted, _, _ = apply_symptom_rules(first, symptom_flags, self.rules)
+        escalate = np.flatnonzero(~cascade_exit(adjusted, self.cascade, self.rules))
+        CASCADE_DECISIONS.inc(len(images) - len(escalate), outcome="early_exit")
+        CASCADE_DECISIONS.inc(len(escalate), outcome="escalated")
+        if len(escalate) == 0:
+            return first
+
+        if self.fast_model is None:
+            # The center view is already scored; only the flipped views remain
+            views = list(range(1, len(self.tta_transforms)))
+        else:
+            views = self._views()
+        remaining = [images[i] for i in escalate]
+        with stage_timer("preprocess_escalated"):
+            batch = self._preprocess(remaining, views)
+        with stage_timer("forward_escalated"):
+            view_probs = self._forward(batch).reshape(len(remaining), len(views), -1)
+        if self.fast_model is None:
+            view_probs = np.concatenate([first[escalate, np.newaxis], view_probs], axis=1)
+        if capture is not None:
+            # The captured batch must hold the views behind the final probabilities
+            # (capture is single-image, so the whole first batch was escalated)
+            capture["batch"] = batch if self.fast_model is not None else torch.cat([first_batch, batch])
+
+        probs = first.copy()
+        probs[escalate] = view_probs.mean(axis=1)
+        return probs
+
+    def warmup(self, runs=MODEL_WARMUP_RUNS):
+        """Run the full and first-pass forwards on a blank image so the first real request pays no lazy init."""
+        image = open_image(Image.new('RGB', (260, 260), (180, 140, 120)), self.decode_backend)
+        for _ in range(runs):
+            self._forward(self._preprocess([image]))
+            if self.fast_model is not None:
+                self._forward(self._preprocess([image], [0]), self.fast_model)
+
+    def _views(self):
+        return list(range(len(self.tta_transforms))) if self.use_tta else [0]
+
+    def _preprocess(self, images, views=None):
+        # `views` index into tta_transforms (default: all, or the center only without TTA)
+        if views is None:
+            views = self._views()
+        batch = preprocess(images, views).to(self.device)
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        return batch
+
+    def _forward(self, batch, model=None):
+        model = self.model if model is None else model
+        with torch.no_grad():
+            return torch.softmax(model(batch), dim=1).cpu().numpy()
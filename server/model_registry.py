@@ -0,0 +1,284 @@
+"""Versioned model registry and the hot-swappable serving slot.
+
+A registry is a directory with one subfolder per version and a manifest:
+
+    registry/
+      manifest.json
+      v1/model.pth
+      v2/model.pth
+      v2/symptom_rules.json
+
+    {
+      "active": "v2",
+      "versions": {
+        "v2": {
+          "checkpoint": "v2/model.pth",
+          "arch": "efficientnet_b0",
+          "rules": "v2/symptom_rules.json",
+          "cascade_gate": null,
+          "fast_model": null,
+          "sha256": "...",
+          "created_at": "2026-01-01T00:00:00+00:00",
+          "notes": "distilled student"
+        }
+      }
+    }
+
+Paths in the manifest are relative to the registry directory. Without a
+manifest, the registry serves a single implicit version, MODEL_PATH.
+
+Register and inspect versions from the command line:
+
+    python -m server.model_registry register out/student.pth --version v2 --activate
+    python -m server.model_registry list
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+MANIFEST_NAME = "manifest.json"
+# File name of each registered artifact inside its version directory
+ARTIFACT_NAMES = {
+    "checkpoint": "model.pth",
+    "rules": "symptom_rules.json",
+    "cascade_gate": "cascade_gate.json",
+    "fast_model": "fast_model.pth",
+}
+
+
+@dataclass(frozen=True)
+class ModelVersion:
+    version: str
+    checkpoint: Path
+    arch: Optional[str] = None
+    rules: Optional[Path] = None
+    cascade_gate: Optional[Path] = None
+    fast_model: Optional[Path] = None
+    sha256: Optional[str] = None
+    created_at: Optional[str] = None
+    notes: str = ""
+
+    def to_dict(self) -> dict:
+        return {key: str(value) if isinstance(value, Path) else value for key, value in asdict(self).items()}
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, root, default_checkpoint=None):
+        self.root = Path(root)
+        self.default_checkpoint = Path(default_checkpoint) if default_checkpoint else None
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root / MANIFEST_NAME
+
+    @property
+    def enabled(self) -> bool:
+        return self.manifest_path.exists()
+
+    def read_manifest(self) -> dict:
+        if not self.enabled:
+            return {"active": None, "versions": {}}
+        return json.loads(self.manifest_path.read_text())
+
+    def _write_manifest(self, manifest: dict) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_name(MANIFEST_NAME + ".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, self.manifest_path)
+
+    def _version(self, name: str, entry: dict) -> ModelVersion:
+        values = {"version": name}
+        for field in fields(ModelVersion):
+            value = entry.get(field.name)
+            if field.name in {"checkpoint", "rules", "cascade_gate", "fast_model"} and value:
+                value = self.root / value
+            if value is not None and field.name != "version":
+                values[field.name] = value
+        return ModelVersion(**values)
+
+    def versions(self) -> list:
+        manifest = self.read_manifest()
+        return [self._version(name, entry) for name, entry in manifest["versions"].items()]
+
+    def active_version(self) -> Optional[str]:
+        return self.read_manifest().get("active")
+
+    def get(self, name: str) -> ModelVersion:
+        entry = self.read_manifest()["versions"].get(name)
+        if entry is None:
+            raise KeyError(f"Unknown model version {name!r}")
+        return self._version(name, entry)
+
+    def resolve(self, name: Optional[str] = None) -> ModelVersion:
+        """The named version, else the manifest's active one, else the implicit MODEL_PATH version."""
+        if name is None:
+            name = self.active_version()
+        if name is not None:
+            return self.get(name)
+        if self.default_checkpoint is None:
+            raise KeyError("The registry has no active version and no default checkpoint")
+        return ModelVersion(version=self.default_checkpoint.stem, checkpoint=self.default_checkpoint)
+
+    def set_active(self, name: str) -> None:
+        manifest = self.read_manifest()
+        if name not in manifest["versions"]:
+            raise KeyError(f"Unknown model version {name!r}")
+        manifest["active"] = name
+        self._write_manifest(manifest)
+
+    def register(
+        self,
+        checkpoint,
+        version: str,
+        arch: Optional[str] = None,
+        rules=None,
+        cascade_gate=None,
+        fast_model=None,
+        notes: str = "",
+    ) -> ModelVersion:
+        """Copy a checkpoint (and its optional configs) into `<root>/<version>/` and add it to the manifest."""
+        manifest = self.read_manifest()
+        if version in manifest["versions"]:
+            raise ValueError(f"Model version {version!r} already exists")
+        version_dir = self.root / version
+        version_dir.mkdir(parents=True, exist_ok=False)
+
+        try:
+            entry = {}
+            sources = {
+                "checkpoint": checkpoint, "rules": rules, "cascade_gate": cascade_gate, "fast_model": fast_model,
+            }
+            for key, source in sources.items():
+                if source is None:
+                    entry[key] = None
+                    continue
+                target = version_dir / ARTIFACT_NAMES[key]
+                shutil.copy2(Path(source), target)
+                entry[key] = str(target.relative_to(self.root))
+            entry.update({
+                "arch": arch,
+                "sha256": file_sha256(version_dir / ARTIFACT_NAMES["checkpoint"]),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "notes": notes,
+            })
+            manifest["versions"][version] = entry
+            self._write_manifest(manifest)
+        except BaseException:
+            # Leave nothing behind that would block a retry under the same version name
+            shutil.rmtree(version_dir, ignore_errors=True)
+            raise
+        return self._version(version, entry)
+
+
+class ServedModel:
+    """A loaded model plus the number of requests currently using it."""
+
+    def __init__(self, version: ModelVersion, model):
+        self.version = version
+        self.model = model
+        self.refs = 0
+
+
+class ModelSlot:
+    """The model that serves requests.
+
+    Requests take a lease for their whole prediction. `swap` replaces the
+    model atomically between leases, and `drain` waits until the leases on
+    the previous model are returned.
+    """
+
+    def __init__(self):
+        self._current = None
+        self._cond = threading.Condition()
+
+    @property
+    def current(self) -> Optional[ServedModel]:
+        return self._current
+
+    @contextmanager
+    def lease(self, load_default):
+        with self._cond:
+            if self._current is None:
+                # Cold start: the first request loads the model, later ones wait for it
+                self._current = load_default()
+            served = self._current
+            served.refs += 1
+        try:
+            yield served
+        finally:
+            with self._cond:
+                served.refs -= 1
+                if served.refs == 0:
+                    self._cond.notify_all()
+
+    def swap(self, served: ServedModel) -> Optional[ServedModel]:
+        with self._cond:
+            previous, self._current = self._current, served
+        return previous
+
+    def drain(self, served: ServedModel, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: served.refs == 0, timeout)
+
+
+def main():
+    default_root = os.getenv(
+        "MODEL_REGISTRY_DIR", str(Path(__file__).resolve().parents[1] / "data" / "models" / "registry")
+    )
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry")
+    parser.add_argument("--root", default=default_root, help="Registry directory (default: MODEL_REGISTRY_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("register", help="Copy a checkpoint into the registry as a new version")
+    p.add_argument("checkpoint")
+    p.add_argument("--version", required=True)
+    p.add_argument("--arch", default=None, help="Override the checkpoint's arch key")
+    p.add_argument("--rules", default=None, help="Symptom rules JSON for this version")
+    p.add_argument("--cascade-gate", default=None, help="Cascade gate JSON for this version")
+    p.add_argument("--fast-model", default=None, help="Cascade fast-model checkpoint for this version")
+    p.add_argument("--notes", default="")
+    p.add_argument("--activate", action="store_true", help="Make it the active version (applied on restart, "
+                   "by the registry watcher, or via POST /admin/models/{version}/activate)")
+
+    commands.add_parser("list", help="List versions")
+    p = commands.add_parser("activate", help="Mark a version active in the manifest")
+    p.add_argument("version")
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.root)
+    if args.command == "register":
+        version = registry.register(
+            args.checkpoint, args.version, args.arch, args.rules, args.cascade_gate, args.fast_model, args.notes
+        )
+        print(f"Registered {version.version} ({version.sha256[:12]}) in {registry.root}")
+        if args.activate:
+            registry.set_active(version.version)
+            print(f"Active version: {version.version}")
+    elif args.command == "activate":
+        registry.set_active(args.version)
+        print(f"Active version: {args.version}")
+    else:
+        active = registry.active_version()
+        for version in registry.versions():
+            marker = "*" if version.version == active else " "
+            print(f"{marker} {version.version:<16} {version.arch or '-':<20} {version.created_at or '-':<32} {version.notes}")
+
+
+if __name__ == "__main__":
+    main()
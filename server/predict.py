@@ -1,17 +1,49 @@
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
-from PIL import Image
+"""Inference service: configuration, risk post-processing and the serving slot.
+
+This module stays free of torch so the API (and tools that only need the
+labels or symptom rules) import quickly. The networks and the predictor
+live in server/model.py and server/decode.py, imported when the first
+model is loaded.
+"""
 import numpy as np
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+from functools import partial
+from dataclasses import dataclass, fields
 from pathlib import Path
 
+from .lanes import DEFAULT_LANES, LaneScheduler, parse_lanes
+from .metrics import MODEL_INFO, MODEL_SWAPS
+from .model_registry import ModelRegistry, ModelSlot, ServedModel
+
 # ==========================================
 # 1. CONFIGURATION
 # ==========================================
-DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
 _DEFAULT_MODEL_PATH = Path(__file__).resolve().parents[1] / "data" / "models" / "efficientnet_b2_pad_ufes_best.pth"
 MODEL_PATH = os.getenv("MODEL_PATH", str(_DEFAULT_MODEL_PATH))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+# Priority lanes as name:weight:max_queue:slo_ms (see server/lanes.py)
+INFERENCE_LANES = os.getenv("INFERENCE_LANES", DEFAULT_LANES)
+# Versioned checkpoints with a manifest (see server/model_registry.py); MODEL_PATH is used without one
+_DEFAULT_REGISTRY_DIR = Path(__file__).resolve().parents[1] / "data" / "models" / "registry"
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", str(_DEFAULT_REGISTRY_DIR))
+# Forward passes run on a new version before it takes traffic
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "2"))
+# Longest wait for in-flight requests on a replaced model before it is released anyway
+MODEL_DRAIN_TIMEOUT_S = float(os.getenv("MODEL_DRAIN_TIMEOUT_S", "120"))
+# Seconds between manifest checks so every worker follows the active version (0 disables)
+MODEL_REGISTRY_POLL_S = float(os.getenv("MODEL_REGISTRY_POLL_S", "0"))
+# Architecture of checkpoints without an "arch" key (see MODEL_ARCHS in server/model.py)
+MODEL_ARCH = os.getenv("MODEL_ARCH", "")
+# Optional JSON overriding the symptom rule parameters (see training/calibrate_rules.py)
+SYMPTOM_RULES_PATH = os.getenv("SYMPTOM_RULES_PATH", "")
+# Optional JSON enabling the confidence-gated cascade (see CascadeGate)
+CASCADE_GATE_PATH = os.getenv("CASCADE_GATE_PATH", "")
+# Optional small checkpoint for the cascade's first pass (default: center view of the main model)
+CASCADE_FAST_MODEL_PATH = os.getenv("CASCADE_FAST_MODEL_PATH", "")
 
 LABELS = {
     0: "Low Risk (Benign)",
@@ -56,162 +88,301 @@ RECOMMENDATIONS = {
 
 
 # ==========================================
-# 2. MODEL ARCHITECTURE
+# 2. SYMPTOM RULES & POST-PROCESSING
 # ==========================================
-class DermSightModel(nn.Module):
-    def __init__(self):
-        super().__init__()
-        base = models.efficientnet_b2(weights=None)
-        in_features = base.classifier[1].in_features
-        base.classifier[1] = nn.Linear(in_features, 3)
-        # Expose features and classifier at top level (no wrapper prefix)
-        self.features = base.features
-        self.avgpool = base.avgpool
-        self.classifier = base.classifier
-
-    def forward(self, image):
-        x = self.features(image)
-        x = self.avgpool(x)
-        x = torch.flatten(x, 1)
-        x = self.classifier(x)
-        return x
+HIGH_RISK_THRESHOLD = 0.30
+MIN_DANGER_FLAGS = 2
+DANGER_BOOST = 0.15
+BLEED_GREW_FACTOR = 1.25
+
+SYMPTOM_NAMES = ("itch", "bleed", "grew", "elevation")
+
+
+@dataclass(frozen=True)
+class SymptomRules:
+    """Parameters of the symptom re-weighting and high-risk override.
+
+    Fields may also be numpy arrays that broadcast against the batch axis,
+    e.g. shape [G, 1] to evaluate G rule variants in one call (see
+    training/calibrate_rules.py).
+    """
+    high_risk_threshold: float = HIGH_RISK_THRESHOLD
+    min_danger_flags: int = MIN_DANGER_FLAGS
+    danger_boost: float = DANGER_BOOST
+    bleed_grew_factor: float = BLEED_GREW_FACTOR
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a JSON config such as the one written by calibrate_rules.py; unknown keys are ignored."""
+        with open(path) as handle:
+            data = json.load(handle)
+        return cls(**{field.name: data[field.name] for field in fields(cls) if field.name in data})
+
+
+DEFAULT_RULES = SymptomRules()
+
+
+def apply_symptom_rules(probs, symptom_flags, rules=DEFAULT_RULES):
+    """Vectorized symptom re-weighting and high-risk override.
+
+    probs: [N, 3] averaged class probabilities.
+    symptom_flags: [N, 4] booleans ordered as SYMPTOM_NAMES.
+    Returns (adjusted probs [N, 3], prediction index [N], danger count [N]).
+    With array-valued rules of shape [G, 1] the first two gain a leading
+    grid axis: [G, N, 3] and [G, N].
+    """
+    probs = np.asarray(probs)
+    flags = np.asarray(symptom_flags, dtype=bool).reshape(-1, len(SYMPTOM_NAMES))
+    itch, bleed, grew, elevation = flags.T
+    danger_count = flags.sum(axis=1)
+
+    # Boost factors use the same scalar arithmetic as the original per-image
+    # path (`probs[2] *= python_float`), rounding back to the probs dtype after
+    # each factor, so single-image results stay identical.
+    factor_dtype = (probs.dtype.type(1.0) * 1.0).dtype
+    one = factor_dtype.type(1.0)
+    boosted = danger_count >= np.asarray(rules.min_danger_flags)
+    danger_factor = np.where(boosted, 1.0 + np.asarray(rules.danger_boost) * danger_count, 1.0)
+    bleed_grew = np.where(bleed & grew, np.asarray(rules.bleed_grew_factor, dtype=factor_dtype), one)
+    high = (probs[..., 2] * danger_factor.astype(factor_dtype)).astype(probs.dtype)
+    high = (high * bleed_grew).astype(probs.dtype)
+
+    adjusted = np.concatenate(
+        [np.broadcast_to(probs[..., :2], high.shape + (2,)), high[..., np.newaxis]], axis=-1
+    )
+    total = adjusted.sum(axis=-1, keepdims=True)
+    np.divide(adjusted, total, out=adjusted, where=total > 0)
+
+    prediction_idx = np.argmax(adjusted, axis=-1)
+    threshold = np.asarray(rules.high_risk_threshold, dtype=probs.dtype)
+    prediction_idx[adjusted[..., 2] > threshold] = 2
+    return adjusted, prediction_idx, danger_count
+
+
+def build_results(probs, symptom_flags, rules=DEFAULT_RULES):
+    """Apply the symptom rules to a batch and build one result dict per row."""
+    flags = np.asarray(symptom_flags, dtype=bool).reshape(-1, len(SYMPTOM_NAMES))
+    adjusted, prediction_idx, danger_count = apply_symptom_rules(probs, flags, rules)
+
+    results = []
+    for row, idx, row_flags, dangers in zip(adjusted, prediction_idx, flags, danger_count):
+        idx = int(idx)
+        symptoms_used = {name: bool(flag) for name, flag in zip(SYMPTOM_NAMES, row_flags)}
+        symptoms_used["danger_flags"] = int(dangers)
+        results.append({
+            "prediction": f"{RISK_EMOJI[idx]} {LABELS[idx]}",
+            "risk_level": idx,
+            "confidence": round(float(row[idx]) * 100, 1),
+            "scores": {
+                "low_risk": round(float(row[0]) * 100, 1),
+                "medium_risk": round(float(row[1]) * 100, 1),
+                "high_risk": round(float(row[2]) * 100, 1),
+            },
+            "recommendation": RECOMMENDATIONS[idx],
+            "symptoms_used": symptoms_used,
+        })
+    return results
+
+
+@dataclass(frozen=True)
+class CascadeGate:
+    """When a first, cheap pass may answer on its own.
+
+    The first pass is one center view (of the main model, or of the fast model
+    when one is configured). A request exits early only if the top-two margin of
+    its symptom-adjusted probabilities is at least `min_margin` and its adjusted
+    high-risk probability is more than `high_risk_band` away from the override
+    threshold; everything else is escalated to the full TTA pass. Like
+    SymptomRules, fields may be [G, 1] arrays to evaluate G gates at once.
+    """
+    min_margin: float = 0.5
+    high_risk_band: float = 0.1
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a JSON config such as the one written by `calibrate_rules.py gate`; unknown keys are ignored."""
+        with open(path) as handle:
+            data = json.load(handle)
+        return cls(**{field.name: data[field.name] for field in fields(cls) if field.name in data})
+
+
+def cascade_exit(adjusted, gate, rules=DEFAULT_RULES):
+    """Boolean early-exit mask for symptom-adjusted first-pass probabilities [N, 3].
+
+    Returns [N], or [G, N] for array-valued gate fields of shape [G, 1].
+    """
+    adjusted = np.asarray(adjusted)
+    top_two = np.sort(adjusted, axis=-1)[..., -2:]
+    margin = top_two[..., 1] - top_two[..., 0]
+    near_override = np.abs(adjusted[..., 2] - np.asarray(rules.high_risk_threshold)) <= np.asarray(gate.high_risk_band)
+    return (margin >= np.asarray(gate.min_margin)) & ~near_override
 
 
 # ==========================================
-# 3. PREDICTION ENGINE
+# 3. SINGLETON HELPER
 # ==========================================
-class DermSightPredictor:
-    def __init__(self, model_path):
-        self.device = DEVICE
-        print(f"Loading DermSight model on {self.device}...")
-
-        self.model = DermSightModel().to(self.device)
-
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model not found: {model_path}")
-
-        raw = torch.load(model_path, map_location=self.device, weights_only=False)
-
-        # Handle different checkpoint formats
-        if isinstance(raw, dict) and "model_state_dict" in raw:
-            state_dict = raw["model_state_dict"]
-        elif isinstance(raw, dict) and "state_dict" in raw:
-            state_dict = raw["state_dict"]
-        elif isinstance(raw, dict):
-            state_dict = raw
-        else:
-            # torch.save(model, ...) was used — extract state_dict
-            state_dict = raw.state_dict()
-
-        # Strip 'backbone.' prefix if present (training saved with wrapper)
-        cleaned = {}
-        for k, v in state_dict.items():
-            new_key = k.replace("backbone.", "") if k.startswith("backbone.") else k
-            cleaned[new_key] = v
-
-        # Drop num_batches_tracked if missing in model
-        model_keys = set(self.model.state_dict().keys())
-        cleaned = {k: v for k, v in cleaned.items() if k in model_keys}
-
-        self.model.load_state_dict(cleaned, strict=False)
-        self.model.eval()
-        print(f"Model loaded: {model_path} ({len(cleaned)} keys matched)")
-
-        self.transform = transforms.Compose([
-            transforms.Resize((260, 260)),
-            transforms.CenterCrop((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ])
-
-        self.tta_transforms = [
-            self.transform,
-            transforms.Compose([
-                transforms.Resize((260, 260)),
-                transforms.CenterCrop((224, 224)),
-                transforms.RandomHorizontalFlip(p=1.0),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-            ]),
-            transforms.Compose([
-                transforms.Resize((260, 260)),
-                transforms.CenterCrop((224, 224)),
-                transforms.RandomVerticalFlip(p=1.0),
-                transforms.ToTensor(),
-                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-            ]),
-        ]
-
-    def predict(self, image_path, itch=False, bleed=False, grew=False, elevation=False):
+_registry = ModelRegistry(MODEL_REGISTRY_DIR, default_checkpoint=MODEL_PATH)
+_slot = ModelSlot()
+_swap_lock = threading.Lock()
+_swap_status = {"state": "idle"}
+
+
+def _build_predictor(version):
+    from .model import DermSightPredictor
+
+    return DermSightPredictor(
+        str(version.checkpoint),
+        arch=version.arch,
+        rules=SymptomRules.from_file(version.rules) if version.rules else None,
+        cascade=CascadeGate.from_file(version.cascade_gate) if version.cascade_gate else None,
+        fast_model_path=str(version.fast_model) if version.fast_model else None,
+    )
+
+
+def _load_version(version):
+    served = ServedModel(version, _build_predictor(version))
+    MODEL_INFO.set(1, version=version.version)
+    return served
+
+
+def load_candidate(name):
+    """Load and warm a registry version without serving it (see server/shadow.py)."""
+    version = _registry.get(name)
+    predictor = _build_predictor(version)
+    predictor.warmup()
+    return ServedModel(version, predictor)
+
+
+def load_model_and_predict(
+    image, itch=False, bleed=False, grew=False, elevation=False, model_path=MODEL_PATH, capture=None
+):
+    registry = _registry if model_path == MODEL_PATH else ModelRegistry(MODEL_REGISTRY_DIR, model_path)
+    with _slot.lease(lambda: _load_version(registry.resolve())) as served:
+        result = served.model.predict(image, itch, bleed, grew, elevation, capture)
+    result["model_version"] = served.version.version
+    return result
+
+
+def load_model_and_embed(image, model_path=MODEL_PATH):
+    """(normalized embedding [D], serving model version) for one image (see server/similarity.py)."""
+    registry = _registry if model_path == MODEL_PATH else ModelRegistry(MODEL_REGISTRY_DIR, model_path)
+    with _slot.lease(lambda: _load_version(registry.resolve())) as served:
+        embedding = served.model.embed([image])[0]
+    return embedding, served.version.version
+
+
+def model_status():
+    current = _slot.current
+    return {
+        "serving": current.version.to_dict() if current else None,
+        "active": _registry.active_version(),
+        "swap": dict(_swap_status),
+        "versions": [version.to_dict() for version in _registry.versions()],
+    }
+
+
+def swap_in_progress():
+    return _swap_lock.locked()
+
+
+def activate_version(name, persist=True):
+    """Load, warm and swap in a registry version; returns once the old model has drained.
+
+    Raises KeyError for unknown versions and RuntimeError if a swap is already running.
+    """
+    if not _swap_lock.acquire(blocking=False):
+        raise RuntimeError("A model swap is already in progress")
+    try:
+        version = _registry.get(name)
+        current = _slot.current
+        if current is not None and current.version.version == name:
+            if persist:
+                _registry.set_active(name)
+            return dict(_swap_status)
+
+        _swap_status.update(state="loading", version=name, previous=None, error=None)
+        served = _load_version(version)
+        _swap_status.update(state="warming")
+        served.model.warmup()
+        previous = _slot.swap(served)
+        if persist:
+            _registry.set_active(name)
+        MODEL_SWAPS.inc(outcome="ok")
+
+        if previous is not None:
+            _swap_status.update(state="draining", previous=previous.version.version)
+            if not _slot.drain(previous, MODEL_DRAIN_TIMEOUT_S):
+                print(f"Model {previous.version.version} still had {previous.refs} requests after draining")
+            MODEL_INFO.set(0, version=previous.version.version)
+        _swap_status.update(state="active")
+        return dict(_swap_status)
+    except Exception as exc:
+        MODEL_SWAPS.inc(outcome="error")
+        _swap_status.update(state="failed", error=str(exc))
+        raise
+    finally:
+        _swap_lock.release()
+
+
+# Loading and warming stay off the inference workers so traffic keeps flowing during a swap
+_loader_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+
+
+async def activate_version_async(name, persist=True):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_loader_executor, activate_version, name, persist)
+
+
+async def watch_registry(interval_s):
+    """Follow the manifest's active version, so every worker picks up a promotion."""
+    while True:
+        await asyncio.sleep(interval_s)
         try:
-            image = Image.open(image_path).convert('RGB')
-        except Exception as e:
-            return {"error": f"Image load failed: {str(e)}"}
-
-        all_probs = []
-        with torch.no_grad():
-            for t in self.tta_transforms:
-                tensor = t(image).unsqueeze(0).to(self.device)
-                logits = self.model(tensor)
-                probs = torch.softmax(logits, dim=1).cpu().numpy()[0]
-                all_probs.append(probs)
-
-        avg_probs = np.mean(all_probs, axis=0)
-
-        symptom_flags = [itch, bleed, grew, elevation]
-        danger_count = sum(symptom_flags)
-        if danger_count >= 2:
-            avg_probs[2] *= (1.0 + 0.15 * danger_count)
-        if bleed and grew:
-            avg_probs[2] *= 1.25
-
-        total = avg_probs.sum()
-        if total > 0:
-            avg_probs = avg_probs / total
-
-        prediction_idx = int(np.argmax(avg_probs))
-
-        if avg_probs[2] > 0.30:
-            prediction_idx = 2
-
-        result = {
-            "prediction": f"{RISK_EMOJI[prediction_idx]} {LABELS[prediction_idx]}",
-            "risk_level": prediction_idx,
-            "confidence": round(float(avg_probs[prediction_idx]) * 100, 1),
-            "scores": {
-                "low_risk": round(float(avg_probs[0]) * 100, 1),
-                "medium_risk": round(float(avg_probs[1]) * 100, 1),
-                "high_risk": round(float(avg_probs[2]) * 100, 1),
-            },
-            "recommendation": RECOMMENDATIONS[prediction_idx],
-            "symptoms_used": {
-                "itch": itch,
-                "bleed": bleed,
-                "grew": grew,
-                "elevation": elevation,
-                "danger_flags": danger_count,
-            }
-        }
-        return result
+            active = _registry.active_version()
+            current = _slot.current
+            if active and current is not None and current.version.version != active and not swap_in_progress():
+                await activate_version_async(active, persist=False)
+        except Exception as exc:
+            print(f"Registry watch failed: {exc}")
 
 
-# ==========================================
-# 4. SINGLETON HELPER
-# ==========================================
-_predictor = None
+# Inference runs off the event loop, on workers shared by priority lanes (see server/lanes.py)
+_scheduler = LaneScheduler(parse_lanes(INFERENCE_LANES), INFERENCE_WORKERS)
+
+
+def inference_lanes():
+    return _scheduler.lanes
+
+
+def lane_status():
+    return _scheduler.status()
 
 
-def load_model_and_predict(image_path, itch=False, bleed=False, grew=False, elevation=False, model_path=MODEL_PATH):
-    global _predictor
-    if _predictor is None:
-        _predictor = DermSightPredictor(model_path)
-    return _predictor.predict(image_path, itch, bleed, grew, elevation)
+async def predict_async(
+    image, itch=False, bleed=False, grew=False, elevation=False, capture=None, lane="interactive"
+):
+    """Queue a prediction on `lane`; raises LaneFull when that lane's queue is at its limit.
+
+    Cancelling the await also cancels the job if no worker has picked it up yet.
+    """
+    future = _scheduler.submit(
+        lane, partial(load_model_and_predict, image, itch, bleed, grew, elevation, capture=capture)
+    )
+    return await asyncio.wrap_future(future)
+
+
+async def embed_async(image, lane="background"):
+    """Queue an embedding on `lane` (background by default: nobody waits on it)."""
+    future = _scheduler.submit(lane, partial(load_model_and_embed, image))
+    return await asyncio.wrap_future(future)
 
 
 # ==========================================
-# 5. STANDALONE TEST
+# 4. STANDALONE TEST
 # ==========================================
 if __name__ == "__main__":
+    from .model import DermSightPredictor
+
     engine = DermSightPredictor(MODEL_PATH)
     test_image = Path(__file__).resolve().parents[1] / "data" / "PAD_UFES" / "imgs_part_1" / "imgs_part_1" / "PAT_9_13_1.png"
     if test_image.exists():
@@ -0,0 +1,142 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+_DEFAULT_PROFILE_DIR = Path(__file__).resolve().parent / "profiles"
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", _DEFAULT_PROFILE_DIR))
+
+_active = None
+_active_lock = threading.Lock()
+
+
+class ProfileSession:
+    """Profiles one predict() call: cProfile for the Python path, torch.profiler for the forward."""
+
+    def __init__(self, capture, index: int):
+        self.capture = capture
+        self.index = index
+        self.profiler = cProfile.Profile()
+        self.torch_profile = None
+
+    def __enter__(self):
+        try:
+            self.profiler.enable()
+        except Exception as exc:
+            # e.g. another cProfile already running in this process (Python 3.12+);
+            # the request still runs, just unprofiled
+            print(f"Profiling request {self.index} skipped: {exc}")
+            self.profiler = None
+            self.capture.release()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is None:
+            return False
+        self.profiler.disable()
+        try:
+            path = self.capture.output_dir / f"request_{self.index}.pstats"
+            self.profiler.dump_stats(str(path))
+            self.capture.record(path)
+            # Trace export is slow, so it happens after the Python profile stops
+            if self.torch_profile is not None:
+                trace_path = self.capture.output_dir / f"forward_{self.index}.trace.json"
+                self.torch_profile.export_chrome_trace(str(trace_path))
+                ops_path = self.capture.output_dir / f"forward_{self.index}_ops.txt"
+                ops_path.write_text(
+                    self.torch_profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=40)
+                )
+                self.capture.record(trace_path, ops_path)
+        finally:
+            self.capture.release()
+        return False
+
+    @contextmanager
+    def forward(self):
+        if self.profiler is None:
+            yield
+            return
+        from torch.profiler import ProfilerActivity, profile
+
+        with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+            yield
+        self.torch_profile = prof
+
+
+class ProfileCapture:
+    def __init__(self, duration_s: float, max_requests: int):
+        self.deadline = time.monotonic() + duration_s
+        self.max_requests = max_requests
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        self.output_dir = PROFILE_DIR / stamp
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.artifacts = []
+        self._claimed = 0
+        self._open = 0
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self._claimed >= self.max_requests or time.monotonic() >= self.deadline
+
+    @property
+    def finished(self) -> bool:
+        return self.done and self._open == 0
+
+    def claim(self):
+        with self._lock:
+            if self.done:
+                return None
+            self._claimed += 1
+            self._open += 1
+            return ProfileSession(self, self._claimed)
+
+    def release(self):
+        with self._lock:
+            self._open -= 1
+
+    def record(self, *paths):
+        with self._lock:
+            self.artifacts.extend(str(path) for path in paths)
+
+    def summarize(self) -> dict:
+        with self._lock:
+            pstats_files = [p for p in self.artifacts if p.endswith(".pstats")]
+            artifacts = list(self.artifacts)
+        if pstats_files:
+            stats = pstats.Stats(pstats_files[0])
+            for path in pstats_files[1:]:
+                stats.add(path)
+            combined = self.output_dir / "combined.pstats"
+            stats.dump_stats(str(combined))
+            buffer = io.StringIO()
+            pstats.Stats(str(combined), stream=buffer).sort_stats("cumulative").print_stats(30)
+            summary = self.output_dir / "python_top.txt"
+            summary.write_text(buffer.getvalue())
+            artifacts += [str(combined), str(summary)]
+        return {
+            "output_dir": str(self.output_dir),
+            "requests_profiled": len(pstats_files),
+            "artifacts": artifacts,
+        }
+
+
+def start_capture(duration_s: float, max_requests: int) -> ProfileCapture:
+    global _active
+    with _active_lock:
+        if _active is not None and not _active.done:
+            raise RuntimeError("A profile capture is already running")
+        _active = ProfileCapture(duration_s, max_requests)
+        return _active
+
+
+def claim_session():
+    capture = _active
+    if capture is None:
+        return None
+    return capture.claim()
@@ -0,0 +1,142 @@
+"""Image quality gate run on uploads before the model.
+
+Checks run on a downscaled copy of the decoded image (at most
+QUALITY_ANALYSIS_SIZE pixels on the short side), as array ops in NumPy:
+  - resolution: short side of the original image,
+  - blur: variance of the 4-neighbour Laplacian of the luminance,
+  - exposure: mean luminance plus the share of clipped dark / bright pixels,
+  - saturation: mean HSV saturation (grayscale or washed-out photos),
+  - skin: share of pixels inside a YCbCr skin-tone box.
+Limits come from QUALITY_* environment variables; QUALITY_GATE=off disables
+rejection but still records the metrics.
+"""
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+from PIL import Image
+
+from .metrics import QUALITY_CHECKS, QUALITY_FAILURES, stage_timer
+
+QUALITY_GATE = os.getenv("QUALITY_GATE", "on").strip().lower() not in {"off", "0", "false", "no"}
+QUALITY_ANALYSIS_SIZE = int(os.getenv("QUALITY_ANALYSIS_SIZE", "256"))
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+@dataclass(frozen=True)
+class QualityLimits:
+    min_side: int = int(os.getenv("QUALITY_MIN_SIDE", "224"))
+    min_sharpness: float = _env_float("QUALITY_MIN_SHARPNESS", 15.0)
+    min_brightness: float = _env_float("QUALITY_MIN_BRIGHTNESS", 30.0)
+    max_brightness: float = _env_float("QUALITY_MAX_BRIGHTNESS", 235.0)
+    max_clipped_fraction: float = _env_float("QUALITY_MAX_CLIPPED", 0.4)
+    min_saturation: float = _env_float("QUALITY_MIN_SATURATION", 0.04)
+    min_skin_fraction: float = _env_float("QUALITY_MIN_SKIN", 0.05)
+
+
+DEFAULT_LIMITS = QualityLimits()
+
+
+@dataclass
+class QualityReport:
+    passed: bool
+    metrics: dict
+    reasons: list = field(default_factory=list)
+
+
+def _image_size(image) -> tuple:
+    if isinstance(image, Image.Image):
+        return image.size
+    return image.shape[2], image.shape[1]
+
+
+def _analysis_copy(image) -> np.ndarray:
+    """float32 [H, W, 3] in 0..255, reduced by an integer box factor (cheap even for 12 MP)."""
+    factor = max(1, min(_image_size(image)) // QUALITY_ANALYSIS_SIZE)
+    if not isinstance(image, Image.Image):
+        # uint8 [3, H, W] tensor from the fast decode backends, so torch is already loaded
+        import torch.nn.functional as F
+
+        small = image.unsqueeze(0).float()
+        if factor > 1:
+            small = F.avg_pool2d(small, factor)
+        return small[0].permute(1, 2, 0).numpy()
+    small = image.reduce(factor) if factor > 1 else image
+    return np.asarray(small, dtype=np.float32)
+
+
+def image_metrics(pixels: np.ndarray) -> dict:
+    """Quality statistics of an RGB float array [H, W, 3] in 0..255."""
+    r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    luma = 0.299 * r + 0.587 * g + 0.114 * b
+    laplacian = (
+        luma[:-2, 1:-1] + luma[2:, 1:-1] + luma[1:-1, :-2] + luma[1:-1, 2:] - 4.0 * luma[1:-1, 1:-1]
+    )
+    high = pixels.max(axis=-1)
+    low = pixels.min(axis=-1)
+    saturation = np.divide(high - low, high, out=np.zeros_like(high), where=high > 0)
+    # Chai & Ngan skin box on the chroma channels
+    cb = 128.0 - 0.168736 * r - 0.331264 * g + 0.5 * b
+    cr = 128.0 + 0.5 * r - 0.418688 * g - 0.081312 * b
+    skin = (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173)
+    return {
+        "sharpness": float(laplacian.var()) if laplacian.size else 0.0,
+        "brightness": float(luma.mean()),
+        "dark_fraction": float((luma <= 8).mean()),
+        "bright_fraction": float((luma >= 247).mean()),
+        "saturation": float(saturation.mean()),
+        "skin_fraction": float(skin.mean()),
+    }
+
+
+def _reason(check, value, limit, message):
+    return {"check": check, "value": round(float(value), 4), "limit": limit, "message": message}
+
+
+def assess_image(image, limits: QualityLimits = DEFAULT_LIMITS, size=None) -> QualityReport:
+    """Score a decoded RGB image; `reasons` lists every failed check.
+
+    image: a PIL image or a uint8 [3, H, W] tensor (see server/decode.py).
+    size: (width, height) of the original upload when `image` was decoded
+    at reduced size; defaults to the image's own size.
+    """
+    size = size or _image_size(image)
+    with stage_timer("quality"):
+        metrics = image_metrics(_analysis_copy(image))
+        metrics["width"], metrics["height"] = size
+
+        reasons = []
+        short_side = min(size)
+        if short_side < limits.min_side:
+            reasons.append(_reason(
+                "resolution", short_side, limits.min_side, f"Image is too small (shorter side {short_side}px)."
+            ))
+        if metrics["sharpness"] < limits.min_sharpness:
+            reasons.append(_reason(
+                "blur", metrics["sharpness"], limits.min_sharpness, "Image is too blurry; hold the camera steady and refocus."
+            ))
+        if metrics["brightness"] < limits.min_brightness or metrics["dark_fraction"] > limits.max_clipped_fraction:
+            reasons.append(_reason(
+                "underexposed", metrics["brightness"], limits.min_brightness, "Image is too dark; add light."
+            ))
+        if metrics["brightness"] > limits.max_brightness or metrics["bright_fraction"] > limits.max_clipped_fraction:
+            reasons.append(_reason(
+                "overexposed", metrics["brightness"], limits.max_brightness, "Image is over-exposed; avoid flash glare."
+            ))
+        if metrics["saturation"] < limits.min_saturation:
+            reasons.append(_reason(
+                "saturation", metrics["saturation"], limits.min_saturation, "Image has almost no colour; use a colour photo."
+            ))
+        if metrics["skin_fraction"] < limits.min_skin_fraction:
+            reasons.append(_reason(
+                "not_skin", metrics["skin_fraction"], limits.min_skin_fraction, "No skin detected; photograph the affected area."
+            ))
+
+    for reason in reasons:
+        QUALITY_FAILURES.inc(reason=reason["check"])
+    passed = not reasons or not QUALITY_GATE
+    QUALITY_CHECKS.inc(outcome="passed" if not reasons else "rejected" if QUALITY_GATE else "would_reject")
+    return QualityReport(passed=passed, metrics={k: round(v, 4) for k, v in metrics.items()}, reasons=reasons)
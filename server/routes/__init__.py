@@ -2,5 +2,6 @@ from .auth import router as auth_router
 from .inference import router as predict_router
 from .triage import router as triage_router
 from .explain import router as explain_router
+from .admin import router as admin_router
 
-__all__ = ["auth_router", "triage_router", "predict_router", "explain_router"]
+__all__ = ["auth_router", "triage_router", "predict_router", "explain_router", "admin_router"]
@@ -0,0 +1,118 @@
+import asyncio
+import hmac
+import os
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, UploadFile
+from fastapi.responses import JSONResponse
+
+from .. import shadow
+from ..predict import activate_version_async, lane_status, model_status, predict_async, swap_in_progress
+from ..profiling import start_capture
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+# How long POST /admin/profile waits past its window for profiled requests to finish
+PROFILE_FINISH_GRACE_S = float(os.getenv("PROFILE_FINISH_GRACE_S", "60"))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@router.post("/profile", dependencies=[Depends(require_admin)])
+async def capture_profile(
+    duration_s: float = Query(default=30.0, gt=0, le=300),
+    max_requests: int = Query(default=5, ge=1, le=100),
+    image: Optional[UploadFile] = File(default=None),
+):
+    """Profile the next predict() calls until the window closes.
+
+    Live /predict traffic inside the window is captured. If an image is
+    uploaded it is run through the predictor once, so a profile can be
+    taken on an idle worker too.
+    """
+    try:
+        capture = start_capture(duration_s, max_requests)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+
+    if image is not None:
+        await predict_async(await image.read())
+
+    give_up = capture.deadline + PROFILE_FINISH_GRACE_S
+    while not capture.finished and time.monotonic() < give_up:
+        await asyncio.sleep(0.1)
+    return {**capture.summarize(), "complete": capture.finished}
+
+
+@router.get("/inference", dependencies=[Depends(require_admin)])
+async def inference_status():
+    """Per-lane queue depth, limits, rolling p95 latency and SLO attainment."""
+    return lane_status()
+
+
+@router.get("/models", dependencies=[Depends(require_admin)])
+async def list_models():
+    """Registry versions, the version serving traffic, the last swap and the shadow candidate."""
+    return {**model_status(), "shadow": shadow.status()}
+
+
+# Keeps background swaps referenced until they finish
+_swap_tasks = set()
+
+
+def _swap_done(task: asyncio.Task) -> None:
+    _swap_tasks.discard(task)
+    # Failures are reported through the swap status; retrieving them avoids "never retrieved" warnings
+    if not task.cancelled():
+        task.exception()
+
+
+@router.post("/models/{version}/activate", dependencies=[Depends(require_admin)])
+async def activate_model(version: str, wait: bool = Query(default=False)):
+    """Load and warm a registry version, then swap it in between requests.
+
+    In-flight predictions finish on the previous model, which is released
+    once they drain. Without `wait` the swap runs in the background and
+    its progress shows in GET /admin/models.
+    """
+    status = model_status()
+    if version not in {entry["version"] for entry in status["versions"]}:
+        raise HTTPException(status_code=404, detail=f"Unknown model version {version!r}")
+    if swap_in_progress():
+        raise HTTPException(status_code=409, detail="A model swap is already in progress")
+
+    if wait:
+        try:
+            return await activate_version_async(version)
+        except RuntimeError as exc:
+            raise HTTPException(status_code=409, detail=str(exc)) from exc
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=f"Model swap failed: {exc}") from exc
+
+    task = asyncio.create_task(activate_version_async(version))
+    _swap_tasks.add(task)
+    task.add_done_callback(_swap_done)
+    return JSONResponse(status_code=202, content={"version": version, "state": "loading"})
+
+
+@router.put("/shadow", dependencies=[Depends(require_admin)])
+async def set_shadow(version: str = Query(...), fraction: float = Query(default=0.1, gt=0, le=1)):
+    """Score `fraction` of /predict requests with a candidate registry version as well, off the response path."""
+    if version not in {entry["version"] for entry in model_status()["versions"]}:
+        raise HTTPException(status_code=404, detail=f"Unknown model version {version!r}")
+    try:
+        return await shadow.configure(version, fraction)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Loading the candidate failed: {exc}") from exc
+
+
+@router.delete("/shadow", dependencies=[Depends(require_admin)])
+async def clear_shadow():
+    return await shadow.configure(None, 0.0)
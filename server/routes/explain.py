@@ -3,8 +3,11 @@ from pydantic import BaseModel
 from typing import Dict, Optional
 import httpx
 import os
+import time
 from dotenv import load_dotenv
 
+from ..metrics import GROQ_LATENCY
+
 load_dotenv()
 
 router = APIRouter(prefix="/explain", tags=["explain"])
@@ -13,7 +16,7 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     print("WARNING: GROQ_API_KEY not set. AI explanations will fail.")
 
-GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_URL = os.getenv("GROQ_URL", "https://api.groq.com/openai/v1/chat/completions")
 MODEL = "llama-3.3-70b-versatile"
 
 
@@ -73,7 +76,13 @@ Itch: {req.symptoms_used.get('itch',False)}, Bleed: {req.symptoms_used.get('blee
 
     try:
         async with httpx.AsyncClient(timeout=30) as client:
-            resp = await client.post(GROQ_URL, headers=headers, json=payload)
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                resp = await client.post(GROQ_URL, headers=headers, json=payload)
+                outcome = str(resp.status_code)
+            finally:
+                GROQ_LATENCY.observe(time.perf_counter() - start, outcome=outcome)
             resp.raise_for_status()
             data = resp.json()
             explanation = data["choices"][0]["message"]["content"]
@@ -1,60 +1,113 @@
-from pathlib import Path
-import uuid
-import os
+import asyncio
+import hashlib
+from functools import partial
 
-from fastapi import APIRouter, File, Form, UploadFile, HTTPException
+from fastapi import APIRouter, File, Form, Query, UploadFile, HTTPException
 from fastapi.responses import JSONResponse
+from PIL import Image
 
-from ..predict import load_model_and_predict
+from .. import shadow
+from ..lanes import LaneFull
+from ..metrics import stage_timer
+from ..predict import inference_lanes, predict_async
+from ..quality import assess_image
+from ..singleflight import SingleFlight
 
 router = APIRouter(prefix="/predict", tags=["predict"])
 
-TEMP_DIR = Path(__file__).resolve().parents[1] / "tmp_uploads"
-TEMP_DIR.mkdir(parents=True, exist_ok=True)
-
 ACCEPTED_TYPES = {"image/jpeg", "image/png", "image/jpg"}
 MAX_SIZE = 10 * 1024 * 1024  # 10 MB
 
+# Concurrent uploads of the same bytes with the same symptoms share one decode + inference
+_inflight = SingleFlight("predict")
+
+
+def _decode_and_assess(data: bytes):
+    # Imported on first upload, not with the app: server/decode.py pulls in torch
+    from ..decode import decode_image
+
+    # Decoded once here (with DECODE_BACKEND); the quality gate and the predictor share the image
+    with stage_timer("upload_decode"):
+        decoded, size = decode_image(data)
+    return decoded, assess_image(decoded, size=size)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+async def _score_upload(data: bytes, flags: tuple, capture, lane: str):
+    loop = asyncio.get_running_loop()
+    try:
+        decoded, quality = await loop.run_in_executor(None, _decode_and_assess, data)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {e}")
+    if not quality.passed:
+        raise HTTPException(status_code=422, detail={
+            "message": "Image failed the quality check",
+            "reasons": quality.reasons,
+            "metrics": quality.metrics,
+        })
+
+    itch, bleed, grew, elevation = flags
+    try:
+        result = await predict_async(
+            image=decoded,
+            itch=itch,
+            bleed=bleed,
+            grew=grew,
+            elevation=elevation,
+            capture=capture,
+            lane=lane,
+        )
+    except LaneFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
 
 @router.post("")
 async def predict_case(
     image: UploadFile = File(...),
     symptoms: str = Form(""),
+    priority: str = Query("interactive", description="Inference lane: interactive, batch or background"),
 ):
+    if priority not in inference_lanes():
+        raise HTTPException(status_code=400, detail=f"Unknown priority {priority!r}")
+
     # Validate type
     if image.content_type not in ACCEPTED_TYPES:
         raise HTTPException(status_code=400, detail=f"Invalid file type: {image.content_type}")
 
     # Read and validate size
-    data = await image.read()
+    with stage_timer("upload_read"):
+        data = await image.read()
     if len(data) > MAX_SIZE:
         raise HTTPException(status_code=400, detail="File too large (max 10MB)")
 
-    # Save temp
-    file_ext = Path(image.filename or "").suffix.lower() or ".jpg"
-    temp_path = TEMP_DIR / f"{uuid.uuid4().hex}{file_ext}"
-
     try:
-        with temp_path.open("wb") as f:
-            f.write(data)
-
         # Parse symptoms string into boolean flags
         sym_lower = symptoms.lower() if symptoms else ""
         itch = any(k in sym_lower for k in ["itch", "itchy", "itching", "pruritus"])
         bleed = any(k in sym_lower for k in ["bleed", "bleeding", "blood"])
         grew = any(k in sym_lower for k in ["grew", "growing", "enlarged", "bigger", "growth", "size increase"])
         elevation = any(k in sym_lower for k in ["elevated", "raised", "bump", "elevation", "lump"])
+        flags = (itch, bleed, grew, elevation)
 
-        result = load_model_and_predict(
-            image_path=str(temp_path),
-            itch=itch,
-            bleed=bleed,
-            grew=grew,
-            elevation=elevation,
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, _sha256, data)
+
+        # Only the request that runs the computation fills `capture`, so duplicates are not shadowed twice
+        candidate = shadow.sample()
+        capture = {} if candidate is not None else None
+        # The lane is part of the key: an interactive request never waits on a queued batch job
+        result = await _inflight.run(
+            (digest, flags, priority), partial(_score_upload, data, flags, capture, priority)
         )
 
-        if "error" in result:
-            raise HTTPException(status_code=500, detail=result["error"])
+        if candidate is not None:
+            shadow.submit(candidate, capture, list(flags), result)
 
         return JSONResponse(content=result)
 
@@ -62,9 +115,3 @@ async def predict_case(
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if temp_path.exists():
-            try:
-                os.remove(temp_path)
-            except OSError:
-                pass
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from datetime import datetime, timezone
 from pathlib import Path
@@ -8,6 +9,7 @@ from bson import ObjectId
 from fastapi import APIRouter, File, Form, HTTPException, Query, UploadFile, status
 from pydantic import BaseModel
 
+from .. import similarity
 from ..db import db
 
 router = APIRouter(prefix="/triage", tags=["triage"])
@@ -16,6 +18,9 @@ MAX_UPLOAD_BYTES = 10 * 1024 * 1024
 DEFAULT_UPLOAD_DIR = Path(__file__).resolve().parent.parent / "uploads"
 UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", DEFAULT_UPLOAD_DIR))
 
+# Keeps background embedding tasks referenced until they finish
+_index_tasks = set()
+
 
 class TriageUploadResponse(BaseModel):
     id: str
@@ -35,6 +40,10 @@ class TriageCaseSummary(BaseModel):
     created_at: datetime
 
 
+class SimilarCase(TriageCaseSummary):
+    similarity: float
+
+
 def _serialize_case(doc: dict) -> TriageCaseSummary:
     return TriageCaseSummary(
         id=str(doc["_id"]),
@@ -88,6 +97,10 @@ async def upload_case(
         "created_at": datetime.now(timezone.utc),
     }
     result = await db.triage_cases.insert_one(doc)
+    if similarity.SIMILARITY_INDEXING:
+        task = asyncio.create_task(similarity.index_case(str(result.inserted_id), file_path, doc["created_at"]))
+        _index_tasks.add(task)
+        task.add_done_callback(_index_tasks.discard)
     return TriageUploadResponse(id=str(result.inserted_id), **doc)
 
 
@@ -118,3 +131,26 @@ async def get_case(case_id: str):
         raise HTTPException(status_code=404, detail="Case not found")
 
     return _serialize_case(doc)
+
+
+@router.get("/cases/{case_id}/similar", response_model=list[SimilarCase])
+async def similar_cases(case_id: str, k: int = Query(default=5, ge=1, le=50)):
+    """The k earlier cases whose images look most like this one (cosine of model embeddings)."""
+    try:
+        oid = ObjectId(case_id)
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="Invalid case id") from exc
+
+    doc = await db.triage_cases.find_one({"_id": oid}, {"embedding": 1, "embedding_version": 1, "created_at": 1})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Case not found")
+    if "embedding" not in doc:
+        raise HTTPException(status_code=409, detail="Case has not been indexed yet")
+
+    hits = await similarity.similar_cases(case_id, doc["embedding"], doc["embedding_version"], doc["created_at"], k)
+    cursor = db.triage_cases.find({"_id": {"$in": [ObjectId(case) for case, _ in hits]}}, {"embedding": 0})
+    docs = {str(found["_id"]): found async for found in cursor}
+    return [
+        SimilarCase(**_serialize_case(docs[case]).model_dump(), similarity=round(score, 4))
+        for case, score in hits if case in docs
+    ]
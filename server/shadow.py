@@ -0,0 +1,120 @@
+"""Shadow scoring of a candidate model on live /predict traffic.
+
+A sampled fraction of requests is also scored by a candidate registry
+version after the response is sent. The candidate reuses the tensor the
+serving model preprocessed for the views behind its answer (all TTA views,
+or only the center view when the cascade exits early), so both sides are
+compared on the same views and no image is decoded twice.
+Both outputs are logged to the `shadow_predictions` collection. Compare
+them with `python -m server.shadow_report`.
+
+Configure with SHADOW_VERSION and SHADOW_FRACTION, or at runtime via
+PUT/DELETE /admin/shadow.
+"""
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+from .db import db
+from .metrics import SHADOW_PREDICTIONS, stage_timer
+from .predict import SYMPTOM_NAMES, load_candidate
+
+SHADOW_VERSION = os.getenv("SHADOW_VERSION", "").strip()
+SHADOW_FRACTION = float(os.getenv("SHADOW_FRACTION", "0"))
+# Shadow jobs waiting or running before new samples are dropped
+SHADOW_MAX_PENDING = int(os.getenv("SHADOW_MAX_PENDING", "8"))
+
+# One worker, separate from inference, so shadow work never holds a serving slot
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+_candidate = None
+_fraction = 0.0
+_pending = 0
+_tasks = set()
+
+
+def status() -> dict:
+    return {
+        "version": _candidate.version.version if _candidate else None,
+        "fraction": _fraction,
+        "pending": _pending,
+    }
+
+
+async def configure(version: Optional[str], fraction: float) -> dict:
+    """Load `version` as the candidate (or stop shadowing when None) and set the sampled fraction."""
+    global _candidate, _fraction
+    if version is None:
+        _candidate, _fraction = None, 0.0
+        return status()
+    if _candidate is None or _candidate.version.version != version:
+        loop = asyncio.get_running_loop()
+        candidate = await loop.run_in_executor(_executor, load_candidate, version)
+        _candidate = candidate
+    _fraction = fraction
+    return status()
+
+
+def sample():
+    """The candidate to shadow this request with, or None."""
+    candidate = _candidate
+    if candidate is None or _fraction <= 0 or random.random() >= _fraction:
+        return None
+    if _pending >= SHADOW_MAX_PENDING:
+        SHADOW_PREDICTIONS.inc(outcome="dropped")
+        return None
+    return candidate
+
+
+def _score(candidate, batch, symptom_flags):
+    start = time.perf_counter()
+    with stage_timer("shadow_forward"):
+        probs, result = candidate.model.predict_preprocessed(batch, symptom_flags)
+    return probs, result, (time.perf_counter() - start) * 1000
+
+
+async def _shadow(candidate, capture: dict, symptom_flags, primary: dict) -> None:
+    global _pending
+    loop = asyncio.get_running_loop()
+    try:
+        probs, result, latency_ms = await loop.run_in_executor(
+            _executor, _score, candidate, capture["batch"], symptom_flags
+        )
+        await db.shadow_predictions.insert_one({
+            "created_at": datetime.now(timezone.utc),
+            "views": int(capture["batch"].shape[0]),
+            "symptoms": {name: bool(flag) for name, flag in zip(SYMPTOM_NAMES, symptom_flags)},
+            "primary": {
+                "version": primary.get("model_version"),
+                "probs": [float(p) for p in capture["probs"]],
+                "scores": primary["scores"],
+                "risk_level": primary["risk_level"],
+            },
+            "candidate": {
+                "version": candidate.version.version,
+                "probs": [float(p) for p in probs],
+                "scores": result["scores"],
+                "risk_level": result["risk_level"],
+                "latency_ms": round(latency_ms, 2),
+            },
+        })
+        SHADOW_PREDICTIONS.inc(outcome="logged")
+    except Exception as exc:
+        SHADOW_PREDICTIONS.inc(outcome="error")
+        print(f"Shadow scoring failed: {exc}")
+    finally:
+        _pending -= 1
+
+
+def submit(candidate, capture: dict, symptom_flags, primary: dict) -> None:
+    """Score and log in the background; the caller's response does not wait."""
+    global _pending
+    if "batch" not in capture or "error" in primary:
+        return
+    _pending += 1
+    task = asyncio.create_task(_shadow(candidate, capture, symptom_flags, primary))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
@@ -0,0 +1,127 @@
+"""Agreement report for shadow-scored candidate models.
+
+Reads the `shadow_predictions` collection written by server/shadow.py and
+reports, per (serving, candidate) version pair:
+  - agreement: share of requests where both chose the same risk level,
+  - the 3x3 flip matrix (rows = serving model, cols = candidate),
+  - high-risk flips in each direction,
+  - mean |P(high)| difference of the raw model probabilities,
+  - mean candidate forward latency.
+
+    python -m server.shadow_report --candidate v2 --since-hours 24 --output shadow.json
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+from .db import db
+from .predict import LABELS
+
+HIGH_RISK = 2
+
+
+async def flip_counts(match: dict) -> list:
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "primary_version": "$primary.version",
+                "candidate_version": "$candidate.version",
+                "primary": "$primary.risk_level",
+                "candidate": "$candidate.risk_level",
+            },
+            "count": {"$sum": 1},
+            "high_diff": {"$sum": {"$abs": {"$subtract": [
+                {"$arrayElemAt": ["$candidate.probs", HIGH_RISK]},
+                {"$arrayElemAt": ["$primary.probs", HIGH_RISK]},
+            ]}}},
+            "latency_ms": {"$sum": "$candidate.latency_ms"},
+        }},
+    ]
+    return await db.shadow_predictions.aggregate(pipeline).to_list(length=None)
+
+
+def summarize(groups: list) -> list:
+    pairs = {}
+    for group in groups:
+        key = (group["_id"]["primary_version"], group["_id"]["candidate_version"])
+        pair = pairs.setdefault(key, {"flips": np.zeros((3, 3), dtype=np.int64), "high_diff": 0.0, "latency_ms": 0.0})
+        pair["flips"][group["_id"]["primary"], group["_id"]["candidate"]] += group["count"]
+        pair["high_diff"] += group["high_diff"] or 0.0
+        pair["latency_ms"] += group["latency_ms"] or 0.0
+
+    reports = []
+    for (primary, candidate), pair in sorted(pairs.items(), key=lambda item: str(item[0])):
+        flips = pair["flips"]
+        total = int(flips.sum())
+        primary_high = int(flips[HIGH_RISK].sum())
+        primary_other = total - primary_high
+        reports.append({
+            "primary_version": primary,
+            "candidate_version": candidate,
+            "requests": total,
+            "agreement": round(float(np.trace(flips)) / total, 4),
+            # Serving model said high risk, candidate did not: the flips that matter most
+            "high_to_lower": int(primary_high - flips[HIGH_RISK, HIGH_RISK]),
+            "high_to_lower_rate": round(float(primary_high - flips[HIGH_RISK, HIGH_RISK]) / primary_high, 4)
+            if primary_high else 0.0,
+            "lower_to_high": int(flips[:HIGH_RISK, HIGH_RISK].sum()),
+            "lower_to_high_rate": round(float(flips[:HIGH_RISK, HIGH_RISK].sum()) / primary_other, 4)
+            if primary_other else 0.0,
+            "mean_abs_high_prob_diff": round(pair["high_diff"] / total, 4),
+            "mean_candidate_latency_ms": round(pair["latency_ms"] / total, 2),
+            "flip_matrix": flips.tolist(),
+        })
+    return reports
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['primary_version']} -> {report['candidate_version']}: {report['requests']} requests, "
+        f"agreement {report['agreement']:.1%}, high->lower {report['high_to_lower']} "
+        f"({report['high_to_lower_rate']:.1%}), lower->high {report['lower_to_high']} "
+        f"({report['lower_to_high_rate']:.1%}), mean |dP(high)| {report['mean_abs_high_prob_diff']:.4f}, "
+        f"candidate forward {report['mean_candidate_latency_ms']:.1f} ms"
+    )
+    names = [LABELS[i].split(" (")[0] for i in range(3)]
+    width = max(len(name) for name in names)
+    print("  rows = serving model, cols = candidate")
+    print(" " * (width + 4) + "".join(f"{name:>{width + 2}}" for name in names))
+    for name, row in zip(names, report["flip_matrix"]):
+        print(f"  {name:<{width + 2}}" + "".join(f"{count:>{width + 2}}" for count in row))
+
+
+async def run(args) -> list:
+    match = {}
+    if args.candidate:
+        match["candidate.version"] = args.candidate
+    if args.primary:
+        match["primary.version"] = args.primary
+    if args.since_hours:
+        match["created_at"] = {"$gte": datetime.now(timezone.utc) - timedelta(hours=args.since_hours)}
+    return summarize(await flip_counts(match))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agreement and risk-level flips of shadow-scored candidates")
+    parser.add_argument("--candidate", default=None, help="Only this candidate version")
+    parser.add_argument("--primary", default=None, help="Only this serving version")
+    parser.add_argument("--since-hours", type=float, default=None, help="Only recent shadow predictions")
+    parser.add_argument("--output", default=None, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    reports = asyncio.run(run(args))
+    if not reports:
+        print("No shadow predictions match.")
+    for report in reports:
+        print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
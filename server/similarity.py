@@ -0,0 +1,368 @@
+"""Similar-case retrieval over triage case embeddings.
+
+With SIMILARITY_INDEXING=on, each triage upload is embedded on the
+background inference lane: the serving model's pooled features (1408-d for
+efficientnet_b2), averaged over the TTA views and L2-normalized. The vector is stored on the case as fp16
+bytes (`embedding`, 2.8 KB) next to the model version that produced it
+(`embedding_version`). Vectors from different versions are never compared.
+
+Each process keeps one in-memory VectorIndex per model version. It is
+loaded from Mongo when the app starts and then synced incrementally by
+`embedded_at`, with an overlap window for late writes. Cosine similarity
+is a dot product of normalized vectors.
+  - exact (default): one matrix, one matmul per query. About 5 ms per 10k
+    cases on one core.
+  - ivf (SIMILARITY_INDEX=ivf): spherical k-means splits the cases into
+    SIMILARITY_NLIST lists (default ~sqrt(N)). A query scores only the
+    SIMILARITY_NPROBE lists whose centroids are closest. This keeps queries
+    in the low milliseconds at hundreds of thousands of cases, at a small
+    recall cost (see benchmarks/bench_similarity.py).
+In memory, vectors are float32: widening fp16 on every query costs more
+than the matmul itself.
+
+Embed cases uploaded before indexing existed with
+`python -m server.similarity backfill`.
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+from bson import ObjectId
+
+from .db import db
+
+# Embed new triage uploads on the background lane. Off by default: embedding
+# loads torch and the model in every worker that takes triage uploads
+SIMILARITY_INDEXING = os.getenv("SIMILARITY_INDEXING", "off").strip().lower() in {"on", "1", "true", "yes"}
+SIMILARITY_INDEX = os.getenv("SIMILARITY_INDEX", "exact").strip().lower()
+# IVF lists (0 = about sqrt(N) at training time) and lists scored per query
+SIMILARITY_NLIST = int(os.getenv("SIMILARITY_NLIST", "0"))
+SIMILARITY_NPROBE = int(os.getenv("SIMILARITY_NPROBE", "16"))
+# IVF needs this many vectors before the first training; until then it searches exactly
+SIMILARITY_MIN_TRAIN = int(os.getenv("SIMILARITY_MIN_TRAIN", "4096"))
+# Seconds between syncs with cases embedded by other workers
+SIMILARITY_REFRESH_S = float(os.getenv("SIMILARITY_REFRESH_S", "30"))
+# Each sync re-reads this many seconds before the newest embedded_at it has seen,
+# so writes that commit late (other workers, clock skew) are not skipped
+SIMILARITY_SYNC_OVERLAP_S = float(os.getenv("SIMILARITY_SYNC_OVERLAP_S", "300"))
+
+
+def encode(vector: np.ndarray) -> bytes:
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+
+def decode(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+
+
+class _List:
+    """Append-only keys, vectors and creation times, with amortized growth."""
+
+    def __init__(self, dim: int):
+        self.keys = []
+        self._vectors = np.empty((64, dim), dtype=np.float32)
+        self._stamps = np.empty(64, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:len(self.keys)]
+
+    @property
+    def stamps(self) -> np.ndarray:
+        return self._stamps[:len(self.keys)]
+
+    def add(self, key, vector, stamp: float) -> None:
+        if len(self.keys) == len(self._vectors):
+            grown = np.empty((2 * len(self._vectors), self._vectors.shape[1]), dtype=self._vectors.dtype)
+            grown[:len(self.keys)] = self._vectors
+            self._vectors = grown
+            stamps = np.empty(2 * len(self._stamps), dtype=np.float64)
+            stamps[:len(self.keys)] = self._stamps[:len(self.keys)]
+            self._stamps = stamps
+        self._vectors[len(self.keys)] = vector
+        self._stamps[len(self.keys)] = stamp
+        self.keys.append(key)
+
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0,
+                     sample: int = 100_000) -> np.ndarray:
+    """Unit-norm centroids [nlist, D] maximizing the summed cosine to their members."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample:
+        vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+    vectors = vectors.astype(np.float32)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = ~np.bincount(assign, minlength=nlist).astype(bool)
+        # Re-seed empty lists from random members
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class VectorIndex:
+    """Top-k cosine search over normalized vectors: exact, or IVF once `train` has run."""
+
+    def __init__(self, dim: int, kind: str = "exact", nprobe: int = SIMILARITY_NPROBE):
+        if kind not in {"exact", "ivf"}:
+            raise ValueError(f"Unknown index kind {kind!r}; expected 'exact' or 'ivf'")
+        self.dim = dim
+        self.kind = kind
+        self.nprobe = nprobe
+        self.centroids = None
+        self._lists = [_List(dim)]
+        self._keys = set()
+        self._lock = threading.Lock()
+        self.trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def add(self, key, vector, stamp: float = 0.0) -> None:
+        """Index `vector` under `key`; `stamp` (e.g. creation time) is what `search(before=...)` filters on."""
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Expected a {self.dim}-d vector, got {vector.shape}")
+        with self._lock:
+            if key in self._keys:
+                return
+            target = 0 if self.centroids is None else int(np.argmax(self.centroids @ vector))
+            self._lists[target].add(key, vector, stamp)
+            self._keys.add(key)
+
+    def train(self, nlist: int = 0, iterations: int = 10, seed: int = 0) -> None:
+        """Cluster the current vectors into IVF lists; later adds join their nearest list."""
+        with self._lock:
+            previous = [(lst, len(lst)) for lst in self._lists]
+            keys = [key for lst in self._lists for key in lst.keys]
+            vectors = np.concatenate([lst.vectors for lst in self._lists])
+            stamps = np.concatenate([lst.stamps for lst in self._lists])
+        nlist = nlist or max(1, int(np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        centroids = spherical_kmeans(vectors, nlist, iterations, seed)
+        lists = [_List(self.dim) for _ in range(nlist)]
+        for start in range(0, len(vectors), 65536):
+            chunk = vectors[start:start + 65536]
+            for offset, target in enumerate(np.argmax(chunk @ centroids.T, axis=1)):
+                index = start + offset
+                lists[target].add(keys[index], chunk[offset], stamps[index])
+        with self._lock:
+            # Vectors added while training ran are re-assigned into the new lists
+            for lst, length in previous:
+                for key, vector, stamp in zip(lst.keys[length:], lst.vectors[length:], lst.stamps[length:]):
+                    lists[int(np.argmax(centroids @ vector))].add(key, vector, stamp)
+            self.centroids, self._lists = centroids, lists
+            self.trained_size = len(self._keys)
+
+    def search(self, query, k: int, exclude=None, before=None) -> list:
+        """[(key, cosine similarity)] of the k nearest vectors, best first.
+
+        Keys in `exclude`, and with `before` set, vectors whose stamp is not
+        below it, are skipped. IVF probes more lists until enough vectors
+        pass the filter (or all lists are scored).
+        """
+        query = np.asarray(query, dtype=np.float32)
+        exclude = exclude or set()
+        with self._lock:
+            if self.centroids is None:
+                lists = self._lists
+            else:
+                lists = [self._lists[i] for i in np.argsort(-(self.centroids @ query))]
+            # Lists are append-only: these views and lengths stay valid after the lock is released
+            lists = [(lst, lst.vectors, lst.stamps) for lst in lists if len(lst)]
+        if not lists:
+            return []
+
+        wanted = k + len(exclude)
+        probe = len(lists) if self.centroids is None else min(self.nprobe, len(lists))
+        parts, scored, valid = [], 0, 0
+        while True:
+            for _, vectors, stamps in lists[scored:probe]:
+                scores = vectors @ query
+                if before is not None:
+                    scores[stamps >= before] = -np.inf
+                valid += int(np.count_nonzero(scores > -np.inf))
+                parts.append(scores)
+            scored = probe
+            if valid >= wanted or probe == len(lists):
+                break
+            probe = min(2 * probe, len(lists))
+        if valid == 0:
+            return []
+
+        scores = np.concatenate(parts)
+        offsets = np.cumsum([0] + [len(part) for part in parts])
+        wanted = min(wanted, valid)
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        results = []
+        for i in top[np.argsort(-scores[top])]:
+            slot = int(np.searchsorted(offsets, i, side="right")) - 1
+            key = lists[slot][0].keys[i - offsets[slot]]
+            if key not in exclude:
+                results.append((key, float(scores[i])))
+        return results[:k]
+
+
+# ==========================================
+# Process-wide indexes, synced from Mongo
+# ==========================================
+_indexes = {}
+_synced_until = None
+_last_sync = 0.0
+_sync_lock = asyncio.Lock()
+# Background IVF training per model version
+_train_tasks = {}
+
+
+def _index_for(version: str, dim: int) -> VectorIndex:
+    index = _indexes.get(version)
+    if index is None:
+        index = _indexes[version] = VectorIndex(dim, SIMILARITY_INDEX)
+    return index
+
+
+def _stamp(created_at: datetime) -> float:
+    # Mongo returns naive UTC datetimes
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp()
+
+
+def add_case(case_id: str, vector, version: str, created_at: datetime) -> None:
+    """Make a freshly embedded case searchable in this process right away."""
+    _index_for(version, len(vector)).add(case_id, vector, _stamp(created_at))
+
+
+def _train_done(version: str, task: asyncio.Task) -> None:
+    _train_tasks.pop(version, None)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Similarity index training failed for {version}: {task.exception()}")
+
+
+def _maybe_train(version: str, index: VectorIndex) -> None:
+    # Train once past SIMILARITY_MIN_TRAIN, retrain when the index has doubled since.
+    # Training runs in the background; queries keep using the current lists until it swaps them.
+    if index.kind != "ivf" or len(index) < SIMILARITY_MIN_TRAIN or len(index) < 2 * index.trained_size:
+        return
+    if version in _train_tasks:
+        return
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(loop.run_in_executor(None, index.train, SIMILARITY_NLIST))
+    _train_tasks[version] = task
+    task.add_done_callback(partial(_train_done, version))
+
+
+async def sync(force: bool = False) -> None:
+    """Load cases embedded since the last sync (all of them on the first call, from the app lifespan).
+
+    Cases from the overlap window are read again; VectorIndex.add ignores
+    the ones already indexed. A query never waits for another query's sync.
+    """
+    global _synced_until, _last_sync
+    if not force and _synced_until is not None and time.monotonic() - _last_sync < SIMILARITY_REFRESH_S:
+        return
+    if not force and _sync_lock.locked():
+        return
+    async with _sync_lock:
+        query = {"embedding": {"$exists": True}}
+        if _synced_until is not None:
+            query["embedded_at"] = {"$gt": _synced_until - timedelta(seconds=SIMILARITY_SYNC_OVERLAP_S)}
+        projection = {"embedding": 1, "embedding_version": 1, "embedded_at": 1, "created_at": 1}
+        async for doc in db.triage_cases.find(query, projection):
+            add_case(str(doc["_id"]), decode(doc["embedding"]), doc["embedding_version"], doc["created_at"])
+            if _synced_until is None or doc["embedded_at"] > _synced_until:
+                _synced_until = doc["embedded_at"]
+        _last_sync = time.monotonic()
+    for version, index in list(_indexes.items()):
+        _maybe_train(version, index)
+
+
+async def similar_cases(case_id: str, embedding: bytes, version: str, created_at: datetime, k: int) -> list:
+    """[(case id, similarity)] of the k cases uploaded before this one that are closest to it.
+
+    Only cases embedded by the same model version are compared.
+    """
+    await sync()
+    vector = decode(embedding)
+    index = _index_for(version, len(vector))
+    return index.search(vector, k, exclude={case_id}, before=_stamp(created_at))
+
+
+async def index_case(case_id, image, created_at: datetime) -> None:
+    """Embed a triage image on the background lane and store the fp16 vector on the case."""
+    from .lanes import LaneFull
+    from .predict import embed_async
+
+    try:
+        vector, version = await embed_async(image)
+    except LaneFull:
+        print(f"Similarity indexing skipped for case {case_id}: background lane is full")
+        return
+    except Exception as exc:
+        print(f"Similarity indexing failed for case {case_id}: {exc}")
+        return
+    await db.triage_cases.update_one({"_id": ObjectId(case_id)}, {"$set": {
+        "embedding": encode(vector),
+        "embedding_version": version,
+        "embedded_at": datetime.now(timezone.utc),
+    }})
+    add_case(str(case_id), vector, version, created_at)
+
+
+async def backfill(upload_dir: Path, limit: int) -> int:
+    """Embed stored cases that have no embedding yet; returns how many were indexed."""
+    from .predict import load_model_and_embed
+
+    loop = asyncio.get_running_loop()
+    done = 0
+    cursor = db.triage_cases.find({"embedding": {"$exists": False}}, {"filename": 1})
+    async for doc in cursor:
+        if limit and done >= limit:
+            break
+        path = upload_dir / doc["filename"]
+        if not path.exists():
+            print(f"  {doc['_id']}: {path} is missing")
+            continue
+        vector, version = await loop.run_in_executor(None, load_model_and_embed, str(path))
+        await db.triage_cases.update_one({"_id": doc["_id"]}, {"$set": {
+            "embedding": encode(vector),
+            "embedding_version": version,
+            "embedded_at": datetime.now(timezone.utc),
+        }})
+        done += 1
+        print(f"  {done} cases indexed", end="\r")
+    print()
+    return done
+
+
+def main():
+    from .routes.triage import UPLOAD_DIR
+
+    parser = argparse.ArgumentParser(description="Similar-case index maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("backfill", help="Embed triage cases uploaded before indexing")
+    p.add_argument("--upload-dir", default=str(UPLOAD_DIR))
+    p.add_argument("--limit", type=int, default=0, help="Stop after this many cases (0 = all)")
+    args = parser.parse_args()
+
+    count = asyncio.run(backfill(Path(args.upload_dir), args.limit))
+    print(f"Indexed {count} cases.")
+
+
+if __name__ == "__main__":
+    main()
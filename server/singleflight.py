@@ -0,0 +1,66 @@
+"""Coalesce concurrent identical requests onto one computation.
+
+Double-clicks and client retries send the same upload several times at
+once. `SingleFlight.run(key, fn)` starts `fn()` for the first caller of a
+key; callers arriving while it runs await the same result instead of
+starting their own.
+
+  - Results and exceptions (including HTTPException) reach every waiter.
+  - Nothing is cached: the key is released as soon as the computation
+    finishes, so a retry after an error runs again.
+  - A waiter that is cancelled (client disconnect) only stops waiting; the
+    computation keeps running for the others. When the last waiter leaves,
+    the computation is cancelled, which drops it from the inference queue
+    if it has not started.
+"""
+import asyncio
+from functools import partial
+
+from .metrics import REQUESTS_COALESCED
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key, fn):
+        """Result of `fn()` (a coroutine function), shared with concurrent callers of `key`."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(partial(self._release, key, flight))
+        else:
+            REQUESTS_COALESCED.inc(flight=self.name)
+
+        flight.waiters += 1
+        try:
+            # shield: cancelling this waiter must not cancel the shared task
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # Forget the flight first, so a caller arriving before the done
+                # callback runs starts a new one instead of joining a cancelled task
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _release(self, key, flight: _Flight, task: asyncio.Task) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even when every waiter has already left
+            task.exception()
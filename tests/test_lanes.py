@@ -0,0 +1,64 @@
+"""LaneScheduler: weighted-fair order, queue limits and cancelled jobs."""
+import threading
+
+import pytest
+
+from server.lanes import Lane, LaneFull, LaneScheduler
+
+
+def blocked_scheduler(*lanes):
+    """A one-worker scheduler whose worker is busy on the `hold` lane until the returned event is set."""
+    scheduler = LaneScheduler((Lane("hold", 1, 1),) + lanes, workers=1, thread_name_prefix="test")
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(10)
+
+    scheduler.submit("hold", hold)
+    assert started.wait(10)
+    return scheduler, release
+
+
+def test_weighted_order():
+    scheduler, release = blocked_scheduler(Lane("fast", 3, 10), Lane("slow", 1, 10))
+    order = []
+    futures = [scheduler.submit("fast", lambda: order.append("fast")) for _ in range(6)]
+    futures += [scheduler.submit("slow", lambda: order.append("slow")) for _ in range(2)]
+    release.set()
+    for future in futures:
+        future.result(10)
+    # Three fast jobs per slow one while both lanes have work queued
+    assert order[:4].count("fast") == 3
+    assert sorted(order) == ["fast"] * 6 + ["slow"] * 2
+
+
+def test_full_lane_rejects():
+    scheduler, release = blocked_scheduler(Lane("small", 1, 2))
+    futures = [scheduler.submit("small", lambda: None) for _ in range(2)]
+    with pytest.raises(LaneFull):
+        scheduler.submit("small", lambda: None)
+    assert scheduler.status()["lanes"]["small"]["queued"] == 2
+    release.set()
+    for future in futures:
+        future.result(10)
+    # Room again once the queue drains
+    assert scheduler.submit("small", lambda: "ok").result(10) == "ok"
+
+
+def test_unknown_lane():
+    scheduler = LaneScheduler((Lane("only", 1, 1),), workers=1, thread_name_prefix="test")
+    with pytest.raises(ValueError):
+        scheduler.submit("missing", lambda: None)
+
+
+def test_cancelled_job_is_skipped():
+    scheduler, release = blocked_scheduler(Lane("work", 1, 10))
+    ran = []
+    cancelled = scheduler.submit("work", lambda: ran.append("cancelled"))
+    kept = scheduler.submit("work", lambda: ran.append("kept"))
+    assert cancelled.cancel()
+    release.set()
+    kept.result(10)
+    assert cancelled.cancelled()
+    assert ran == ["kept"]
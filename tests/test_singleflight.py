@@ -0,0 +1,112 @@
+"""SingleFlight: concurrent callers of a key share one computation."""
+import asyncio
+
+import pytest
+
+from server.singleflight import SingleFlight
+
+
+class Work:
+    """A computation that counts its starts and blocks until released."""
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.calls
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_share_one_computation():
+    async def scenario():
+        flight, work = SingleFlight("test"), Work()
+        waiters = [asyncio.ensure_future(flight.run("key", work)) for _ in range(5)]
+        await settle()
+        assert len(flight) == 1
+        work.release.set()
+        assert await asyncio.gather(*waiters) == [1] * 5
+        assert work.calls == 1
+        assert len(flight) == 0
+
+    asyncio.run(scenario())
+
+
+def test_exception_reaches_every_waiter():
+    async def scenario():
+        flight, work = SingleFlight("test"), Work(error=ValueError("boom"))
+        waiters = [asyncio.ensure_future(flight.run("key", work)) for _ in range(3)]
+        await settle()
+        work.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert work.calls == 1
+        assert len(flight) == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_computation_running():
+    async def scenario():
+        flight, work = SingleFlight("test"), Work()
+        leaving = asyncio.ensure_future(flight.run("key", work))
+        staying = asyncio.ensure_future(flight.run("key", work))
+        await settle()
+        leaving.cancel()
+        await settle()
+        assert leaving.cancelled()
+        assert work.cancelled == 0
+        work.release.set()
+        assert await staying == 1
+        assert work.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_last_waiter_cancels_computation_and_releases_key():
+    async def scenario():
+        flight, work = SingleFlight("test"), Work()
+        waiter = asyncio.ensure_future(flight.run("key", work))
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        # The key is dropped before the computation's done callback runs
+        assert len(flight) == 0
+        await settle()
+        assert work.cancelled == 1
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_cancellation_starts_new_computation():
+    async def scenario():
+        flight, work = SingleFlight("test"), Work()
+        waiter = asyncio.ensure_future(flight.run("key", work))
+        await settle()
+        waiter.cancel()
+        # Retry in the same loop iteration, before the cancelled task has finished
+        retry = asyncio.ensure_future(flight.run("key", work))
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await settle()
+        work.release.set()
+        assert await retry == 2
+        assert work.calls == 2
+        assert work.cancelled == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,80 @@
+"""The vectorized symptom rules must match the original per-image predictor exactly."""
+import itertools
+
+import numpy as np
+import pytest
+
+from server.predict import LABELS, RECOMMENDATIONS, RISK_EMOJI, build_results
+
+
+def reference_result(avg_probs, itch, bleed, grew, elevation):
+    """The per-image rules and result dict of the original DermSightPredictor.predict."""
+    avg_probs = avg_probs.copy()
+    symptom_flags = [itch, bleed, grew, elevation]
+    danger_count = sum(symptom_flags)
+    if danger_count >= 2:
+        avg_probs[2] *= (1.0 + 0.15 * danger_count)
+    if bleed and grew:
+        avg_probs[2] *= 1.25
+
+    total = avg_probs.sum()
+    if total > 0:
+        avg_probs = avg_probs / total
+
+    prediction_idx = int(np.argmax(avg_probs))
+
+    if avg_probs[2] > 0.30:
+        prediction_idx = 2
+
+    return {
+        "prediction": f"{RISK_EMOJI[prediction_idx]} {LABELS[prediction_idx]}",
+        "risk_level": prediction_idx,
+        "confidence": round(float(avg_probs[prediction_idx]) * 100, 1),
+        "scores": {
+            "low_risk": round(float(avg_probs[0]) * 100, 1),
+            "medium_risk": round(float(avg_probs[1]) * 100, 1),
+            "high_risk": round(float(avg_probs[2]) * 100, 1),
+        },
+        "recommendation": RECOMMENDATIONS[prediction_idx],
+        "symptoms_used": {
+            "itch": itch,
+            "bleed": bleed,
+            "grew": grew,
+            "elevation": elevation,
+            "danger_flags": danger_count,
+        },
+    }
+
+
+def random_probs(rng, count, dtype):
+    # Softmax-like rows, plus near-ties and rows close to the 0.30 override
+    probs = rng.dirichlet(np.ones(3), size=count)
+    probs[: count // 4] = rng.dirichlet(np.full(3, 50.0), size=count // 4)
+    probs[count // 4: count // 2, 2] = rng.uniform(0.2, 0.35, size=count // 2 - count // 4)
+    return probs.astype(dtype)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("seed", range(5))
+def test_single_image_matches_reference(dtype, seed):
+    rng = np.random.default_rng(seed)
+    probs = random_probs(rng, 2000, dtype)
+    flags = rng.random((len(probs), 4)) < 0.5
+    for row, row_flags in zip(probs, flags):
+        expected = reference_result(row, *(bool(flag) for flag in row_flags))
+        assert build_results(row[np.newaxis], [row_flags])[0] == expected
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_batch_matches_reference(dtype):
+    rng = np.random.default_rng(100)
+    probs = random_probs(rng, 5000, dtype)
+    flags = rng.random((len(probs), 4)) < 0.5
+    expected = [reference_result(row, *(bool(flag) for flag in row_flags)) for row, row_flags in zip(probs, flags)]
+    assert build_results(probs, flags) == expected
+
+
+@pytest.mark.parametrize("row_flags", list(itertools.product([False, True], repeat=4)))
+def test_every_flag_combination_and_zero_probs(row_flags):
+    for row in (np.zeros(3, dtype=np.float32), np.array([0.5, 0.3, 0.2], dtype=np.float32)):
+        assert build_results(row[np.newaxis], [row_flags])[0] == reference_result(row, *row_flags)
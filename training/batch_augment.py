@@ -0,0 +1,69 @@
+"""Batched augmentation on collated uint8 image tensors.
+
+Replaces the per-sample PIL RandomHorizontalFlip / RandomVerticalFlip /
+RandomRotation + ToTensor + Normalize chain. Flips and rotation are
+folded into one affine matrix per sample and applied with a single
+grid_sample over the batch, and uint8 -> normalized float is one fused
+multiply-add. Datasets only need to yield resized uint8 CHW tensors.
+"""
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class BatchAugment(nn.Module):
+    """Random flips + rotation then normalization in train mode, normalization only in eval.
+
+    Expects square [N, C, H, W] uint8 batches (all pipelines resize to 260x260).
+    """
+
+    def __init__(
+        self,
+        hflip: bool = True,
+        vflip: bool = False,
+        degrees: float = 0.0,
+        mean=IMAGENET_MEAN,
+        std=IMAGENET_STD,
+    ):
+        super().__init__()
+        self.hflip = hflip
+        self.vflip = vflip
+        self.degrees = degrees
+        std = torch.tensor(std).view(1, -1, 1, 1)
+        mean = torch.tensor(mean).view(1, -1, 1, 1)
+        # (x / 255 - mean) / std == x * scale + shift
+        self.register_buffer("scale", 1.0 / (255.0 * std))
+        self.register_buffer("shift", -mean / std)
+
+    def normalize(self, images: torch.Tensor) -> torch.Tensor:
+        return torch.addcmul(self.shift, images.float(), self.scale)
+
+    def _affine(self, batch: int, device) -> torch.Tensor:
+        sx = torch.ones(batch, device=device)
+        sy = torch.ones(batch, device=device)
+        if self.hflip:
+            sx = torch.where(torch.rand(batch, device=device) < 0.5, -sx, sx)
+        if self.vflip:
+            sy = torch.where(torch.rand(batch, device=device) < 0.5, -sy, sy)
+        angle = (torch.rand(batch, device=device) * 2 - 1) * math.radians(self.degrees)
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        zero = torch.zeros(batch, device=device)
+        # Rotation composed with the flip scaling, in normalized [-1, 1] coordinates
+        return torch.stack([
+            torch.stack([cos * sx, -sin * sy, zero], dim=1),
+            torch.stack([sin * sx, cos * sy, zero], dim=1),
+        ], dim=1)
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        x = images.float()
+        if self.training and (self.hflip or self.vflip or self.degrees):
+            theta = self._affine(x.size(0), x.device)
+            grid = F.affine_grid(theta, list(x.shape), align_corners=False)
+            # Nearest + zero fill matches torchvision's RandomRotation defaults
+            x = F.grid_sample(x, grid, mode="nearest", padding_mode="zeros", align_corners=False)
+        return torch.addcmul(self.shift, x, self.scale)
@@ -0,0 +1,437 @@
+"""Offline logit store and calibration sweep for the serving symptom rules.
+
+    python calibrate_rules.py extract --checkpoint best.pth --data-dirs ... --csv-path ... --store logits.npz
+    python calibrate_rules.py sweep --store logits.npz --output symptom_rules.json
+    python calibrate_rules.py gate --store logits.npz --rules symptom_rules.json --output cascade_gate.json
+
+`extract` runs DermSightPredictor's own TTA preprocessing and model once
+over the evaluation set. It stores the per-view logits [N, views, 3] along
+with the raw diagnoses and the CSV symptom columns (itch/bleed/grew/elevation).
+
+`sweep` replays server.predict.apply_symptom_rules over a grid of high-risk
+thresholds, danger boosts and bleed+grew factors, with the rule parameters
+broadcast over the grid axis. It then picks the variant with the best
+high-risk F1 whose recall is no lower than the current rules (or
+--min-recall). The written JSON loads into the predictor through
+SYMPTOM_RULES_PATH.
+
+`gate` calibrates the predictor's inference cascade (server.predict.CascadeGate):
+the center view (or a fast model's store, --fast-store) answers on its own
+when the gate allows it, otherwise the full TTA pass does. It picks the gate
+with the most early exits that loses no high-risk detection of the full pass,
+so the cascade never lowers high-risk recall on the calibration set. The JSON
+loads through CASCADE_GATE_PATH.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, random_split
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from finetune_pad_ufes import (  # noqa: E402
+    DEFAULT_HIGH,
+    DEFAULT_MEDIUM,
+    build_image_index,
+    parse_labels,
+    read_metadata,
+    risk_label,
+)
+from risk_metrics import HIGH_RISK_INDEX, accuracy, per_class_metrics  # noqa: E402
+from server.model import DermSightPredictor  # noqa: E402
+from server.predict import (  # noqa: E402
+    DEFAULT_RULES,
+    SYMPTOM_NAMES,
+    CascadeGate,
+    SymptomRules,
+    apply_symptom_rules,
+    cascade_exit,
+)
+
+NUM_CLASSES = 3
+
+
+class TTADataset(Dataset):
+    def __init__(self, paths, views):
+        self.paths = paths
+        self.views = views
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        image = Image.open(self.paths[idx]).convert("RGB")
+        return torch.stack([view(image) for view in self.views])
+
+
+def read_symptom_flags(csv_path: Path) -> dict:
+    """img_id -> [itch, bleed, grew, elevation]; "UNK" and blanks count as False, as in the app."""
+    flags = {}
+    with csv_path.open("r", newline="") as handle:
+        for row in csv.DictReader(handle):
+            flags[row.get("img_id")] = [
+                (row.get(name) or "").strip().upper() == "TRUE" for name in SYMPTOM_NAMES
+            ]
+    return flags
+
+
+def extract(args) -> None:
+    manifest_path = Path(args.manifest) if args.manifest else None
+    image_index = build_image_index([Path(p) for p in args.data_dirs], manifest_path)
+    rows = read_metadata(Path(args.csv_path), image_index, args.label_col)
+    symptom_flags = read_symptom_flags(Path(args.csv_path))
+    paths = [path for path, _ in rows]
+    flags = np.array(
+        [symptom_flags.get(path.name, [False] * len(SYMPTOM_NAMES)) for path in paths], dtype=bool
+    )
+
+    predictor = DermSightPredictor(args.checkpoint, use_tta=True)
+    views = predictor.tta_transforms
+    loader = DataLoader(TTADataset(paths, views), batch_size=args.batch_size, num_workers=args.num_workers)
+
+    print(f"Extracting logits for {len(paths)} images x {len(views)} views...")
+    chunks = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in loader:
+            n, v = batch.shape[:2]
+            logits = predictor.model(batch.flatten(0, 1).to(predictor.device))
+            chunks.append(logits.view(n, v, -1).float().cpu().numpy())
+            print(f"  {sum(len(c) for c in chunks)}/{len(paths)}", end="\r")
+    print(f"\nInference took {time.perf_counter() - start:.1f}s.")
+
+    store = Path(args.store)
+    store.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = store.with_name(store.stem + ".tmp.npz")
+    np.savez_compressed(
+        tmp_path,
+        logits=np.concatenate(chunks),
+        paths=np.array([str(p) for p in paths]),
+        labels=np.array([label for _, label in rows]),
+        flags=flags,
+        checkpoint=np.array(str(Path(args.checkpoint).resolve())),
+    )
+    tmp_path.replace(store)
+    print(f"Saved logit store to {store}")
+
+
+def parse_range(value: str) -> np.ndarray:
+    """"start:stop:step" (stop inclusive) or a comma list."""
+    if ":" in value:
+        start, stop, step = (float(part) for part in value.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 6)
+    return np.array([float(part) for part in value.split(",")])
+
+
+def stacked_confusions(labels, preds) -> np.ndarray:
+    """[G, 3, 3] confusion matrices for predictions [G, N] against labels [N], in one bincount."""
+    count = len(preds)
+    keys = (np.arange(count)[:, np.newaxis] * NUM_CLASSES + labels) * NUM_CLASSES + preds
+    return np.bincount(keys.ravel(), minlength=count * NUM_CLASSES ** 2).reshape(
+        count, NUM_CLASSES, NUM_CLASSES
+    )
+
+
+def sweep_confusions(probs, flags, labels, grid, chunk) -> np.ndarray:
+    """[G, 3, 3] confusion matrices, one per rule variant in `grid`."""
+    size = len(grid["high_risk_threshold"])
+    confusions = np.zeros((size, NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+    for start in range(0, size, chunk):
+        part = slice(start, min(start + chunk, size))
+        rules = SymptomRules(**{name: values[part, np.newaxis] for name, values in grid.items()})
+        _, preds, _ = apply_symptom_rules(probs, flags, rules)
+        confusions[part] = stacked_confusions(labels, preds)
+    return confusions
+
+
+def validation_indices(count: int, val_split: float, seed: int) -> np.ndarray:
+    """finetune_pad_ufes.py's validation split, when the store holds the same samples in the same order."""
+    val_size = int(count * val_split)
+    generator = torch.Generator().manual_seed(seed)
+    _, val_idx = random_split(range(count), [count - val_size, val_size], generator=generator)
+    return np.array(list(val_idx), dtype=np.int64)
+
+
+def store_labels(store, args) -> np.ndarray:
+    high_labels = parse_labels(args.high_labels) or DEFAULT_HIGH
+    medium_labels = parse_labels(args.medium_labels) or DEFAULT_MEDIUM
+    return np.array([risk_label(str(label), high_labels, medium_labels) for label in store["labels"]])
+
+
+def summarize(confusions) -> dict:
+    metrics = per_class_metrics(confusions)
+    total = confusions.sum(axis=(-2, -1))
+    flagged = confusions[..., :, HIGH_RISK_INDEX].sum(axis=-1)
+    return {
+        "high_precision": metrics["precision"][..., HIGH_RISK_INDEX],
+        "high_recall": metrics["recall"][..., HIGH_RISK_INDEX],
+        "high_f1": metrics["f1"][..., HIGH_RISK_INDEX],
+        "accuracy": accuracy(confusions),
+        "flag_rate": np.divide(flagged, total, out=np.zeros(flagged.shape), where=total > 0),
+    }
+
+
+def _row(metrics: dict, index=None) -> dict:
+    return {key: round(float(value if index is None else value[index]), 4) for key, value in metrics.items()}
+
+
+def sweep(args) -> None:
+    store = np.load(args.store, allow_pickle=False)
+    logits = torch.from_numpy(store["logits"])
+    labels = store_labels(store, args)
+    flags = store["flags"]
+
+    # Same float32 softmax + view average as DermSightPredictor
+    views = logits.shape[1] if args.tta else 1
+    probs = np.mean(torch.softmax(logits[:, :views], dim=-1).numpy(), axis=1)
+
+    if args.subset == "val":
+        keep = validation_indices(len(labels), args.val_split, args.seed)
+        probs, flags, labels = probs[keep], flags[keep], labels[keep]
+    print(f"Calibrating on {len(labels)} images ({int((labels == HIGH_RISK_INDEX).sum())} high risk).")
+
+    axes = {
+        "high_risk_threshold": parse_range(args.thresholds),
+        "min_danger_flags": np.array([int(v) for v in args.min_danger_flags.split(",")]),
+        "danger_boost": parse_range(args.boosts),
+        "bleed_grew_factor": parse_range(args.factors),
+    }
+    mesh = np.meshgrid(*axes.values(), indexing="ij")
+    grid = {name: values.ravel() for name, values in zip(axes, mesh)}
+
+    start = time.perf_counter()
+    metrics = summarize(sweep_confusions(probs, flags, labels, grid, args.chunk))
+    elapsed = time.perf_counter() - start
+    print(f"Swept {len(grid['high_risk_threshold'])} rule variants in {elapsed:.2f}s.")
+
+    baseline_rules = SymptomRules.from_file(args.baseline) if args.baseline else DEFAULT_RULES
+    baseline_grid = {name: np.array([getattr(baseline_rules, name)]) for name in grid}
+    baseline = _row(summarize(sweep_confusions(probs, flags, labels, baseline_grid, 1)), 0)
+    min_recall = args.min_recall if args.min_recall is not None else baseline["high_recall"]
+
+    feasible = metrics["high_recall"] >= min_recall - 1e-9
+    if not feasible.any():
+        raise SystemExit(f"No rule variant reaches high-risk recall {min_recall:.4f}.")
+    objective = np.where(feasible, metrics[args.objective], -np.inf)
+    # Normalized distance to the baseline, so ties keep the rules close to what is served
+    distance = sum(
+        np.abs(values - getattr(baseline_rules, name)) / max(np.ptp(values), 1e-9) for name, values in grid.items()
+    )
+    # Best objective, then accuracy, then the lowest flag rate, then the nearest to baseline
+    best = np.lexsort((-distance, -metrics["flag_rate"], metrics["accuracy"], objective))[-1]
+    chosen_rules = SymptomRules(**{
+        name: (int if name == "min_danger_flags" else float)(values[best]) for name, values in grid.items()
+    })
+    chosen = _row(metrics, best)
+
+    print(f"\n{'':<10} {'threshold':>9} {'min_flags':>9} {'boost':>6} {'factor':>6} "
+          f"{'HighP':>7} {'HighR':>7} {'HighF1':>7} {'Acc':>7} {'Flagged':>8}")
+    for name, rules, row in (("baseline", baseline_rules, baseline), ("chosen", chosen_rules, chosen)):
+        print(
+            f"{name:<10} {rules.high_risk_threshold:>9.3f} {rules.min_danger_flags:>9d} "
+            f"{rules.danger_boost:>6.3f} {rules.bleed_grew_factor:>6.3f} "
+            f"{row['high_precision']:>7.4f} {row['high_recall']:>7.4f} {row['high_f1']:>7.4f} "
+            f"{row['accuracy']:>7.4f} {row['flag_rate']:>8.4f}"
+        )
+
+    if args.curves:
+        with open(args.curves, "w", newline="") as handle:
+            writer = csv.writer(handle)
+            writer.writerow([*grid, *metrics])
+            for index in range(len(grid["high_risk_threshold"])):
+                writer.writerow(
+                    [grid[name][index] for name in grid] + [round(float(v[index]), 6) for v in metrics.values()]
+                )
+        print(f"Wrote recall/precision trade-off curves to {args.curves}")
+
+    config = asdict(chosen_rules)
+    config["calibration"] = {
+        "store": str(Path(args.store).resolve()),
+        "checkpoint": str(store["checkpoint"]),
+        "subset": args.subset,
+        "images": int(len(labels)),
+        "objective": args.objective,
+        "min_recall": round(float(min_recall), 4),
+        "baseline": baseline,
+        "chosen": chosen,
+    }
+    Path(args.output).write_text(json.dumps(config, indent=2))
+    print(f"\nSaved rules to {args.output}; serve them with SYMPTOM_RULES_PATH={args.output}")
+
+
+def main_model_views(exit_rate: float, views: int, first_views: int) -> float:
+    """Expected main-model forward views per image under the cascade."""
+    return first_views + (views - first_views) * (1 - exit_rate)
+
+
+def gate(args) -> None:
+    store = np.load(args.store, allow_pickle=False)
+    logits = torch.from_numpy(store["logits"])
+    labels = store_labels(store, args)
+    flags = store["flags"]
+    rules = SymptomRules.from_file(args.rules) if args.rules else DEFAULT_RULES
+
+    # Escalated pass: the main model with TTA, as the served predictor runs it
+    views = logits.shape[1]
+    full = np.mean(torch.softmax(logits[:, :views], dim=-1).numpy(), axis=1)
+    if args.fast_store:
+        fast_store = np.load(args.fast_store, allow_pickle=False)
+        if not np.array_equal(fast_store["paths"], store["paths"]):
+            raise SystemExit(f"{args.fast_store} and {args.store} were extracted from different images.")
+        first = torch.softmax(torch.from_numpy(fast_store["logits"][:, 0]), dim=-1).numpy()
+        # The fast model answers early exits; escalations run every view of the main model
+        first_views = 0
+    else:
+        # Same model: the center view is reused and only the flipped views are added
+        first = torch.softmax(logits[:, 0], dim=-1).numpy()
+        first_views = 1
+
+    if args.subset == "val":
+        keep = validation_indices(len(labels), args.val_split, args.seed)
+        full, first, flags, labels = full[keep], first[keep], flags[keep], labels[keep]
+    print(f"Calibrating the cascade gate on {len(labels)} images ({int((labels == HIGH_RISK_INDEX).sum())} high risk).")
+
+    _, full_preds, _ = apply_symptom_rules(full, flags, rules)
+    adjusted, first_preds, _ = apply_symptom_rules(first, flags, rules)
+
+    axes = {"min_margin": parse_range(args.margins), "high_risk_band": parse_range(args.bands)}
+    mesh = np.meshgrid(*axes.values(), indexing="ij")
+    grid = {name: values.ravel() for name, values in zip(axes, mesh)}
+    exits = cascade_exit(adjusted, CascadeGate(**{name: v[:, np.newaxis] for name, v in grid.items()}), rules)
+    preds = np.where(exits, first_preds, full_preds)
+
+    metrics = summarize(stacked_confusions(labels, preds))
+    metrics["exit_rate"] = exits.mean(axis=1)
+    # High-risk images the full pass flags but the cascade would answer otherwise
+    caught = (labels == HIGH_RISK_INDEX) & (full_preds == HIGH_RISK_INDEX)
+    lost = (caught & (preds != HIGH_RISK_INDEX)).sum(axis=1)
+    full_row = _row(summarize(stacked_confusions(labels, full_preds[np.newaxis])), 0)
+
+    feasible = lost == 0
+    constraint = "no high-risk image flagged by the full pass is missed"
+    if not feasible.any():
+        raise SystemExit(f"No gate satisfies: {constraint}.")
+    objective = np.where(feasible, metrics["exit_rate"], -np.inf)
+    # Normalized gate strictness, so ties escalate more rather than less
+    strictness = sum(values / max(np.ptp(values), 1e-9) for values in grid.values())
+    # Most early exits, then accuracy, then high-risk F1, then the strictest gate
+    best = np.lexsort((strictness, metrics["high_f1"], metrics["accuracy"], objective))[-1]
+    chosen_gate = CascadeGate(**{name: float(values[best]) for name, values in grid.items()})
+    chosen = _row(metrics, best)
+    chosen["lost_high_risk"] = int(lost[best])
+    print(f"Swept {len(grid['min_margin'])} gates; constraint: {constraint}.")
+
+    print(f"\n{'':<8} {'margin':>6} {'band':>6} {'Exit':>6} {'Views':>6} "
+          f"{'HighP':>7} {'HighR':>7} {'HighF1':>7} {'Acc':>7}")
+    full_row["exit_rate"] = 0.0
+    for name, margin, band, row in (
+        ("full", "-", "-", full_row),
+        ("cascade", f"{chosen_gate.min_margin:.3f}", f"{chosen_gate.high_risk_band:.3f}", chosen),
+    ):
+        used = main_model_views(row["exit_rate"], views, first_views)
+        print(
+            f"{name:<8} {margin:>6} {band:>6} {row['exit_rate']:>6.1%} {used:>6.2f} "
+            f"{row['high_precision']:>7.4f} {row['high_recall']:>7.4f} {row['high_f1']:>7.4f} {row['accuracy']:>7.4f}"
+        )
+
+    if args.curves:
+        with open(args.curves, "w", newline="") as handle:
+            writer = csv.writer(handle)
+            writer.writerow([*grid, *metrics, "lost_high_risk"])
+            for index in range(len(grid["min_margin"])):
+                writer.writerow(
+                    [grid[name][index] for name in grid]
+                    + [round(float(v[index]), 6) for v in metrics.values()]
+                    + [int(lost[index])]
+                )
+        print(f"Wrote early-exit trade-off curves to {args.curves}")
+
+    config = asdict(chosen_gate)
+    config["calibration"] = {
+        "store": str(Path(args.store).resolve()),
+        "checkpoint": str(store["checkpoint"]),
+        "fast_store": str(Path(args.fast_store).resolve()) if args.fast_store else None,
+        "fast_checkpoint": str(fast_store["checkpoint"]) if args.fast_store else None,
+        "rules": asdict(rules),
+        "subset": args.subset,
+        "images": int(len(labels)),
+        "constraint": constraint,
+        "full": full_row,
+        "chosen": chosen,
+        "main_model_views_per_image": round(main_model_views(chosen["exit_rate"], views, first_views), 4),
+    }
+    Path(args.output).write_text(json.dumps(config, indent=2))
+    print(f"\nSaved gate to {args.output}; serve it with CASCADE_GATE_PATH={args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the serving symptom rules offline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("extract", help="Run TTA inference once and store per-view logits")
+    p.add_argument("--checkpoint", required=True, help="Model served by DermSightPredictor")
+    p.add_argument("--data-dirs", nargs="+", required=True, help="Image folders")
+    p.add_argument("--csv-path", required=True, help="PAD-UFES metadata CSV (with symptom columns)")
+    p.add_argument("--label-col", default="diagnostic")
+    p.add_argument("--manifest", default=None, help="SQLite image manifest to reuse between runs")
+    p.add_argument("--store", required=True, help="Output .npz logit store")
+    p.add_argument("--batch-size", type=int, default=16)
+    p.add_argument("--num-workers", type=int, default=4)
+
+    p = commands.add_parser("sweep", help="Sweep rule parameters over a logit store")
+    p.add_argument("--store", required=True, help=".npz written by `extract`")
+    p.add_argument("--high-labels", default=",".join(DEFAULT_HIGH))
+    p.add_argument("--medium-labels", default=",".join(DEFAULT_MEDIUM))
+    p.add_argument("--subset", choices=["all", "val"], default="all",
+                   help="`val` keeps only finetune_pad_ufes.py's validation split")
+    p.add_argument("--val-split", type=float, default=0.15)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--no-tta", dest="tta", action="store_false", help="Use only the first (center) view")
+    p.add_argument("--thresholds", default="0.10:0.60:0.01", help="start:stop:step or comma list")
+    p.add_argument("--min-danger-flags", default="2", help="Comma list")
+    p.add_argument("--boosts", default="0.0:0.40:0.025")
+    p.add_argument("--factors", default="1.0:2.0:0.05")
+    p.add_argument("--objective", choices=["high_f1", "high_precision", "accuracy"], default="high_f1")
+    p.add_argument("--min-recall", type=float, default=None,
+                   help="High-risk recall floor (default: recall of the baseline rules)")
+    p.add_argument("--baseline", default=None, help="Rules JSON to compare against (default: built-in)")
+    p.add_argument("--chunk", type=int, default=512, help="Rule variants evaluated per vectorized step")
+    p.add_argument("--curves", default=None, help="Write per-variant metrics CSV here")
+    p.add_argument("--output", default="symptom_rules.json", help="Rules JSON for SYMPTOM_RULES_PATH")
+
+    p = commands.add_parser("gate", help="Calibrate the cascade's early-exit gate over a logit store")
+    p.add_argument("--store", required=True, help=".npz written by `extract` for the served checkpoint")
+    p.add_argument("--fast-store", default=None,
+                   help="`extract` store of the cascade's fast model (default: the center view of --store)")
+    p.add_argument("--rules", default=None, help="Served rules JSON (default: built-in)")
+    p.add_argument("--high-labels", default=",".join(DEFAULT_HIGH))
+    p.add_argument("--medium-labels", default=",".join(DEFAULT_MEDIUM))
+    p.add_argument("--subset", choices=["all", "val"], default="all",
+                   help="`val` keeps only finetune_pad_ufes.py's validation split")
+    p.add_argument("--val-split", type=float, default=0.15)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--margins", default="0.0:1.0:0.02", help="start:stop:step or comma list")
+    p.add_argument("--bands", default="0.0:0.30:0.01", help="start:stop:step or comma list")
+    p.add_argument("--curves", default=None, help="Write per-gate metrics CSV here")
+    p.add_argument("--output", default="cascade_gate.json", help="Gate JSON for CASCADE_GATE_PATH")
+
+    args = parser.parse_args()
+    if args.command == "extract":
+        extract(args)
+    elif args.command == "sweep":
+        sweep(args)
+    else:
+        gate(args)
+
+
+if __name__ == "__main__":
+    main()
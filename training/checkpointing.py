@@ -0,0 +1,103 @@
+"""Full training-state checkpoints, exact mid-epoch resume and SIGTERM handling."""
+import math
+import os
+import random
+import signal
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+def capture_rng_state() -> dict:
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state: dict) -> None:
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def save_training_state(path: Path, state: dict) -> None:
+    """Write to a temp file in the same folder, then rename, so a kill mid-write never corrupts it."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_training_state(path: Path, device) -> Optional[dict]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    return torch.load(path, map_location=device, weights_only=False)
+
+
+class ResumableRandomSampler(Sampler[int]):
+    """Shuffles with a per-epoch seed so an epoch's order can be regenerated on resume.
+
+    `set_epoch(epoch, skip)` must be called before each epoch; `skip` drops
+    the samples this rank already consumed before an interruption. With
+    `num_replicas > 1` each rank gets a strided shard of the same
+    permutation, padded to equal length exactly like DistributedSampler.
+    """
+
+    def __init__(self, num_samples: int, seed: int, num_replicas: int = 1, rank: int = 0):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shard_size = math.ceil(num_samples / num_replicas)
+        self.epoch = 0
+        self.skip = 0
+
+    def set_epoch(self, epoch: int, skip: int = 0) -> None:
+        self.epoch = epoch
+        self.skip = skip
+
+    def __iter__(self) -> Iterator[int]:
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        order = torch.randperm(self.num_samples, generator=generator).tolist()
+        padding = self.shard_size * self.num_replicas - len(order)
+        if padding:
+            order += (order * math.ceil(padding / len(order)))[:padding]
+        shard = order[self.rank::self.num_replicas]
+        return iter(shard[self.skip:])
+
+    def __len__(self) -> int:
+        return self.shard_size - self.skip
+
+
+class PreemptionHandler:
+    """Turns SIGTERM into a flag the training loop polls between optimizer steps."""
+
+    def __init__(self, signals=(signal.SIGTERM,)):
+        self.signals = signals
+        self.requested = False
+        self._previous = {}
+
+    def _handle(self, signum, frame):
+        print(f"Received signal {signum}; saving state after the current step...")
+        self.requested = True
+
+    def __enter__(self):
+        for sig in self.signals:
+            self._previous[sig] = signal.signal(sig, self._handle)
+        return self
+
+    def __exit__(self, *exc):
+        for sig, handler in self._previous.items():
+            signal.signal(sig, handler)
+        return False
@@ -0,0 +1,159 @@
+"""Decoded, resized image cache backed by a single memory-mapped uint8 array.
+
+The cache is built once per (image set, size): every image is decoded with
+PIL and resized exactly as `transforms.Resize((size, size))` would, then
+stored as HWC uint8 rows of `<prefix>.u8`. A `<prefix>.index.npz` sidecar
+records the source path and label of each row. Datasets read rows as
+zero-copy views, so epochs only pay for the cheap random augmentations.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+CACHE_SIZE = 260
+_CHUNK = 256
+
+
+def _data_path(prefix: Path) -> Path:
+    return prefix.with_name(prefix.name + ".u8")
+
+
+def _index_path(prefix: Path) -> Path:
+    return prefix.with_name(prefix.name + ".index.npz")
+
+
+def _decode_chunk(data_path: str, shape: Tuple[int, ...], start: int, paths: List[str]) -> int:
+    images = np.memmap(data_path, dtype=np.uint8, mode="r+", shape=shape)
+    size = shape[1]
+    for offset, path in enumerate(paths):
+        with Image.open(path) as image:
+            resized = image.convert("RGB").resize((size, size), Image.BILINEAR)
+        images[start + offset] = np.asarray(resized, dtype=np.uint8)
+    images.flush()
+    return len(paths)
+
+
+class ImageCache:
+    """Read side of the cache. The memmap is opened lazily per process,
+    so DataLoader workers map the file instead of receiving a pickled copy."""
+
+    def __init__(self, prefix: Path):
+        self.prefix = Path(prefix)
+        index = np.load(_index_path(self.prefix), allow_pickle=False)
+        self.paths = [str(p) for p in index["paths"]]
+        self.labels = index["labels"]
+        self.size = int(index["size"])
+        self._rows = {path: row for row, path in enumerate(self.paths)}
+        self._images = None
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @property
+    def images(self) -> np.memmap:
+        if self._images is None:
+            # Copy-on-write keeps rows writable for torch.from_numpy without touching the file
+            self._images = np.memmap(
+                _data_path(self.prefix), dtype=np.uint8, mode="c",
+                shape=(len(self.paths), self.size, self.size, 3),
+            )
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def rows_for(self, paths: Sequence) -> List[int]:
+        return [self._rows[str(path)] for path in paths]
+
+    def covers(self, paths: Sequence, size: int) -> bool:
+        return size == self.size and all(str(path) in self._rows for path in paths)
+
+
+def build_cache(
+    paths: Sequence,
+    prefix: Path,
+    labels: Optional[Sequence[int]] = None,
+    size: int = CACHE_SIZE,
+    num_workers: int = 4,
+) -> ImageCache:
+    prefix = Path(prefix)
+    prefix.parent.mkdir(parents=True, exist_ok=True)
+    _index_path(prefix).unlink(missing_ok=True)
+    paths = [str(path) for path in paths]
+    labels = np.asarray(labels if labels is not None else [-1] * len(paths), dtype=np.int64)
+    shape = (len(paths), size, size, 3)
+
+    data_path = _data_path(prefix)
+    tmp_data = data_path.with_name(data_path.name + ".tmp")
+    np.memmap(tmp_data, dtype=np.uint8, mode="w+", shape=shape).flush()
+
+    print(f"Building image cache ({len(paths)} images at {size}x{size}) -> {data_path}")
+    chunks = [(start, paths[start:start + _CHUNK]) for start in range(0, len(paths), _CHUNK)]
+    done = 0
+    if num_workers > 0:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            futures = [pool.submit(_decode_chunk, str(tmp_data), shape, start, chunk) for start, chunk in chunks]
+            for future in futures:
+                done += future.result()
+                print(f"  cached {done}/{len(paths)}", end="\r")
+    else:
+        for start, chunk in chunks:
+            done += _decode_chunk(str(tmp_data), shape, start, chunk)
+    print()
+
+    # Write data before the index so a half-built cache is never considered valid
+    tmp_data.replace(data_path)
+    index_path = _index_path(prefix)
+    tmp_index = index_path.with_name(index_path.name + ".tmp.npz")
+    np.savez(tmp_index, paths=np.array(paths), labels=labels, size=np.int64(size))
+    tmp_index.replace(index_path)
+    return ImageCache(prefix)
+
+
+def load_or_build_cache(
+    paths: Sequence,
+    prefix: Path,
+    labels: Optional[Sequence[int]] = None,
+    size: int = CACHE_SIZE,
+    num_workers: int = 4,
+    rebuild: bool = False,
+) -> ImageCache:
+    prefix = Path(prefix)
+    if not rebuild and _index_path(prefix).exists() and _data_path(prefix).exists():
+        cache = ImageCache(prefix)
+        if cache.covers(paths, size):
+            print(f"Using image cache {_data_path(prefix)} ({len(cache)} images).")
+            return cache
+        print("Image cache does not cover the current samples; rebuilding.")
+    return build_cache(paths, prefix, labels=labels, size=size, num_workers=num_workers)
+
+
+class CachedImageDataset(Dataset):
+    """Serves (image, label) from an ImageCache.
+
+    items: sequence of (cache_row, label). Images come out as CHW uint8
+    tensors; `transform` should hold only tensor ops (flips, rotation,
+    ConvertImageDtype, Normalize).
+    """
+
+    def __init__(self, cache: ImageCache, items, transform=None):
+        self.cache = cache
+        self.items = items
+        self.transform = transform
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, int]:
+        row, label = self.items[idx]
+        image = torch.from_numpy(self.cache.images[row]).permute(2, 0, 1)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, label
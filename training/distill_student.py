@@ -0,0 +1,250 @@
+"""Distil the PAD-UFES EfficientNet-B2 into a smaller student for CPU serving.
+
+The teacher is the served checkpoint, loaded exactly as DermSightPredictor
+loads it. It scores every augmented training batch and the student learns
+from a mix of three terms:
+  - temperature-scaled KL divergence to the teacher's soft labels,
+  - cross-entropy on the risk labels,
+  - a soft high-risk recall penalty (1 - mean student P(high) on high-risk images).
+Data loading, the seeded split and the image cache are shared with
+finetune_pad_ufes.py. The exported checkpoint carries an "arch" key so the
+predictor builds the right network (see MODEL_ARCHS in server/model.py).
+
+Compare the result with benchmarks/student_report.py.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from batch_augment import BatchAugment  # noqa: E402
+from checkpointing import ResumableRandomSampler  # noqa: E402
+from distributed import DistContext  # noqa: E402
+from finetune_pad_ufes import (  # noqa: E402
+    DEFAULT_HIGH,
+    DEFAULT_MEDIUM,
+    build_datasets,
+    build_image_index,
+    load_metadata,
+    parse_labels,
+)
+from risk_metrics import HIGH_RISK_INDEX, ConfusionMatrix, high_risk_f1  # noqa: E402
+from server.model import MODEL_ARCHS, DermSightModel, DermSightPredictor  # noqa: E402
+from train_utils import add_performance_args, autocast, make_grad_scaler, prepare_model  # noqa: E402
+
+
+def distillation_loss(
+    student_logits,
+    teacher_logits,
+    labels,
+    temperature: float,
+    alpha: float,
+    recall_weight: float,
+    label_smoothing: float = 0.0,
+):
+    student_logits = student_logits.float()
+    teacher_logits = teacher_logits.float()
+    soft = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction="batchmean",
+    ) * temperature ** 2
+    hard = F.cross_entropy(student_logits, labels, label_smoothing=label_smoothing)
+    loss = alpha * soft + (1 - alpha) * hard
+    high = labels == HIGH_RISK_INDEX
+    if recall_weight and high.any():
+        soft_recall = F.softmax(student_logits[high], dim=1)[:, HIGH_RISK_INDEX].mean()
+        loss = loss + recall_weight * (1 - soft_recall)
+    return loss
+
+
+def train_one_epoch(student, teacher, loader, optimizer, device, args, augment=None, scaler=None):
+    student.train()
+    running_loss = 0.0
+    total = 0
+    start = time.perf_counter()
+    optimizer.zero_grad()
+    for step, (images, labels) in enumerate(loader, start=1):
+        images = images.to(device)
+        labels = labels.to(device)
+        if augment is not None:
+            images = augment(images)
+        if args.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+
+        with autocast(device, args.amp):
+            with torch.no_grad():
+                teacher_logits = teacher(images)
+            student_logits = student(images)
+            loss = distillation_loss(
+                student_logits, teacher_logits, labels,
+                args.temperature, args.alpha, args.recall_weight, args.label_smoothing,
+            )
+        scaler.scale(loss / args.accum_steps).backward()
+        if step % args.accum_steps == 0 or step == len(loader):
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad()
+
+        running_loss += loss.item() * images.size(0)
+        total += labels.size(0)
+
+    total = max(total, 1)
+    return running_loss / total, total / (time.perf_counter() - start)
+
+
+def evaluate(model, loader, device, augment=None, amp="off", channels_last=False):
+    model.eval()
+    confusion = ConfusionMatrix(num_classes=3)
+    with torch.no_grad():
+        for images, labels in loader:
+            images = images.to(device)
+            labels = labels.to(device)
+            if augment is not None:
+                images = augment.normalize(images)
+            if channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
+            with autocast(device, amp):
+                outputs = model(images)
+            confusion.update(labels, outputs.argmax(dim=1))
+    return confusion.matrix
+
+
+def main():
+    student_archs = sorted(arch for arch in MODEL_ARCHS if arch != "efficientnet_b2")
+    parser = argparse.ArgumentParser(description="Distil the PAD-UFES model into a smaller student")
+    parser.add_argument("--data-dirs", nargs="+", required=True, help="Image folders")
+    parser.add_argument("--csv-path", required=True, help="Path to metadata CSV")
+    parser.add_argument("--label-col", default="diagnostic", help="CSV column for diagnosis")
+    parser.add_argument("--high-labels", default=",".join(DEFAULT_HIGH))
+    parser.add_argument("--medium-labels", default=",".join(DEFAULT_MEDIUM))
+    parser.add_argument("--teacher", required=True, help="Served PAD-UFES checkpoint")
+    parser.add_argument("--student-arch", choices=student_archs, default="efficientnet_b0")
+    parser.add_argument("--no-pretrained", dest="pretrained", action="store_false",
+                        help="Start the student from random instead of ImageNet weights")
+    parser.add_argument("--output-dir", required=True, help="Output folder")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-4)
+    parser.add_argument("--label-smoothing", type=float, default=0.05)
+    parser.add_argument("--temperature", type=float, default=4.0, help="Softmax temperature for the KL term")
+    parser.add_argument("--alpha", type=float, default=0.7, help="Weight of the KL term vs cross-entropy")
+    parser.add_argument("--recall-weight", type=float, default=0.5, help="Weight of the soft high-risk recall term")
+    parser.add_argument("--val-split", type=float, default=0.15)
+    parser.add_argument("--patience", type=int, default=6)
+    parser.add_argument("--min-delta", type=float, default=0.002)
+    parser.add_argument("--lr-patience", type=int, default=2)
+    parser.add_argument("--lr-factor", type=float, default=0.5)
+    parser.add_argument("--cache-dir", default=None, help="Use a decoded memmap image cache stored here")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Rebuild the image cache")
+    parser.add_argument("--manifest", default=None, help="SQLite image manifest to reuse between runs")
+    parser.add_argument("--batch-augment", action="store_true", help="Augment collated uint8 batches")
+    parser.add_argument("--seed", type=int, default=42, help="Same seed as finetune_pad_ufes.py gives the same split")
+    add_performance_args(parser)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    high_labels = parse_labels(args.high_labels) or DEFAULT_HIGH
+    medium_labels = parse_labels(args.medium_labels) or DEFAULT_MEDIUM
+
+    print("Indexing images...")
+    manifest_path = Path(args.manifest) if args.manifest else None
+    image_index = build_image_index([Path(path) for path in args.data_dirs], manifest_path)
+    samples = load_metadata(
+        Path(args.csv_path), image_index, args.label_col, high_labels, medium_labels, manifest_path
+    )
+    print(f"Loaded {len(samples)} samples.")
+
+    split_generator = torch.Generator().manual_seed(args.seed)
+    train_dataset, val_dataset = build_datasets(samples, args, split_generator, DistContext())
+    print(f"Train size: {len(train_dataset)} | Val size: {len(val_dataset)}")
+    train_sampler = ResumableRandomSampler(len(train_dataset), args.seed)
+    train_loader = DataLoader(
+        train_dataset, batch_size=args.batch_size, sampler=train_sampler, num_workers=args.num_workers
+    )
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+
+    teacher_predictor = DermSightPredictor(args.teacher, use_tta=False)
+    device = teacher_predictor.device
+    teacher = teacher_predictor.model
+    augment = BatchAugment(hflip=True, degrees=15).to(device) if args.batch_augment else None
+
+    student = DermSightModel(args.student_arch, pretrained=args.pretrained).to(device)
+    teacher_params = sum(p.numel() for p in teacher.parameters())
+    student_params = sum(p.numel() for p in student.parameters())
+    print(
+        f"Teacher: {teacher_predictor.arch} ({teacher_params / 1e6:.1f}M params) -> "
+        f"student: {args.student_arch} ({student_params / 1e6:.1f}M params)"
+    )
+
+    if args.channels_last:
+        teacher.to(memory_format=torch.channels_last)
+    teacher_confusion = evaluate(teacher, val_loader, device, augment, args.amp, args.channels_last)
+    precision, recall, f1 = high_risk_f1(teacher_confusion)
+    print(f"Teacher val | high_precision={precision:.4f} high_recall={recall:.4f} high_f1={f1:.4f}")
+
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
+        optimizer, mode="max", factor=args.lr_factor, patience=args.lr_patience, min_lr=1e-6
+    )
+    train_model = prepare_model(student, args.channels_last, args.compile)
+    scaler = make_grad_scaler(device, args.amp)
+
+    best_val_f1 = 0.0
+    epochs_no_improve = 0
+    checkpoint_path = output_dir / f"{args.student_arch}_student_best.pth"
+    for epoch in range(1, args.epochs + 1):
+        train_sampler.set_epoch(epoch)
+        train_loss, train_ips = train_one_epoch(
+            train_model, teacher, train_loader, optimizer, device, args, augment, scaler
+        )
+        val_confusion = evaluate(train_model, val_loader, device, augment, args.amp, args.channels_last)
+        high_precision, high_recall, high_f1 = high_risk_f1(val_confusion)
+        scheduler.step(high_f1)
+
+        print(
+            f"Epoch {epoch}/{args.epochs} | train_loss={train_loss:.4f} "
+            f"train_throughput={train_ips:.1f} img/s | high_precision={high_precision:.4f} "
+            f"high_recall={high_recall:.4f} high_f1={high_f1:.4f}"
+        )
+        print("Confusion matrix (rows=actual, cols=pred):")
+        print(val_confusion.numpy())
+
+        if high_f1 > best_val_f1 + args.min_delta:
+            best_val_f1 = high_f1
+            epochs_no_improve = 0
+            torch.save({
+                "arch": args.student_arch,
+                "model_state_dict": student.state_dict(),
+                "teacher": str(Path(args.teacher).resolve()),
+                "temperature": args.temperature,
+            }, checkpoint_path)
+        else:
+            epochs_no_improve += 1
+
+        if epochs_no_improve >= args.patience:
+            print(
+                f"Early stopping: no high_f1 improvement >= {args.min_delta} "
+                f"for {args.patience} epochs."
+            )
+            break
+
+    if checkpoint_path.exists():
+        print(f"Best student checkpoint: {checkpoint_path} (high_f1={best_val_f1:.4f})")
+    else:
+        print("No epoch improved high_f1; no student checkpoint written.")
+
+
+if __name__ == "__main__":
+    main()
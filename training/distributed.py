@@ -0,0 +1,132 @@
+"""Data-parallel helpers for running the training scripts under torchrun.
+
+    torchrun --standalone --nproc-per-node 4 train_ham10000.py ...
+
+Processes talk over gloo, so this works on plain multi-core CPU boxes.
+Without torchrun's environment variables everything falls back to a
+single process and the reduction helpers are no-ops.
+"""
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset, Subset
+
+
+@dataclass
+class DistContext:
+    rank: int = 0
+    world_size: int = 1
+    local_rank: int = 0
+    local_world_size: int = 1
+
+    @property
+    def enabled(self) -> bool:
+        return self.world_size > 1
+
+    @property
+    def is_main(self) -> bool:
+        return self.rank == 0
+
+    @property
+    def device(self) -> str:
+        if torch.cuda.is_available():
+            return f"cuda:{self.local_rank}" if self.enabled else "cuda"
+        return "cpu"
+
+    def log(self, *args, **kwargs) -> None:
+        """print() on rank 0 only, so progress is reported once per run."""
+        if self.is_main:
+            print(*args, **kwargs)
+
+
+def init_distributed(threads: Optional[int] = None) -> DistContext:
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size == 1:
+        if threads:
+            torch.set_num_threads(threads)
+        return DistContext()
+
+    ctx = DistContext(
+        rank=int(os.environ["RANK"]),
+        world_size=world_size,
+        local_rank=int(os.environ.get("LOCAL_RANK", "0")),
+        local_world_size=int(os.environ.get("LOCAL_WORLD_SIZE", world_size)),
+    )
+    dist.init_process_group("gloo")
+    if torch.cuda.is_available():
+        torch.cuda.set_device(ctx.local_rank)
+    # torchrun defaults OMP_NUM_THREADS to 1; share the cores between local ranks instead
+    torch.set_num_threads(threads or max(1, (os.cpu_count() or 1) // ctx.local_world_size))
+    return ctx
+
+
+def cleanup_distributed() -> None:
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def _initialized() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+@contextmanager
+def main_process_first(ctx: DistContext):
+    """Rank 0 runs the block first (e.g. building a cache), the others then reuse its result."""
+    if ctx.enabled and not ctx.is_main:
+        dist.barrier()
+    yield
+    if ctx.enabled and ctx.is_main:
+        dist.barrier()
+
+
+def validation_shard(dataset: Dataset, ctx: DistContext) -> Subset:
+    """This rank's unpadded strided share of `dataset`, so reduced metrics count every image once.
+
+    Every rank needs at least one image: the first DDP forward in eval
+    broadcasts buffers, and a rank with nothing to evaluate would leave
+    the others waiting on it.
+    """
+    if len(dataset) < ctx.world_size:
+        raise ValueError(
+            f"Validation set has {len(dataset)} images but {ctx.world_size} processes need one each; "
+            "raise --val-split or run fewer processes"
+        )
+    return Subset(dataset, range(ctx.rank, len(dataset), ctx.world_size))
+
+
+def all_reduce_sum(*values: float) -> List[float]:
+    """Sum Python scalars across ranks."""
+    if not _initialized():
+        return list(values)
+    totals = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(totals)
+    return totals.tolist()
+
+
+def all_reduce_tensor(tensor: torch.Tensor) -> torch.Tensor:
+    """Sum a tensor across ranks (e.g. a confusion matrix), returning a CPU copy."""
+    tensor = tensor.detach().cpu().clone()
+    if _initialized():
+        dist.all_reduce(tensor)
+    return tensor
+
+
+def any_rank(flag: bool) -> bool:
+    """True on every rank if it is true on any; keeps collective decisions like stopping in lockstep."""
+    if not _initialized():
+        return flag
+    value = torch.tensor([int(flag)])
+    dist.all_reduce(value, op=dist.ReduceOp.MAX)
+    return bool(value.item())
+
+
+def gather_objects(obj: Any) -> List[Any]:
+    if not _initialized():
+        return [obj]
+    gathered = [None] * dist.get_world_size()
+    dist.all_gather_object(gathered, obj)
+    return gathered
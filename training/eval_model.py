@@ -1,15 +1,29 @@
 import argparse
 import csv
+import math
+import queue
+import traceback
 from pathlib import Path
 from typing import List, Optional
 
 import torch
+import torch.multiprocessing as mp
 import torch.nn as nn
 from torch.utils.data import DataLoader, Dataset
 from torchvision import models, transforms
 from PIL import Image
 import numpy as np
 
+from dataset_cache import CACHE_SIZE, CachedImageDataset, load_or_build_cache
+from image_manifest import load_image_index
+from risk_metrics import (
+    HIGH_RISK_INDEX,
+    accuracy as confusion_accuracy,
+    confusion_matrix,
+    high_risk_f1,
+    per_class_metrics,
+)
+
 try:
     import matplotlib
     matplotlib.use('Agg')
@@ -32,7 +46,9 @@ def parse_labels(value: Optional[str]) -> set:
     return {item.strip().upper() for item in value.split(",") if item.strip()}
 
 
-def build_image_index(image_dirs: List[Path]) -> dict:
+def build_image_index(image_dirs: List[Path], manifest_path: Optional[Path] = None) -> dict:
+    if manifest_path:
+        return load_image_index(manifest_path, image_dirs)
     index = {}
     for directory in image_dirs:
         if not directory.exists():
@@ -88,23 +104,203 @@ def build_model(num_classes=3):
     return base
 
 
+def load_checkpoint_model(checkpoint, device):
+    model = build_model(num_classes=3).to(device)
+
+    # Load checkpoint (handle different formats)
+    raw = torch.load(checkpoint, map_location=device, weights_only=False)
+    if isinstance(raw, dict) and "model_state_dict" in raw:
+        state_dict = raw["model_state_dict"]
+    elif isinstance(raw, dict) and "state_dict" in raw:
+        state_dict = raw["state_dict"]
+    elif isinstance(raw, dict):
+        state_dict = raw
+    else:
+        state_dict = raw.state_dict()
+
+    # Strip 'backbone.' prefix if present
+    cleaned = {}
+    for k, v in state_dict.items():
+        new_key = k.replace("backbone.", "") if k.startswith("backbone.") else k
+        cleaned[new_key] = v
+
+    model.load_state_dict(cleaned, strict=False)
+    model.eval()
+    return model
+
+
+# Seconds between liveness checks while waiting on a scoring worker
+WORKER_POLL_S = 1.0
+
+
+def _score_worker(checkpoint, device, threads, inbox, outbox):
+    # Messages: ("ready", None), ("preds", tensor) per batch, or ("error", traceback) before exiting
+    try:
+        torch.set_num_threads(threads)
+        model = load_checkpoint_model(checkpoint, device)
+        outbox.put(("ready", None))
+        with torch.no_grad():
+            while True:
+                images = inbox.get()
+                if images is None:
+                    break
+                outbox.put(("preds", model(images.to(device)).argmax(dim=1).cpu()))
+    except Exception:
+        outbox.put(("error", traceback.format_exc()))
+
+
+def _receive(checkpoint, process, outbox):
+    """The worker's next payload; raises if it failed or died without answering."""
+    while True:
+        try:
+            kind, payload = outbox.get(timeout=WORKER_POLL_S)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Scoring worker for {checkpoint} exited with code {process.exitcode}")
+            continue
+        if kind == "error":
+            raise RuntimeError(f"Scoring worker for {checkpoint} failed:\n{payload}")
+        return payload
+
+
+def _send(checkpoint, process, inbox, images):
+    while True:
+        try:
+            inbox.put(images, timeout=WORKER_POLL_S)
+            return
+        except queue.Full:
+            if not process.is_alive():
+                raise RuntimeError(f"Scoring worker for {checkpoint} exited with code {process.exitcode}")
+
+
+def score_checkpoints(loader, checkpoints, device, parallel=False):
+    """Run every checkpoint on each decoded batch.
+
+    Returns (labels [N], preds [len(checkpoints), N]). With `parallel`, each
+    model lives in its own process and batches reach it through shared memory.
+    """
+    all_labels, all_preds = [], []
+    if not parallel:
+        loaded = [load_checkpoint_model(checkpoint, device) for checkpoint in checkpoints]
+        with torch.no_grad():
+            for images, labels in loader:
+                images = images.to(device)
+                all_labels.append(labels)
+                all_preds.append(torch.stack([model(images).argmax(dim=1).cpu() for model in loaded]))
+        return torch.cat(all_labels), torch.cat(all_preds, dim=1)
+
+    context = mp.get_context("spawn")
+    threads = max(1, torch.get_num_threads() // len(checkpoints))
+    workers = []
+    try:
+        for checkpoint in checkpoints:
+            inbox, outbox = context.Queue(maxsize=2), context.Queue()
+            process = context.Process(target=_score_worker, args=(checkpoint, device, threads, inbox, outbox))
+            process.start()
+            workers.append((checkpoint, process, inbox, outbox))
+        for checkpoint, process, _, outbox in workers:
+            _receive(checkpoint, process, outbox)
+        for images, labels in loader:
+            images.share_memory_()
+            for checkpoint, process, inbox, _ in workers:
+                _send(checkpoint, process, inbox, images)
+            all_labels.append(labels)
+            all_preds.append(torch.stack([
+                _receive(checkpoint, process, outbox) for checkpoint, process, _, outbox in workers
+            ]))
+    finally:
+        for _, process, inbox, _ in workers:
+            try:
+                inbox.put_nowait(None)
+            except queue.Full:
+                pass
+        for _, process, _, _ in workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+    return torch.cat(all_labels), torch.cat(all_preds, dim=1)
+
+
+def mcnemar_p(b: int, c: int) -> float:
+    """Exact two-sided McNemar p-value from the discordant pair counts."""
+    n = b + c
+    if n == 0:
+        return 1.0
+    tail = sum(math.comb(n, k) for k in range(min(b, c) + 1)) / 2 ** n
+    return min(1.0, 2 * tail)
+
+
+def paired_recall_difference(ref_hits, hits, num_bootstrap=2000, seed=0):
+    """Difference in recall (hits - ref_hits) over the same positives, with a paired bootstrap 95% CI."""
+    if len(hits) == 0:
+        return 0.0, (0.0, 0.0)
+    delta = hits.astype(np.float64) - ref_hits.astype(np.float64)
+    rng = np.random.default_rng(seed)
+    resampled = delta[rng.integers(0, len(delta), size=(num_bootstrap, len(delta)))].mean(axis=1)
+    low, high = np.percentile(resampled, [2.5, 97.5])
+    return float(delta.mean()), (float(low), float(high))
+
+
+def print_comparison(names, labels, preds, num_bootstrap):
+    """One row per checkpoint; high-risk recall is compared to the first checkpoint on the same images."""
+    labels = labels.numpy()
+    preds = preds.numpy()
+    high = labels == HIGH_RISK_INDEX
+    ref_hits = preds[0][high] == HIGH_RISK_INDEX
+    width = max(len("Checkpoint"), *(len(name) for name in names))
+
+    print("\n" + "=" * (width + 84))
+    print(f"Comparison on {len(labels)} images ({int(high.sum())} high risk); reference: {names[0]}")
+    print("=" * (width + 84))
+    print(
+        f"{'Checkpoint':<{width}} {'Acc':>7} {'HighP':>7} {'HighR':>7} {'HighF1':>7} "
+        f"{'dHighR':>8} {'95% CI':>17} {'b/c':>9} {'p':>7}"
+    )
+    for index, (name, model_preds) in enumerate(zip(names, preds)):
+        cm = confusion_matrix(labels, model_preds, 3)
+        precision, recall, f1 = high_risk_f1(cm)
+        row = f"{name:<{width}} {confusion_accuracy(cm):>7.4f} {precision:>7.4f} {recall:>7.4f} {f1:>7.4f}"
+        if index == 0:
+            print(row)
+            continue
+        hits = model_preds[high] == HIGH_RISK_INDEX
+        delta, (low, high_ci) = paired_recall_difference(ref_hits, hits, num_bootstrap)
+        # b: only this model catches the case, c: only the reference does
+        b = int((hits & ~ref_hits).sum())
+        c = int((~hits & ref_hits).sum())
+        print(
+            f"{row} {delta:>+8.4f} {f'[{low:+.3f}, {high_ci:+.3f}]':>17} "
+            f"{f'{b}/{c}':>9} {mcnemar_p(b, c):>7.4f}"
+        )
+
+
 def main():
-    parser = argparse.ArgumentParser(description="Evaluate model and plot confusion matrix")
-    parser.add_argument("--checkpoint", required=True, help="Path to .pth model")
+    parser = argparse.ArgumentParser(description="Evaluate models and plot confusion matrices")
+    parser.add_argument("--checkpoint", nargs="+", required=True,
+                        help="One or more .pth models; the first is the reference for comparisons")
     parser.add_argument("--data-dirs", nargs="+", required=True, help="Image folders")
     parser.add_argument("--csv-path", required=True, help="Metadata CSV")
     parser.add_argument("--label-col", default="diagnostic")
     parser.add_argument("--high-labels", default=",".join(DEFAULT_HIGH))
     parser.add_argument("--medium-labels", default=",".join(DEFAULT_MEDIUM))
     parser.add_argument("--batch-size", type=int, default=32)
-    parser.add_argument("--output", default="confusion_matrix.png", help="Output image path")
+    parser.add_argument("--output", default="confusion_matrix.png",
+                        help="Output image path (suffixed with the checkpoint name when comparing)")
+    parser.add_argument("--cache-dir", default=None, help="Use a decoded memmap image cache stored here")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Rebuild the image cache")
+    parser.add_argument("--manifest", default=None, help="SQLite image manifest to reuse between runs")
+    parser.add_argument("--parallel", action="store_true", help="Score each checkpoint in its own process")
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--bootstrap", type=int, default=2000, help="Paired bootstrap resamples for the CI")
     args = parser.parse_args()
 
     high_labels = parse_labels(args.high_labels) or DEFAULT_HIGH
     medium_labels = parse_labels(args.medium_labels) or DEFAULT_MEDIUM
 
     print("Indexing images...")
-    image_index = build_image_index([Path(p) for p in args.data_dirs])
+    manifest_path = Path(args.manifest) if args.manifest else None
+    image_index = build_image_index([Path(p) for p in args.data_dirs], manifest_path)
     print(f"Indexed {len(image_index)} images.")
 
     print("Loading metadata...")
@@ -127,61 +323,52 @@ def main():
         transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
     ])
 
-    dataset = SimpleDataset(samples, transform)
-    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=4)
+    if args.cache_dir:
+        cache = load_or_build_cache(
+            [path for path, _ in samples],
+            Path(args.cache_dir) / f"pad_ufes_{CACHE_SIZE}",
+            labels=[lbl for _, lbl in samples],
+            rebuild=args.rebuild_cache,
+        )
+        items = list(zip(cache.rows_for([path for path, _ in samples]), [lbl for _, lbl in samples]))
+        cached_transform = transforms.Compose([
+            transforms.CenterCrop((224, 224)),
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ])
+        dataset = CachedImageDataset(cache, items, cached_transform)
+    else:
+        dataset = SimpleDataset(samples, transform)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Device: {device}")
 
-    model = build_model(num_classes=3).to(device)
+    checkpoints = [Path(checkpoint) for checkpoint in args.checkpoint]
+    names = [checkpoint.stem for checkpoint in checkpoints]
+    if len(set(names)) < len(names):
+        names = [str(checkpoint) for checkpoint in checkpoints]
+    print(f"Scoring {len(checkpoints)} model(s){' in parallel' if args.parallel else ''}...\n")
+    labels, preds = score_checkpoints(loader, checkpoints, device, args.parallel and len(checkpoints) > 1)
 
-    # Load checkpoint (handle different formats)
-    raw = torch.load(args.checkpoint, map_location=device, weights_only=False)
-    if isinstance(raw, dict) and "model_state_dict" in raw:
-        state_dict = raw["model_state_dict"]
-    elif isinstance(raw, dict) and "state_dict" in raw:
-        state_dict = raw["state_dict"]
-    elif isinstance(raw, dict):
-        state_dict = raw
-    else:
-        state_dict = raw.state_dict()
-
-    # Strip 'backbone.' prefix if present
-    cleaned = {}
-    for k, v in state_dict.items():
-        new_key = k.replace("backbone.", "") if k.startswith("backbone.") else k
-        cleaned[new_key] = v
+    output = Path(args.output)
+    for name, model_preds in zip(names, preds):
+        if len(checkpoints) > 1:
+            print(f"\n### {name}")
+            output_path = output.with_name(f"{output.stem}_{Path(name).stem}{output.suffix}")
+        else:
+            output_path = output
+        report(confusion_matrix(labels, model_preds, 3).numpy(), output_path)
 
-    model.load_state_dict(cleaned, strict=False)
-    model.eval()
-    print("Model loaded.\n")
+    if len(checkpoints) > 1:
+        print_comparison(names, labels, preds, args.bootstrap)
 
-    # Evaluate
-    all_preds = []
-    all_labels = []
-    correct = 0
-    total = 0
 
-    with torch.no_grad():
-        for images, labels in loader:
-            images = images.to(device)
-            labels = labels.to(device)
-            outputs = model(images)
-            preds = outputs.argmax(dim=1)
-            correct += (preds == labels).sum().item()
-            total += labels.size(0)
-            all_preds.extend(preds.cpu().numpy())
-            all_labels.extend(labels.cpu().numpy())
-
-    all_preds = np.array(all_preds)
-    all_labels = np.array(all_labels)
-    accuracy = correct / total
-
-    # Build confusion matrix
-    num_classes = 3
-    cm = np.zeros((num_classes, num_classes), dtype=int)
-    for t, p in zip(all_labels, all_preds):
-        cm[t, p] += 1
+def report(cm, output_path):
+    num_classes = len(CLASS_NAMES)
+    total = int(cm.sum())
+    correct = int(np.trace(cm))
+    accuracy = confusion_accuracy(cm)
 
     # Per-class metrics
     print("=" * 60)
@@ -189,15 +376,12 @@ def main():
     print("=" * 60)
     print(f"\n{'Class':<15} {'Precision':>10} {'Recall':>10} {'F1':>10} {'Support':>10}")
     print("-" * 60)
+    metrics = per_class_metrics(cm)
     for i, name in enumerate(CLASS_NAMES):
-        tp = cm[i, i]
-        fp = cm[:, i].sum() - tp
-        fn = cm[i, :].sum() - tp
-        prec = tp / (tp + fp) if (tp + fp) else 0
-        rec = tp / (tp + fn) if (tp + fn) else 0
-        f1 = 2 * prec * rec / (prec + rec) if (prec + rec) else 0
-        support = cm[i, :].sum()
-        print(f"{name:<15} {prec:>10.4f} {rec:>10.4f} {f1:>10.4f} {support:>10d}")
+        print(
+            f"{name:<15} {metrics['precision'][i]:>10.4f} {metrics['recall'][i]:>10.4f} "
+            f"{metrics['f1'][i]:>10.4f} {metrics['support'][i]:>10d}"
+        )
 
     print(f"\nConfusion Matrix (rows=actual, cols=predicted):")
     print(f"{'':>15}", end="")
@@ -240,7 +424,6 @@ def main():
         axes[1].set_title("Confusion Matrix (% per class)", fontsize=13)
 
         plt.tight_layout()
-        output_path = Path(args.output)
         plt.savefig(output_path, dpi=150)
         print(f"\nConfusion matrix saved to: {output_path.resolve()}")
         plt.close()
@@ -248,5 +431,6 @@ def main():
         print("\nInstall matplotlib & seaborn to save a visual confusion matrix.")
 
 
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
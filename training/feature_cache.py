@@ -0,0 +1,151 @@
+"""Frozen-backbone embedding cache for classifier-head experiments.
+
+The EfficientNet-B2 backbone (features + avgpool) runs once over every
+image and each fixed TTA view, and the 1408-d pooled embeddings are stored
+in `<prefix>.npz` with the image paths and raw diagnosis labels. Views use
+the same Resize(260) -> CenterCrop(224) preprocessing as DermSightPredictor,
+so a head trained on the cache behaves identically when served. Raw labels
+are kept so risk mappings can change without re-extracting.
+"""
+import os
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from torchvision import transforms
+
+FEATURE_DIM = 1408
+
+_BASE = [transforms.Resize((260, 260)), transforms.CenterCrop((224, 224))]
+_TO_TENSOR = [
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+]
+# Same order as DermSightPredictor.tta_transforms
+VIEW_TRANSFORMS = {
+    "center": transforms.Compose(_BASE + _TO_TENSOR),
+    "hflip": transforms.Compose(_BASE + [transforms.RandomHorizontalFlip(p=1.0)] + _TO_TENSOR),
+    "vflip": transforms.Compose(_BASE + [transforms.RandomVerticalFlip(p=1.0)] + _TO_TENSOR),
+}
+
+
+def _cache_path(prefix: Path) -> Path:
+    return prefix.with_name(prefix.name + ".npz")
+
+
+def _checkpoint_id(checkpoint: Path) -> str:
+    stat = os.stat(checkpoint)
+    return f"{Path(checkpoint).resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class _ViewDataset(Dataset):
+    def __init__(self, paths: Sequence, views: Sequence[str]):
+        self.paths = paths
+        self.views = views
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, idx: int) -> torch.Tensor:
+        image = Image.open(self.paths[idx]).convert("RGB")
+        return torch.stack([VIEW_TRANSFORMS[view](image) for view in self.views])
+
+
+class Backbone(nn.Module):
+    """features -> avgpool -> flatten of an EfficientNet, i.e. the classifier input."""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.features = model.features
+        self.avgpool = model.avgpool
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        return torch.flatten(self.avgpool(self.features(images)), 1)
+
+
+def extract_features(
+    backbone: nn.Module,
+    paths: Sequence,
+    views: Sequence[str],
+    device,
+    batch_size: int = 32,
+    num_workers: int = 4,
+) -> np.ndarray:
+    """Embeddings as a float32 [N, len(views), FEATURE_DIM] array."""
+    loader = DataLoader(_ViewDataset(paths, views), batch_size=batch_size, num_workers=num_workers)
+    backbone.eval()
+    chunks = []
+    done = 0
+    with torch.no_grad():
+        for batch in loader:
+            n, v = batch.shape[:2]
+            embeddings = backbone(batch.flatten(0, 1).to(device))
+            chunks.append(embeddings.view(n, v, -1).float().cpu().numpy())
+            done += n
+            print(f"  extracted {done}/{len(paths)}", end="\r")
+    print()
+    return np.concatenate(chunks) if chunks else np.zeros((0, len(views), FEATURE_DIM), np.float32)
+
+
+class FeatureCache:
+    def __init__(self, prefix: Path):
+        self.prefix = Path(prefix)
+        data = np.load(_cache_path(self.prefix), allow_pickle=False)
+        self.features = data["features"]
+        self.paths = [str(p) for p in data["paths"]]
+        self.labels = [str(label) for label in data["labels"]]
+        self.views = [str(view) for view in data["views"]]
+        self.checkpoint_id = str(data["checkpoint_id"])
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def matches(self, paths: Sequence, labels: Sequence[str], views: Sequence[str], checkpoint_id: str) -> bool:
+        return (
+            self.checkpoint_id == checkpoint_id
+            and self.views == list(views)
+            and self.paths == [str(p) for p in paths]
+            and self.labels == list(labels)
+        )
+
+
+def load_or_build_features(
+    backbone: nn.Module,
+    checkpoint: Path,
+    paths: Sequence,
+    labels: List[str],
+    prefix: Path,
+    views: Sequence[str],
+    device,
+    batch_size: int = 32,
+    num_workers: int = 4,
+    rebuild: bool = False,
+) -> FeatureCache:
+    prefix = Path(prefix)
+    checkpoint_id = _checkpoint_id(checkpoint)
+    if not rebuild and _cache_path(prefix).exists():
+        cache = FeatureCache(prefix)
+        if cache.matches(paths, labels, views, checkpoint_id):
+            print(f"Using feature cache {_cache_path(prefix)} ({len(cache)} images x {len(views)} views).")
+            return cache
+        print("Feature cache is stale (images, views or checkpoint changed); re-extracting.")
+
+    print(f"Extracting {FEATURE_DIM}-d features ({len(paths)} images x {len(views)} views)...")
+    features = extract_features(backbone, paths, views, device, batch_size, num_workers)
+    prefix.parent.mkdir(parents=True, exist_ok=True)
+    path = _cache_path(prefix)
+    tmp_path = path.with_name(path.name + ".tmp.npz")
+    np.savez(
+        tmp_path,
+        features=features,
+        paths=np.array([str(p) for p in paths]),
+        labels=np.array(labels),
+        views=np.array(list(views)),
+        checkpoint_id=np.array(checkpoint_id),
+    )
+    tmp_path.replace(path)
+    return FeatureCache(prefix)
@@ -0,0 +1,190 @@
+"""Retrain only the classifier head of the PAD-UFES model on cached backbone features.
+
+The backbone runs once (see feature_cache.py); every later run with the
+same checkpoint, images and views trains the linear head on the cached
+embeddings in seconds. --high-labels / --medium-labels are applied to the
+cached raw diagnoses, so trying a new risk mapping needs no re-extraction.
+The exported checkpoint is a full EfficientNet-B2 state dict that
+DermSightPredictor loads as-is.
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import random_split
+from torchvision import models
+
+from feature_cache import FEATURE_DIM, VIEW_TRANSFORMS, Backbone, load_or_build_features
+from finetune_pad_ufes import (
+    DEFAULT_HIGH,
+    DEFAULT_MEDIUM,
+    build_image_index,
+    parse_labels,
+    read_metadata,
+    risk_label,
+)
+from image_manifest import ImageManifest
+from risk_metrics import confusion_matrix, high_risk_f1
+
+NUM_CLASSES = 3
+
+
+def load_backbone_model(checkpoint_path: Path, device) -> nn.Module:
+    """EfficientNet-B2 with the checkpoint's weights and a fresh 3-class head."""
+    model = models.efficientnet_b2(weights=None)
+    model.classifier[1] = nn.Linear(model.classifier[1].in_features, NUM_CLASSES)
+    checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=True)
+    classifier_keys = {"classifier.1.weight", "classifier.1.bias"}
+    filtered_checkpoint = {key: value for key, value in checkpoint.items() if key not in classifier_keys}
+    missing, unexpected = model.load_state_dict(filtered_checkpoint, strict=False)
+    print(
+        f"Loaded backbone (excluding classifier). Missing: {len(missing)} | "
+        f"Unexpected: {len(unexpected)}"
+    )
+    return model.to(device)
+
+
+def evaluate_head(head: nn.Module, features: torch.Tensor, labels: torch.Tensor):
+    """Averages softmax over the cached views, as DermSightPredictor does with TTA."""
+    head.eval()
+    with torch.no_grad():
+        n, v, d = features.shape
+        probs = torch.softmax(head(features.view(n * v, d)), dim=1).view(n, v, -1).mean(dim=1)
+    preds = probs.argmax(dim=1)
+    confusion = confusion_matrix(labels, preds, NUM_CLASSES)
+    accuracy = (preds == labels).float().mean().item() if n else 0.0
+    return accuracy, confusion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the PAD-UFES classifier head on cached backbone features")
+    parser.add_argument("--data-dirs", nargs="+", required=True, help="Image folders")
+    parser.add_argument("--csv-path", required=True, help="Path to metadata CSV")
+    parser.add_argument("--label-col", default="diagnostic", help="CSV column for diagnosis")
+    parser.add_argument("--high-labels", default=",".join(DEFAULT_HIGH))
+    parser.add_argument("--medium-labels", default=",".join(DEFAULT_MEDIUM))
+    parser.add_argument("--checkpoint", required=True, help="Backbone checkpoint (HAM10000 or PAD-UFES)")
+    parser.add_argument("--output-dir", required=True, help="Output folder")
+    parser.add_argument("--cache-dir", default=None, help="Feature cache folder (defaults to output-dir)")
+    parser.add_argument("--views", nargs="+", choices=list(VIEW_TRANSFORMS), default=["center"],
+                        help="Fixed TTA views to embed; training uses every view as a sample")
+    parser.add_argument("--rebuild-features", action="store_true", help="Re-extract features")
+    parser.add_argument("--manifest", default=None, help="SQLite image manifest to reuse between runs")
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--extract-batch-size", type=int, default=32)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-4)
+    parser.add_argument("--label-smoothing", type=float, default=0.05)
+    parser.add_argument("--dropout", type=float, default=0.3, help="Matches EfficientNet-B2's classifier dropout")
+    parser.add_argument("--val-split", type=float, default=0.15)
+    parser.add_argument("--seed", type=int, default=42, help="Same seed as finetune_pad_ufes.py gives the same split")
+    args = parser.parse_args()
+    if args.epochs < 1:
+        parser.error("--epochs must be at least 1")
+
+    data_dirs = [Path(path) for path in args.data_dirs]
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = Path(args.cache_dir) if args.cache_dir else output_dir
+    high_labels = parse_labels(args.high_labels) or DEFAULT_HIGH
+    medium_labels = parse_labels(args.medium_labels) or DEFAULT_MEDIUM
+
+    print("Indexing images...")
+    manifest_path = Path(args.manifest) if args.manifest else None
+    image_index = build_image_index(data_dirs, manifest_path)
+    rows = read_metadata(Path(args.csv_path), image_index, args.label_col)
+    if manifest_path:
+        with ImageManifest(manifest_path) as manifest:
+            manifest.set_labels(dict(rows))
+    paths = [path for path, _ in rows]
+    raw_labels = [label for _, label in rows]
+    print(f"Loaded {len(rows)} samples.")
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"Using device: {device}")
+    model = load_backbone_model(Path(args.checkpoint), device)
+    cache = load_or_build_features(
+        Backbone(model),
+        Path(args.checkpoint),
+        paths,
+        raw_labels,
+        cache_dir / "pad_ufes_features",
+        args.views,
+        device,
+        batch_size=args.extract_batch_size,
+        num_workers=args.num_workers,
+        rebuild=args.rebuild_features,
+    )
+
+    features = torch.from_numpy(cache.features).to(device)
+    labels = torch.tensor(
+        [risk_label(label, high_labels, medium_labels) for label in cache.labels], device=device
+    )
+    print("Risk class counts:", np.bincount(labels.cpu().numpy(), minlength=NUM_CLASSES).tolist())
+
+    val_size = int(len(labels) * args.val_split)
+    train_size = len(labels) - val_size
+    generator = torch.Generator().manual_seed(args.seed)
+    train_idx, val_idx = random_split(range(len(labels)), [train_size, val_size], generator=generator)
+    train_idx = torch.tensor(list(train_idx), device=device)
+    val_idx = torch.tensor(list(val_idx), device=device)
+
+    # Every cached view of a training image is its own sample
+    num_views = features.shape[1]
+    train_x = features[train_idx].reshape(-1, FEATURE_DIM)
+    train_y = labels[train_idx].repeat_interleave(num_views)
+    val_x, val_y = features[val_idx], labels[val_idx]
+    print(f"Train size: {train_size} ({len(train_y)} views) | Val size: {val_size}")
+
+    torch.manual_seed(args.seed)
+    head = nn.Sequential(nn.Dropout(p=args.dropout), nn.Linear(FEATURE_DIM, NUM_CLASSES)).to(device)
+    criterion = nn.CrossEntropyLoss(label_smoothing=args.label_smoothing)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+
+    best_val_f1 = -1.0
+    best_head = None
+    best_confusion = None
+    start = time.perf_counter()
+    for epoch in range(1, args.epochs + 1):
+        head.train()
+        order = torch.randperm(len(train_y), device=device)
+        running_loss = 0.0
+        for batch in order.split(args.batch_size):
+            optimizer.zero_grad()
+            loss = criterion(head(train_x[batch]), train_y[batch])
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * len(batch)
+        scheduler.step()
+
+        val_acc, val_confusion = evaluate_head(head, val_x, val_y)
+        high_precision, high_recall, high_f1 = high_risk_f1(val_confusion)
+        # Epochs take milliseconds, so only improvements are logged
+        if high_f1 > best_val_f1:
+            best_val_f1 = high_f1
+            best_head = {key: value.detach().clone() for key, value in head[1].state_dict().items()}
+            best_confusion = val_confusion
+            print(
+                f"Epoch {epoch}/{args.epochs} | train_loss={running_loss / len(train_y):.4f} | "
+                f"val_acc={val_acc:.4f} | high_precision={high_precision:.4f} "
+                f"high_recall={high_recall:.4f} high_f1={high_f1:.4f}"
+            )
+    print(f"Trained head for {args.epochs} epochs in {time.perf_counter() - start:.1f}s.")
+    print("Best confusion matrix (rows=actual, cols=pred):")
+    print(best_confusion.cpu().numpy())
+
+    # Backbone weights + trained head, in the layout DermSightPredictor loads
+    model.classifier[1].load_state_dict(best_head)
+    export_path = output_dir / "efficientnet_b2_pad_ufes_head_best.pth"
+    torch.save(model.state_dict(), export_path)
+    print(f"Saved predictor checkpoint to {export_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import argparse
 import csv
+import time
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Optional, Tuple
@@ -10,6 +11,30 @@ from torch.utils.data import DataLoader, Dataset, random_split
 from torchvision import models, transforms
 from PIL import Image
 
+from batch_augment import BatchAugment
+from checkpointing import (
+    PreemptionHandler,
+    ResumableRandomSampler,
+    capture_rng_state,
+    load_training_state,
+    restore_rng_state,
+    save_training_state,
+)
+from dataset_cache import CACHE_SIZE, CachedImageDataset, load_or_build_cache
+from distributed import (
+    all_reduce_sum,
+    all_reduce_tensor,
+    any_rank,
+    cleanup_distributed,
+    gather_objects,
+    init_distributed,
+    main_process_first,
+    validation_shard,
+)
+from image_manifest import ImageManifest, load_image_index
+from risk_metrics import ConfusionMatrix, high_risk_f1
+from train_utils import add_performance_args, autocast, make_grad_scaler, prepare_model, sync_gradients
+
 DEFAULT_HIGH = {"MEL", "SCC", "SEK"}
 DEFAULT_MEDIUM = {"BCC", "ACK"}
 
@@ -26,27 +51,35 @@ def parse_labels(value: Optional[str]) -> set[str]:
     return {item.strip().upper() for item in value.split(",") if item.strip()}
 
 
-def build_image_index(image_dirs: List[Path]) -> dict[str, Path]:
-    index = {}
-    for directory in image_dirs:
-        if not directory.exists():
-            continue
-        for path in directory.rglob("*"):
-            if path.is_file() and path.suffix.lower() in {".png", ".jpg", ".jpeg"}:
-                index[path.name] = path
+def build_image_index(image_dirs: List[Path], manifest_path: Optional[Path] = None) -> dict[str, Path]:
+    if manifest_path:
+        index = load_image_index(manifest_path, image_dirs)
+    else:
+        index = {}
+        for directory in image_dirs:
+            if not directory.exists():
+                continue
+            for path in directory.rglob("*"):
+                if path.is_file() and path.suffix.lower() in {".png", ".jpg", ".jpeg"}:
+                    index[path.name] = path
     if not index:
         raise FileNotFoundError("No images found in provided PAD-UFES image folders.")
     return index
 
 
-def load_metadata(
-    csv_path: Path,
-    image_index: dict[str, Path],
-    label_col: str,
-    high_labels: set[str],
-    medium_labels: set[str],
-) -> List[Sample]:
-    samples: List[Sample] = []
+def risk_label(label: str, high_labels: set[str], medium_labels: set[str]) -> int:
+    if label in high_labels:
+        return 2
+    if label in medium_labels:
+        return 1
+    return 0
+
+
+def read_metadata(
+    csv_path: Path, image_index: dict[str, Path], label_col: str
+) -> List[Tuple[Path, str]]:
+    """(image path, upper-cased diagnosis) for every CSV row with an indexed image."""
+    rows: List[Tuple[Path, str]] = []
     missing_images = 0
     with csv_path.open("r", newline="") as handle:
         reader = csv.DictReader(handle)
@@ -59,18 +92,30 @@ def load_metadata(
             if not image_path:
                 missing_images += 1
                 continue
-            label = label_raw.strip().upper()
-            if label in high_labels:
-                risk = 2
-            elif label in medium_labels:
-                risk = 1
-            else:
-                risk = 0
-            samples.append(Sample(image_path=image_path, label=risk))
-    if not samples:
+            rows.append((image_path, label_raw.strip().upper()))
+    if not rows:
         raise ValueError("No samples found. Check CSV columns and image paths.")
     if missing_images:
         print(f"Skipped {missing_images} rows with missing images.")
+    return rows
+
+
+def load_metadata(
+    csv_path: Path,
+    image_index: dict[str, Path],
+    label_col: str,
+    high_labels: set[str],
+    medium_labels: set[str],
+    manifest_path: Optional[Path] = None,
+) -> List[Sample]:
+    rows = read_metadata(csv_path, image_index, label_col)
+    samples = [
+        Sample(image_path=path, label=risk_label(label, high_labels, medium_labels))
+        for path, label in rows
+    ]
+    if manifest_path:
+        with ImageManifest(manifest_path) as manifest:
+            manifest.set_labels(dict(rows))
     return samples
 
 
@@ -96,61 +141,152 @@ def build_model(num_classes: int) -> nn.Module:
     return model
 
 
-def train_one_epoch(model, loader, criterion, optimizer, device):
+def train_one_epoch(
+    model,
+    loader,
+    criterion,
+    optimizer,
+    device,
+    augment=None,
+    amp="off",
+    scaler=None,
+    channels_last=False,
+    accum_steps=1,
+    should_stop=None,
+):
     model.train()
     running_loss = 0.0
     correct = 0
     total = 0
-    for images, labels in loader:
+    scaler = scaler or make_grad_scaler(device, amp)
+    start = time.perf_counter()
+    optimizer.zero_grad()
+    batches = 0
+    for step, (images, labels) in enumerate(loader, start=1):
         images = images.to(device)
         labels = labels.to(device)
-
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
+        if augment is not None:
+            images = augment(images)
+        if channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+
+        stepping = step % accum_steps == 0 or step == len(loader)
+        with sync_gradients(model, stepping):
+            with autocast(device, amp):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+            scaler.scale(loss / accum_steps).backward()
+        stop = False
+        if stepping:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad()
+            # Only stop on an optimizer-step boundary so no accumulated gradient is lost
+            stop = should_stop is not None and should_stop()
 
         running_loss += loss.item() * images.size(0)
         preds = outputs.argmax(dim=1)
         correct += (preds == labels).sum().item()
         total += labels.size(0)
+        batches = step
+        if stop:
+            break
 
-    return running_loss / total, correct / total
+    elapsed = time.perf_counter() - start
+    # Every rank reports global numbers, so logging and early stopping agree
+    running_loss, correct, total = all_reduce_sum(running_loss, correct, total)
+    total = max(total, 1)
+    images_per_sec = total / elapsed
+    return running_loss / total, correct / total, images_per_sec, batches
 
 
-def evaluate(model, loader, criterion, device):
+def evaluate(model, loader, criterion, device, augment=None, amp="off", channels_last=False):
     model.eval()
     running_loss = 0.0
     correct = 0
     total = 0
-    num_classes = 3
-    confusion = torch.zeros((num_classes, num_classes), dtype=torch.int64)
+    confusion = ConfusionMatrix(num_classes=3)
     with torch.no_grad():
         for images, labels in loader:
             images = images.to(device)
             labels = labels.to(device)
-            outputs = model(images)
-            loss = criterion(outputs, labels)
+            if augment is not None:
+                images = augment.normalize(images)
+            if channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
+            with autocast(device, amp):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
 
             running_loss += loss.item() * images.size(0)
             preds = outputs.argmax(dim=1)
             correct += (preds == labels).sum().item()
             total += labels.size(0)
-            for target, pred in zip(labels.view(-1), preds.view(-1)):
-                confusion[target.long(), pred.long()] += 1
+            confusion.update(labels, preds)
 
-    return running_loss / total, correct / total, confusion
+    running_loss, correct, total = all_reduce_sum(running_loss, correct, total)
+    return running_loss / total, correct / total, all_reduce_tensor(confusion.matrix)
+
+
+def build_datasets(samples: List[Sample], args, split_generator, ctx) -> Tuple[Dataset, Dataset]:
+    """Seeded train/val split over the PAD samples, read from the image cache when --cache-dir is set.
+
+    Uses args.val_split, cache_dir, rebuild_cache, batch_augment and num_workers.
+    """
+    transform_train = transforms.Compose([
+        transforms.Resize((260, 260)),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(15),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    ])
+    transform_val = transforms.Compose([
+        transforms.Resize((260, 260)),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    ])
 
+    if args.batch_augment:
+        # Datasets yield resized uint8; flips, rotation and normalization run per batch
+        transform_train = transform_val = transforms.Compose([
+            transforms.Resize((260, 260)),
+            transforms.PILToTensor(),
+        ])
 
-def high_risk_f1(confusion: torch.Tensor, high_index: int = 2) -> Tuple[float, float, float]:
-    tp = confusion[high_index, high_index].item()
-    fp = confusion[:, high_index].sum().item() - tp
-    fn = confusion[high_index, :].sum().item() - tp
-    precision = tp / (tp + fp) if (tp + fp) else 0.0
-    recall = tp / (tp + fn) if (tp + fn) else 0.0
-    f1 = (2 * precision * recall / (precision + recall)) if (precision + recall) else 0.0
-    return precision, recall, f1
+    val_size = int(len(samples) * args.val_split)
+    train_size = len(samples) - val_size
+    if args.cache_dir:
+        # Images are already decoded and resized; only tensor augmentations remain
+        with main_process_first(ctx):
+            cache = load_or_build_cache(
+                [s.image_path for s in samples],
+                Path(args.cache_dir) / f"pad_ufes_{CACHE_SIZE}",
+                labels=[s.label for s in samples],
+                rebuild=args.rebuild_cache,
+                num_workers=args.num_workers,
+            )
+        items = list(zip(cache.rows_for([s.image_path for s in samples]), [s.label for s in samples]))
+        train_items, val_items = random_split(items, [train_size, val_size], generator=split_generator)
+        cached_train = transforms.Compose([
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomRotation(15),
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ])
+        cached_val = transforms.Compose([
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ])
+        if args.batch_augment:
+            cached_train = cached_val = None
+        train_dataset = CachedImageDataset(cache, train_items, cached_train)
+        val_dataset = CachedImageDataset(cache, val_items, cached_val)
+    else:
+        train_samples, val_samples = random_split(samples, [train_size, val_size], generator=split_generator)
+        train_dataset = PadDataset(train_samples, transform_train)
+        val_dataset = PadDataset(val_samples, transform_val)
+
+    return train_dataset, val_dataset
 
 
 def main():
@@ -172,58 +308,66 @@ def main():
     parser.add_argument("--min-delta", type=float, default=0.002)
     parser.add_argument("--lr-patience", type=int, default=2)
     parser.add_argument("--lr-factor", type=float, default=0.5)
+    parser.add_argument("--cache-dir", default=None, help="Use a decoded memmap image cache stored here")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Rebuild the image cache")
+    parser.add_argument("--manifest", default=None, help="SQLite image manifest to reuse between runs")
+    parser.add_argument("--batch-augment", action="store_true", help="Augment collated uint8 batches")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the train/val split and shuffling")
+    parser.add_argument("--resume", action="store_true", help="Resume from the full-state checkpoint in output-dir")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="Epochs between full-state checkpoints")
+    add_performance_args(parser)
     args = parser.parse_args()
+    ctx = init_distributed(args.threads)
 
     data_dirs = [Path(path) for path in args.data_dirs]
     csv_path = Path(args.csv_path)
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    state_path = output_dir / "efficientnet_b2_pad_ufes_state.pth"
+    state = load_training_state(state_path, "cpu") if args.resume else None
+    if args.resume and state is None:
+        ctx.log(f"No training state at {state_path}; starting from scratch.")
+    # The split must match the interrupted run, so reuse its seed
+    seed = state["seed"] if state is not None else args.seed
+    split_generator = torch.Generator().manual_seed(seed)
+
     high_labels = parse_labels(args.high_labels) or DEFAULT_HIGH
     medium_labels = parse_labels(args.medium_labels) or DEFAULT_MEDIUM
 
-    print("Indexing images...")
-    image_index = build_image_index(data_dirs)
-    print(f"Indexed {len(image_index)} images.")
-
-    print("Loading metadata...")
-    samples = load_metadata(csv_path, image_index, args.label_col, high_labels, medium_labels)
-    print(f"Loaded {len(samples)} samples.")
-
-    transform_train = transforms.Compose([
-        transforms.Resize((260, 260)),
-        transforms.RandomHorizontalFlip(),
-        transforms.RandomRotation(15),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-    ])
-    transform_val = transforms.Compose([
-        transforms.Resize((260, 260)),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-    ])
-
-    val_size = int(len(samples) * args.val_split)
-    train_size = len(samples) - val_size
-    train_samples, val_samples = random_split(samples, [train_size, val_size])
+    ctx.log("Indexing images...")
+    manifest_path = Path(args.manifest) if args.manifest else None
+    # Rank 0 refreshes the manifest first; the other ranks then find it up to date
+    with main_process_first(ctx):
+        image_index = build_image_index(data_dirs, manifest_path)
+        ctx.log(f"Indexed {len(image_index)} images.")
 
-    train_dataset = PadDataset(train_samples, transform_train)
-    val_dataset = PadDataset(val_samples, transform_val)
+        ctx.log("Loading metadata...")
+        samples = load_metadata(
+            csv_path, image_index, args.label_col, high_labels, medium_labels, manifest_path
+        )
+    ctx.log(f"Loaded {len(samples)} samples.")
 
-    print(f"Train size: {len(train_dataset)} | Val size: {len(val_dataset)}")
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=4)
-    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=4)
+    train_dataset, val_dataset = build_datasets(samples, args, split_generator, ctx)
+    ctx.log(f"Train size: {len(train_dataset)} | Val size: {len(val_dataset)}")
+    train_sampler = ResumableRandomSampler(len(train_dataset), seed, ctx.world_size, ctx.rank)
+    train_loader = DataLoader(
+        train_dataset, batch_size=args.batch_size, sampler=train_sampler, num_workers=args.num_workers
+    )
+    val_loader = DataLoader(validation_shard(val_dataset, ctx), batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Using device: {device}")
-    model = build_model(num_classes=3).to(device)
+    device = ctx.device
+    ctx.log(f"Using device: {device} | processes: {ctx.world_size}")
+    augment = BatchAugment(hflip=True, degrees=15).to(device) if args.batch_augment else None
+    with main_process_first(ctx):
+        model = build_model(num_classes=3).to(device)
     checkpoint = torch.load(args.checkpoint, map_location=device, weights_only=True)
     classifier_keys = {"classifier.1.weight", "classifier.1.bias"}
     filtered_checkpoint = {
         key: value for key, value in checkpoint.items() if key not in classifier_keys
     }
     missing, unexpected = model.load_state_dict(filtered_checkpoint, strict=False)
-    print(
+    ctx.log(
         f"Loaded checkpoint (excluding classifier). Missing: {len(missing)} | "
         f"Unexpected: {len(unexpected)}"
     )
@@ -242,42 +386,109 @@ def main():
         min_lr=1e-6,
     )
 
+    # Train through train_model; checkpoints are saved from the uncompiled model
+    train_model = prepare_model(model, args.channels_last, args.compile, ctx.enabled)
+    scaler = make_grad_scaler(device, args.amp)
+    if args.accum_steps > 1:
+        ctx.log(f"Effective batch size: {args.batch_size * args.accum_steps}")
+
     best_val_f1 = 0.0
     epochs_no_improve = 0
-    for epoch in range(1, args.epochs + 1):
-        train_loss, train_acc = train_one_epoch(model, train_loader, criterion, optimizer, device)
-        val_loss, val_acc, val_confusion = evaluate(model, val_loader, criterion, device)
-        high_precision, high_recall, high_f1 = high_risk_f1(val_confusion)
-        scheduler.step(high_f1)
-
-        print(
-            f"Epoch {epoch}/{args.epochs} | "
-            f"train_loss={train_loss:.4f} train_acc={train_acc:.4f} | "
-            f"val_loss={val_loss:.4f} val_acc={val_acc:.4f} | "
-            f"high_precision={high_precision:.4f} high_recall={high_recall:.4f} "
-            f"high_f1={high_f1:.4f}"
-        )
-        print("Confusion matrix (rows=actual, cols=pred):")
-        print(val_confusion.cpu().numpy())
-
-        if high_f1 > best_val_f1 + args.min_delta:
-            best_val_f1 = high_f1
-            epochs_no_improve = 0
-            checkpoint_path = output_dir / "efficientnet_b2_pad_ufes_best.pth"
-            torch.save(model.state_dict(), checkpoint_path)
-        else:
-            epochs_no_improve += 1
-
+    start_epoch, start_batch = 1, 0
+    if state is not None:
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+        scaler.load_state_dict(state["scaler"])
+        best_val_f1 = state["best_metric"]
+        epochs_no_improve = state["epochs_no_improve"]
+        start_epoch, start_batch = state["epoch"], state["batch"]
+        restore_rng_state(state["rng"][ctx.rank % len(state["rng"])])
+        if state["world_size"] != ctx.world_size and start_batch:
+            # Shards depend on the process count, so the mid-epoch position is meaningless
+            ctx.log(f"Process count changed from {state['world_size']}; restarting epoch {start_epoch}.")
+            start_batch = 0
+        ctx.log(f"Resumed from {state_path} at epoch {start_epoch}, batch {start_batch}.")
         if epochs_no_improve >= args.patience:
-            print(
-                f"Early stopping: no high_f1 improvement >= {args.min_delta} "
-                f"for {args.patience} epochs."
+            ctx.log("Resumed run had already early-stopped.")
+            start_epoch = args.epochs + 1
+
+    def save_state(epoch, batch):
+        # (epoch, batch) is the position to continue from. Collective: every
+        # rank contributes its RNG state and rank 0 writes the file.
+        snapshot = {
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict(),
+            "scaler": scaler.state_dict(),
+            "rng": gather_objects(capture_rng_state()),
+            "epoch": epoch,
+            "batch": batch,
+            "best_metric": best_val_f1,
+            "epochs_no_improve": epochs_no_improve,
+            "seed": seed,
+            "world_size": ctx.world_size,
+        }
+        if ctx.is_main:
+            save_training_state(state_path, snapshot)
+
+    with PreemptionHandler() as preemption:
+        for epoch in range(start_epoch, args.epochs + 1):
+            skip_batches = start_batch if epoch == start_epoch else 0
+            train_sampler.set_epoch(epoch, skip_batches * args.batch_size)
+            train_loss, train_acc, train_ips, batches = train_one_epoch(
+                train_model, train_loader, criterion, optimizer, device, augment,
+                args.amp, scaler, args.channels_last, args.accum_steps,
+                should_stop=lambda: any_rank(preemption.requested),
             )
-            break
+            if any_rank(preemption.requested):
+                save_state(epoch, skip_batches + batches)
+                ctx.log(f"Saved training state to {state_path}; rerun with --resume to continue.")
+                return
+
+            val_loss, val_acc, val_confusion = evaluate(
+                train_model, val_loader, criterion, device, augment, args.amp, args.channels_last
+            )
+            high_precision, high_recall, high_f1 = high_risk_f1(val_confusion)
+            scheduler.step(high_f1)
+
+            ctx.log(
+                f"Epoch {epoch}/{args.epochs} | "
+                f"train_loss={train_loss:.4f} train_acc={train_acc:.4f} "
+                f"train_throughput={train_ips:.1f} img/s | "
+                f"val_loss={val_loss:.4f} val_acc={val_acc:.4f} | "
+                f"high_precision={high_precision:.4f} high_recall={high_recall:.4f} "
+                f"high_f1={high_f1:.4f}"
+            )
+            ctx.log("Confusion matrix (rows=actual, cols=pred):")
+            ctx.log(val_confusion.cpu().numpy())
+
+            if high_f1 > best_val_f1 + args.min_delta:
+                best_val_f1 = high_f1
+                epochs_no_improve = 0
+                if ctx.is_main:
+                    torch.save(model.state_dict(), output_dir / "efficientnet_b2_pad_ufes_best.pth")
+            else:
+                epochs_no_improve += 1
+
+            stopping = epochs_no_improve >= args.patience
+            if epoch % args.checkpoint_every == 0 or epoch == args.epochs or stopping:
+                save_state(epoch + 1, 0)
+
+            if stopping:
+                ctx.log(
+                    f"Early stopping: no high_f1 improvement >= {args.min_delta} "
+                    f"for {args.patience} epochs."
+                )
+                break
 
     final_path = output_dir / "efficientnet_b2_pad_ufes_last.pth"
-    torch.save(model.state_dict(), final_path)
+    if ctx.is_main:
+        torch.save(model.state_dict(), final_path)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        cleanup_distributed()
@@ -0,0 +1,140 @@
+"""Persistent image manifest for the PAD-UFES / HAM10000 loaders.
+
+A small SQLite file records every image under the data folders (path,
+size, mtime and optionally the CSV label) plus the mtime of every
+directory seen. `refresh` only lists directories whose mtime changed since
+the last run, so on a network filesystem a warm start costs one stat per
+directory instead of a full `rglob`. Files edited in place without a
+directory change are not re-stat'ed; pass `full=True` to force a rescan.
+"""
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    label TEXT
+);
+CREATE INDEX IF NOT EXISTS images_dir ON images (dir);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+"""
+
+
+def _subtree_pattern(directory: str) -> str:
+    """LIKE pattern (with ESCAPE '\\') for every path below `directory`; `_` and `%` in names match literally."""
+    prefix = directory.rstrip(os.sep) + os.sep
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+class ImageManifest:
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        # LIKE ignores ASCII case by default, so /data/imgs/% would also match /data/Imgs/...
+        self.conn.execute("PRAGMA case_sensitive_like = ON")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def refresh(self, roots: Iterable[Path], full: bool = False) -> Tuple[int, int]:
+        """Revalidate the manifest under `roots`. Returns (rescanned, skipped) directory counts."""
+        known = dict(self.conn.execute("SELECT path, mtime_ns FROM dirs"))
+        rescanned = skipped = 0
+        stack = [(str(Path(root).resolve()), None) for root in roots]
+        with self.conn:
+            while stack:
+                directory, parent = stack.pop()
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except FileNotFoundError:
+                    self._forget(directory)
+                    continue
+
+                if not full and known.get(directory) == mtime_ns:
+                    skipped += 1
+                    children = self.conn.execute("SELECT path FROM dirs WHERE parent = ?", (directory,))
+                    stack.extend((child, directory) for (child,) in children)
+                    continue
+
+                rescanned += 1
+                stack.extend((child, directory) for child in self._rescan(directory))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                    (directory, parent, mtime_ns),
+                )
+        return rescanned, skipped
+
+    def _rescan(self, directory: str) -> List[str]:
+        labels = dict(self.conn.execute("SELECT path, label FROM images WHERE dir = ?", (directory,)))
+        rows, subdirs = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_SUFFIXES:
+                    stat = entry.stat()
+                    rows.append((entry.path, directory, entry.name, stat.st_size, stat.st_mtime_ns,
+                                 labels.get(entry.path)))
+        self.conn.execute("DELETE FROM images WHERE dir = ?", (directory,))
+        self.conn.executemany(
+            "INSERT INTO images (path, dir, name, size, mtime_ns, label) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        # Drop subdirectories that disappeared since the last scan
+        recorded = [p for (p,) in self.conn.execute("SELECT path FROM dirs WHERE parent = ?", (directory,))]
+        for gone in set(recorded) - set(subdirs):
+            self._forget(gone)
+        return subdirs
+
+    def _forget(self, directory: str) -> None:
+        pattern = _subtree_pattern(directory)
+        self.conn.execute("DELETE FROM images WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (directory, pattern))
+        self.conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (directory, pattern))
+
+    def index_by_name(self, roots: Iterable[Path]) -> Dict[str, Path]:
+        """Image file name -> path for everything under `roots`, like build_image_index."""
+        index = {}
+        for root in roots:
+            root = str(Path(root).resolve())
+            rows = self.conn.execute(
+                "SELECT name, path FROM images WHERE dir = ? OR dir LIKE ? ESCAPE '\\' ORDER BY path",
+                (root, _subtree_pattern(root)),
+            )
+            index.update((name, Path(path)) for name, path in rows)
+        return index
+
+    def set_labels(self, labels: Dict[Path, str]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE images SET label = ? WHERE path = ?",
+                ((label, str(Path(path).resolve())) for path, label in labels.items()),
+            )
+
+
+def load_image_index(manifest_path: Path, roots: List[Path]) -> Dict[str, Path]:
+    with ImageManifest(manifest_path) as manifest:
+        rescanned, skipped = manifest.refresh(roots)
+        print(f"Manifest {manifest_path}: rescanned {rescanned} dirs, {skipped} unchanged.")
+        return manifest.index_by_name(roots)
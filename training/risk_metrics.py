@@ -0,0 +1,80 @@
+"""Confusion-matrix accumulation and per-class metrics for the risk classifiers.
+
+Confusion matrices are built with one `bincount` over `target * C + pred`
+per batch, on whatever device the predictions live on, and all metrics are
+derived from the matrix with array ops. Undefined ratios (no predictions or
+no support for a class) are reported as 0.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+import torch
+
+HIGH_RISK_INDEX = 2
+
+
+def confusion_matrix(targets, preds, num_classes: int) -> torch.Tensor:
+    """[num_classes, num_classes] int64 counts, rows = actual, cols = predicted."""
+    targets = torch.as_tensor(targets).reshape(-1).long()
+    preds = torch.as_tensor(preds, device=targets.device).reshape(-1).long()
+    counts = torch.bincount(targets * num_classes + preds, minlength=num_classes * num_classes)
+    return counts.view(num_classes, num_classes)
+
+
+class ConfusionMatrix:
+    """Accumulates batches without leaving the predictions' device until `.matrix` is read."""
+
+    def __init__(self, num_classes: int):
+        self.num_classes = num_classes
+        self._counts = None
+
+    def update(self, targets, preds) -> None:
+        batch = confusion_matrix(targets, preds, self.num_classes)
+        self._counts = batch if self._counts is None else self._counts + batch
+
+    @property
+    def matrix(self) -> torch.Tensor:
+        if self._counts is None:
+            return torch.zeros((self.num_classes, self.num_classes), dtype=torch.int64)
+        return self._counts.cpu()
+
+
+def _ratio(numerator, denominator) -> np.ndarray:
+    numerator, denominator = np.broadcast_arrays(
+        np.asarray(numerator, dtype=np.float64), np.asarray(denominator, dtype=np.float64)
+    )
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator > 0)
+
+
+def per_class_metrics(confusion) -> Dict[str, np.ndarray]:
+    """Precision, recall, F1 and support per class, each a length-C array.
+
+    Also accepts a stack of matrices [..., C, C] (e.g. one per calibration
+    grid point); the results then have shape [..., C].
+    """
+    cm = np.asarray(confusion, dtype=np.float64)
+    tp = np.diagonal(cm, axis1=-2, axis2=-1)
+    predicted = cm.sum(axis=-2)
+    support = cm.sum(axis=-1)
+    precision = _ratio(tp, predicted)
+    recall = _ratio(tp, support)
+    f1 = _ratio(2 * precision * recall, precision + recall)
+    return {"precision": precision, "recall": recall, "f1": f1, "support": support.astype(np.int64)}
+
+
+def accuracy(confusion):
+    """Accuracy of one matrix (float) or of a stack [..., C, C] (array)."""
+    cm = np.asarray(confusion, dtype=np.float64)
+    correct = np.trace(cm, axis1=-2, axis2=-1)
+    result = _ratio(correct, cm.sum(axis=(-2, -1)))
+    return float(result) if result.ndim == 0 else result
+
+
+def high_risk_f1(confusion, high_index: int = HIGH_RISK_INDEX) -> Tuple[float, float, float]:
+    """(precision, recall, F1) of the high-risk class."""
+    metrics = per_class_metrics(confusion)
+    return (
+        float(metrics["precision"][..., high_index]),
+        float(metrics["recall"][..., high_index]),
+        float(metrics["f1"][..., high_index]),
+    )
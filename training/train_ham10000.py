@@ -1,9 +1,10 @@
 import argparse
 import csv
+import time
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -11,6 +12,28 @@ from torch.utils.data import DataLoader, Dataset, random_split
 from torchvision import models, transforms
 from PIL import Image
 
+from batch_augment import BatchAugment
+from checkpointing import (
+    PreemptionHandler,
+    ResumableRandomSampler,
+    capture_rng_state,
+    load_training_state,
+    restore_rng_state,
+    save_training_state,
+)
+from dataset_cache import CACHE_SIZE, CachedImageDataset, load_or_build_cache
+from distributed import (
+    all_reduce_sum,
+    any_rank,
+    cleanup_distributed,
+    gather_objects,
+    init_distributed,
+    main_process_first,
+    validation_shard,
+)
+from image_manifest import ImageManifest, load_image_index
+from train_utils import add_performance_args, autocast, make_grad_scaler, prepare_model, sync_gradients
+
 HAM_LABELS = ["akiec", "bcc", "bkl", "df", "mel", "nv", "vasc"]
 LABEL_TO_INDEX = {label: idx for idx, label in enumerate(HAM_LABELS)}
 
@@ -34,8 +57,11 @@ def find_image_dir(root: Path) -> Path:
     raise FileNotFoundError("Could not find an images folder inside HAM10000 root.")
 
 
-def load_metadata(csv_path: Path, image_dir: Path) -> List[Sample]:
+def load_metadata(csv_path: Path, image_dir: Path, manifest_path: Optional[Path] = None) -> List[Sample]:
     samples: List[Sample] = []
+    # With a manifest, existence checks are dictionary lookups instead of one stat per row
+    available = load_image_index(manifest_path, [image_dir]) if manifest_path else None
+    raw_labels = {}
     with csv_path.open("r", newline="") as handle:
         reader = csv.DictReader(handle)
         for row in reader:
@@ -45,11 +71,20 @@ def load_metadata(csv_path: Path, image_dir: Path) -> List[Sample]:
                 continue
             if label not in LABEL_TO_INDEX:
                 continue
-            image_path = image_dir / f"{image_id}.jpg"
-            if image_path.exists():
+            if available is not None:
+                image_path = available.get(f"{image_id}.jpg")
+            else:
+                image_path = image_dir / f"{image_id}.jpg"
+                if not image_path.exists():
+                    image_path = None
+            if image_path is not None:
                 samples.append(Sample(image_path=image_path, label=LABEL_TO_INDEX[label]))
+                raw_labels[image_path] = label
     if not samples:
         raise ValueError("No training samples found. Check CSV columns and image paths.")
+    if manifest_path:
+        with ImageManifest(manifest_path) as manifest:
+            manifest.set_labels(raw_labels)
     return samples
 
 
@@ -75,30 +110,66 @@ def build_model(num_classes: int) -> nn.Module:
     return model
 
 
-def train_one_epoch(model, loader, criterion, optimizer, device):
+def train_one_epoch(
+    model,
+    loader,
+    criterion,
+    optimizer,
+    device,
+    augment=None,
+    amp="off",
+    scaler=None,
+    channels_last=False,
+    accum_steps=1,
+    should_stop=None,
+):
     model.train()
     running_loss = 0.0
     correct = 0
     total = 0
-    for images, labels in loader:
+    scaler = scaler or make_grad_scaler(device, amp)
+    start = time.perf_counter()
+    optimizer.zero_grad()
+    batches = 0
+    for step, (images, labels) in enumerate(loader, start=1):
         images = images.to(device)
         labels = labels.to(device)
-
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
+        if augment is not None:
+            images = augment(images)
+        if channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+
+        stepping = step % accum_steps == 0 or step == len(loader)
+        with sync_gradients(model, stepping):
+            with autocast(device, amp):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+            scaler.scale(loss / accum_steps).backward()
+        stop = False
+        if stepping:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad()
+            # Only stop on an optimizer-step boundary so no accumulated gradient is lost
+            stop = should_stop is not None and should_stop()
 
         running_loss += loss.item() * images.size(0)
         preds = outputs.argmax(dim=1)
         correct += (preds == labels).sum().item()
         total += labels.size(0)
+        batches = step
+        if stop:
+            break
 
-    return running_loss / total, correct / total
+    elapsed = time.perf_counter() - start
+    # Every rank reports global numbers, so logging and early stopping agree
+    running_loss, correct, total = all_reduce_sum(running_loss, correct, total)
+    total = max(total, 1)
+    images_per_sec = total / elapsed
+    return running_loss / total, correct / total, images_per_sec, batches
 
 
-def evaluate(model, loader, criterion, device):
+def evaluate(model, loader, criterion, device, augment=None, amp="off", channels_last=False):
     model.eval()
     running_loss = 0.0
     correct = 0
@@ -107,14 +178,20 @@ def evaluate(model, loader, criterion, device):
         for images, labels in loader:
             images = images.to(device)
             labels = labels.to(device)
-            outputs = model(images)
-            loss = criterion(outputs, labels)
+            if augment is not None:
+                images = augment.normalize(images)
+            if channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
+            with autocast(device, amp):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
 
             running_loss += loss.item() * images.size(0)
             preds = outputs.argmax(dim=1)
             correct += (preds == labels).sum().item()
             total += labels.size(0)
 
+    running_loss, correct, total = all_reduce_sum(running_loss, correct, total)
     return running_loss / total, correct / total
 
 
@@ -127,17 +204,35 @@ def main():
     parser.add_argument("--batch-size", type=int, default=32)
     parser.add_argument("--lr", type=float, default=3e-4)
     parser.add_argument("--val-split", type=float, default=0.15)
+    parser.add_argument("--cache-dir", default=None, help="Use a decoded memmap image cache stored here")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Rebuild the image cache")
+    parser.add_argument("--manifest", default=None, help="SQLite image manifest to reuse between runs")
+    parser.add_argument("--batch-augment", action="store_true", help="Augment collated uint8 batches")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the train/val split and shuffling")
+    parser.add_argument("--resume", action="store_true", help="Resume from the full-state checkpoint in output-dir")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="Epochs between full-state checkpoints")
+    add_performance_args(parser)
     args = parser.parse_args()
+    ctx = init_distributed(args.threads)
 
     data_root = Path(args.data_root)
     csv_path = Path(args.csv_path)
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    print("Loading dataset...")
+    state_path = output_dir / "efficientnet_b2_ham10000_state.pth"
+    state = load_training_state(state_path, "cpu") if args.resume else None
+    if args.resume and state is None:
+        ctx.log(f"No training state at {state_path}; starting from scratch.")
+    # The split must match the interrupted run, so reuse its seed
+    seed = state["seed"] if state is not None else args.seed
+    split_generator = torch.Generator().manual_seed(seed)
+
+    ctx.log("Loading dataset...")
     image_dir = find_image_dir(data_root)
-    samples = load_metadata(csv_path, image_dir)
-    print(f"Found {len(samples)} samples in {image_dir}.")
+    with main_process_first(ctx):
+        samples = load_metadata(csv_path, image_dir, Path(args.manifest) if args.manifest else None)
+    ctx.log(f"Found {len(samples)} samples in {image_dir}.")
 
     transform_train = transforms.Compose([
         transforms.Resize((260, 260)),
@@ -153,43 +248,141 @@ def main():
         transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
     ])
 
+    if args.batch_augment:
+        # Datasets yield resized uint8; flips, rotation and normalization run per batch
+        transform_train = transform_val = transforms.Compose([
+            transforms.Resize((260, 260)),
+            transforms.PILToTensor(),
+        ])
+
     val_size = int(len(samples) * args.val_split)
     train_size = len(samples) - val_size
-    train_samples, val_samples = random_split(samples, [train_size, val_size])
-
-    train_dataset = HamDataset(train_samples, transform_train)
-    val_dataset = HamDataset(val_samples, transform_val)
-
-    print(f"Train size: {len(train_dataset)} | Val size: {len(val_dataset)}")
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=4)
-    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=4)
-
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Using device: {device}")
-    model = build_model(num_classes=len(HAM_LABELS)).to(device)
-    print("Model initialized. Starting training...")
+    if args.cache_dir:
+        # Images are already decoded and resized; only tensor augmentations remain
+        with main_process_first(ctx):
+            cache = load_or_build_cache(
+                [s.image_path for s in samples],
+                Path(args.cache_dir) / f"ham10000_{CACHE_SIZE}",
+                labels=[s.label for s in samples],
+                rebuild=args.rebuild_cache,
+                num_workers=args.num_workers,
+            )
+        items = list(zip(cache.rows_for([s.image_path for s in samples]), [s.label for s in samples]))
+        train_items, val_items = random_split(items, [train_size, val_size], generator=split_generator)
+        cached_train = transforms.Compose([
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomVerticalFlip(),
+            transforms.RandomRotation(15),
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ])
+        cached_val = transforms.Compose([
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ])
+        if args.batch_augment:
+            cached_train = cached_val = None
+        train_dataset = CachedImageDataset(cache, train_items, cached_train)
+        val_dataset = CachedImageDataset(cache, val_items, cached_val)
+    else:
+        train_samples, val_samples = random_split(samples, [train_size, val_size], generator=split_generator)
+        train_dataset = HamDataset(train_samples, transform_train)
+        val_dataset = HamDataset(val_samples, transform_val)
+
+    ctx.log(f"Train size: {len(train_dataset)} | Val size: {len(val_dataset)}")
+    train_sampler = ResumableRandomSampler(len(train_dataset), seed, ctx.world_size, ctx.rank)
+    train_loader = DataLoader(
+        train_dataset, batch_size=args.batch_size, sampler=train_sampler, num_workers=args.num_workers
+    )
+    val_loader = DataLoader(validation_shard(val_dataset, ctx), batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+
+    device = ctx.device
+    ctx.log(f"Using device: {device} | processes: {ctx.world_size}")
+    augment = BatchAugment(hflip=True, vflip=True, degrees=15).to(device) if args.batch_augment else None
+    with main_process_first(ctx):
+        model = build_model(num_classes=len(HAM_LABELS)).to(device)
+    ctx.log("Model initialized. Starting training...")
     criterion = nn.CrossEntropyLoss()
     optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
 
-    best_val_acc = 0.0
-    for epoch in range(1, args.epochs + 1):
-        train_loss, train_acc = train_one_epoch(model, train_loader, criterion, optimizer, device)
-        val_loss, val_acc = evaluate(model, val_loader, criterion, device)
+    # Train through train_model; checkpoints are saved from the uncompiled model
+    train_model = prepare_model(model, args.channels_last, args.compile, ctx.enabled)
+    scaler = make_grad_scaler(device, args.amp)
+    if args.accum_steps > 1:
+        ctx.log(f"Effective batch size: {args.batch_size * args.accum_steps}")
 
-        print(
-            f"Epoch {epoch}/{args.epochs} | "
-            f"train_loss={train_loss:.4f} train_acc={train_acc:.4f} | "
-            f"val_loss={val_loss:.4f} val_acc={val_acc:.4f}"
-        )
-
-        if val_acc > best_val_acc:
-            best_val_acc = val_acc
-            checkpoint_path = output_dir / "efficientnet_b2_ham10000_best.pth"
-            torch.save(model.state_dict(), checkpoint_path)
+    best_val_acc = 0.0
+    start_epoch, start_batch = 1, 0
+    if state is not None:
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scaler.load_state_dict(state["scaler"])
+        best_val_acc = state["best_metric"]
+        start_epoch, start_batch = state["epoch"], state["batch"]
+        restore_rng_state(state["rng"][ctx.rank % len(state["rng"])])
+        if state["world_size"] != ctx.world_size and start_batch:
+            # Shards depend on the process count, so the mid-epoch position is meaningless
+            ctx.log(f"Process count changed from {state['world_size']}; restarting epoch {start_epoch}.")
+            start_batch = 0
+        ctx.log(f"Resumed from {state_path} at epoch {start_epoch}, batch {start_batch}.")
+
+    def save_state(epoch, batch):
+        # (epoch, batch) is the position to continue from. Collective: every
+        # rank contributes its RNG state and rank 0 writes the file.
+        snapshot = {
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scaler": scaler.state_dict(),
+            "rng": gather_objects(capture_rng_state()),
+            "epoch": epoch,
+            "batch": batch,
+            "best_metric": best_val_acc,
+            "seed": seed,
+            "world_size": ctx.world_size,
+        }
+        if ctx.is_main:
+            save_training_state(state_path, snapshot)
+
+    with PreemptionHandler() as preemption:
+        for epoch in range(start_epoch, args.epochs + 1):
+            skip_batches = start_batch if epoch == start_epoch else 0
+            train_sampler.set_epoch(epoch, skip_batches * args.batch_size)
+            train_loss, train_acc, train_ips, batches = train_one_epoch(
+                train_model, train_loader, criterion, optimizer, device, augment,
+                args.amp, scaler, args.channels_last, args.accum_steps,
+                should_stop=lambda: any_rank(preemption.requested),
+            )
+            if any_rank(preemption.requested):
+                save_state(epoch, skip_batches + batches)
+                ctx.log(f"Saved training state to {state_path}; rerun with --resume to continue.")
+                return
+
+            val_loss, val_acc = evaluate(
+                train_model, val_loader, criterion, device, augment, args.amp, args.channels_last
+            )
+
+            ctx.log(
+                f"Epoch {epoch}/{args.epochs} | "
+                f"train_loss={train_loss:.4f} train_acc={train_acc:.4f} "
+                f"train_throughput={train_ips:.1f} img/s | "
+                f"val_loss={val_loss:.4f} val_acc={val_acc:.4f}"
+            )
+
+            if val_acc > best_val_acc:
+                best_val_acc = val_acc
+                if ctx.is_main:
+                    torch.save(model.state_dict(), output_dir / "efficientnet_b2_ham10000_best.pth")
+
+            if epoch % args.checkpoint_every == 0 or epoch == args.epochs:
+                save_state(epoch + 1, 0)
 
     final_path = output_dir / "efficientnet_b2_ham10000_last.pth"
-    torch.save(model.state_dict(), final_path)
+    if ctx.is_main:
+        torch.save(model.state_dict(), final_path)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        cleanup_distributed()
@@ -0,0 +1,58 @@
+"""Precision and memory-format helpers shared by the training scripts."""
+from contextlib import nullcontext
+
+import torch
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+
+AMP_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+AMP_CHOICES = ["off", *AMP_DTYPES]
+
+
+def add_performance_args(parser) -> None:
+    parser.add_argument("--amp", choices=AMP_CHOICES, default="off",
+                        help="Autocast dtype (bf16 works on CPU; fp16 uses a GradScaler)")
+    parser.add_argument("--channels-last", action="store_true", help="Use channels_last memory format")
+    parser.add_argument("--compile", action="store_true", help="Wrap the model with torch.compile")
+    parser.add_argument("--accum-steps", type=int, default=1,
+                        help="Micro-batches per optimizer step (effective batch = batch-size * accum-steps)")
+    parser.add_argument("--num-workers", type=int, default=4, help="DataLoader worker processes per rank")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Torch threads per process (default under torchrun: cores / local processes)")
+
+
+def autocast(device, amp: str):
+    if amp == "off":
+        return nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=AMP_DTYPES[amp])
+
+
+def sync_gradients(model: nn.Module, sync: bool):
+    """Skip DDP's gradient all-reduce on micro-batches that do not end in an optimizer step."""
+    ddp = getattr(model, "_orig_mod", model)
+    if sync or not isinstance(ddp, DistributedDataParallel):
+        return nullcontext()
+    return ddp.no_sync()
+
+
+def make_grad_scaler(device, amp: str):
+    # Disabled scalers are pass-throughs, so the loop needs no branches
+    return torch.amp.GradScaler(torch.device(device).type, enabled=(amp == "fp16"))
+
+
+def prepare_model(
+    model: nn.Module, channels_last: bool = False, compile_model: bool = False, distributed: bool = False
+) -> nn.Module:
+    """Return the module to run forward passes on.
+
+    Checkpoints should still be saved from the original `model`, since
+    torch.compile prefixes state_dict keys with `_orig_mod.` and
+    DistributedDataParallel with `module.`.
+    """
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    if distributed:
+        model = DistributedDataParallel(model)
+    if compile_model:
+        return torch.compile(model)
+    return model